@@ -1,69 +1,1395 @@
 '''
 SQLite DB Access - Developer: Koen Aerts
 '''
+import datetime
+import math
+import os
 import sqlite3
+import struct
+import threading
+import time
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+from enums import MotorStatus
+from mercator import project
 
 class Db():
 
+    statementCacheSize = 256 # Prepared statements kept per connection.
+    launchSiteRadiusKm = 0.15 # Flights with home points this close together take off from the same launch site.
+    maxQueryParams = 500 # Values bound per IN (...) list, older SQLite versions allow 999 parameters per statement.
+    earthRadiusKm = 6371
+
+    '''
+    Fill the summary tables from the detail tables. The summary triggers take care of the daily and model totals.
+    '''
+    summaryPopulate = [
+        "INSERT INTO model_summary(modelref) SELECT modelref FROM models",
+        """
+        INSERT INTO import_summary(importref, modelref, dateref, flights, duration, max_duration, max_distance, max_altitude, max_h_speed, max_v_speed, traveled)
+            SELECT i.importref, i.modelref, i.dateref, count(s.flight_number), sum(duration), max(duration), max(max_distance), max(max_altitude), max(max_h_speed), max(max_v_speed), sum(traveled)
+            FROM imports i
+            LEFT OUTER JOIN flight_stats s ON s.importref = i.importref
+            GROUP BY i.importref
+        """
+    ]
+
+    '''
+    Schema migrations, applied in order. Each step is committed together with its schema_version record. Statements
+    must be idempotent, DBs created before schema_version existed already contain (part of) the schema.
+    '''
+    migrations = [
+        (1, "Base schema", [
+            """
+                CREATE TABLE IF NOT EXISTS models(
+                    modelref TEXT PRIMARY KEY
+                )
+            """,
+            """
+                CREATE TABLE IF NOT EXISTS imports(
+                    importref TEXT PRIMARY KEY,
+                    modelref TEXT NOT NULL,
+                    dateref TEXT NOT NULL,
+                    importedon TEXT NOT NULL,
+                    FOREIGN KEY (modelref) REFERENCES models(modelref) ON DELETE CASCADE ON UPDATE NO ACTION
+                )
+            """,
+            """
+                CREATE TABLE IF NOT EXISTS log_files(
+                    filename TEXT PRIMARY KEY,
+                    importref TEXT NOT NULL,
+                    bintype TEXT NOT NULL,
+                    FOREIGN KEY (importref) REFERENCES imports(importref) ON DELETE CASCADE ON UPDATE NO ACTION
+                )
+            """,
+            """
+                CREATE TABLE IF NOT EXISTS flight_stats(
+                    importref TEXT NOT NULL,
+                    flight_number INTEGER NOT NULL,
+                    duration INTEGER NOT NULL,
+                    max_distance REAL NOT NULL,
+                    max_altitude REAL NOT NULL,
+                    max_h_speed REAL NOT NULL,
+                    max_v_speed REAL NOT NULL,
+                    traveled REAL NOT NULL,
+                    FOREIGN KEY (importref) REFERENCES imports(importref) ON DELETE CASCADE ON UPDATE NO ACTION
+                )
+            """,
+            "CREATE INDEX IF NOT EXISTS flight_stats_index ON flight_stats(importref)",
+            """
+                CREATE TABLE IF NOT EXISTS log_file_meta(
+                    filename TEXT PRIMARY KEY,
+                    filesize INTEGER NOT NULL,
+                    records INTEGER NOT NULL,
+                    invalid_records INTEGER NOT NULL,
+                    tail_bytes INTEGER NOT NULL,
+                    layout TEXT,
+                    fpv_platform TEXT,
+                    first_ts TEXT,
+                    last_ts TEXT,
+                    FOREIGN KEY (filename) REFERENCES log_files(filename) ON DELETE CASCADE ON UPDATE NO ACTION
+                )
+            """,
+            """
+                CREATE TABLE IF NOT EXISTS import_journal(
+                    importref TEXT PRIMARY KEY,
+                    modelref TEXT NOT NULL,
+                    sourcefile TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    updatedon TEXT NOT NULL
+                )
+            """
+        ]),
+        (2, "Covering indexes for the log file list and the parser lookups", [
+            "CREATE INDEX IF NOT EXISTS imports_model_index ON imports(modelref, dateref, importref)",
+            "CREATE INDEX IF NOT EXISTS log_files_import_index ON log_files(importref, bintype, filename)"
+        ]),
+        (3, "Remove rows that violate foreign keys, which were not enforced before", [
+            "DELETE FROM imports WHERE modelref NOT IN (SELECT modelref FROM models)",
+            "DELETE FROM flight_stats WHERE importref NOT IN (SELECT importref FROM imports)",
+            "DELETE FROM log_files WHERE importref NOT IN (SELECT importref FROM imports)",
+            "DELETE FROM log_file_meta WHERE filename NOT IN (SELECT filename FROM log_files)"
+        ]),
+        (4, "Import, daily and model summary tables, maintained by triggers", [
+            """
+            CREATE TABLE IF NOT EXISTS import_summary(
+                importref TEXT PRIMARY KEY,
+                modelref TEXT NOT NULL,
+                dateref TEXT NOT NULL,
+                flights INTEGER NOT NULL DEFAULT 0,
+                duration INTEGER,
+                max_duration INTEGER,
+                max_distance REAL,
+                max_altitude REAL,
+                max_h_speed REAL,
+                max_v_speed REAL,
+                traveled REAL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS import_summary_model_index ON import_summary(modelref, dateref, importref)",
+            """
+            CREATE TABLE IF NOT EXISTS daily_summary(
+                modelref TEXT NOT NULL,
+                dateref TEXT NOT NULL,
+                imports INTEGER NOT NULL,
+                flights INTEGER NOT NULL DEFAULT 0,
+                duration INTEGER,
+                max_duration INTEGER,
+                max_distance REAL,
+                max_altitude REAL,
+                max_h_speed REAL,
+                max_v_speed REAL,
+                traveled REAL,
+                PRIMARY KEY (modelref, dateref)
+            ) WITHOUT ROWID
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS model_summary(
+                modelref TEXT PRIMARY KEY,
+                imports INTEGER NOT NULL DEFAULT 0,
+                flights INTEGER NOT NULL DEFAULT 0,
+                duration INTEGER NOT NULL DEFAULT 0,
+                max_duration INTEGER,
+                max_distance REAL,
+                max_altitude REAL,
+                max_h_speed REAL,
+                max_v_speed REAL,
+                traveled REAL NOT NULL DEFAULT 0
+            )
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS models_summary_insert AFTER INSERT ON models BEGIN
+                INSERT INTO model_summary(modelref) VALUES(new.modelref);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS models_summary_delete AFTER DELETE ON models BEGIN
+                DELETE FROM model_summary WHERE modelref = old.modelref;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS imports_summary_insert AFTER INSERT ON imports BEGIN
+                INSERT INTO import_summary(importref, modelref, dateref) VALUES(new.importref, new.modelref, new.dateref);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS imports_summary_delete AFTER DELETE ON imports BEGIN
+                DELETE FROM import_summary WHERE importref = old.importref;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS flight_stats_summary_insert AFTER INSERT ON flight_stats BEGIN
+                UPDATE import_summary SET
+                    flights = flights + 1,
+                    duration = coalesce(duration, 0) + new.duration,
+                    max_duration = coalesce(max(max_duration, new.duration), new.duration),
+                    max_distance = coalesce(max(max_distance, new.max_distance), new.max_distance),
+                    max_altitude = coalesce(max(max_altitude, new.max_altitude), new.max_altitude),
+                    max_h_speed = coalesce(max(max_h_speed, new.max_h_speed), new.max_h_speed),
+                    max_v_speed = coalesce(max(max_v_speed, new.max_v_speed), new.max_v_speed),
+                    traveled = coalesce(traveled, 0) + new.traveled
+                WHERE importref = new.importref;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS flight_stats_summary_delete AFTER DELETE ON flight_stats BEGIN
+                UPDATE import_summary SET (flights, duration, max_duration, max_distance, max_altitude, max_h_speed, max_v_speed, traveled) = (
+                    SELECT count(1), sum(duration), max(duration), max(max_distance), max(max_altitude), max(max_h_speed), max(max_v_speed), sum(traveled)
+                    FROM flight_stats WHERE importref = old.importref
+                ) WHERE importref = old.importref;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS import_summary_insert AFTER INSERT ON import_summary BEGIN
+                DELETE FROM daily_summary WHERE modelref = new.modelref AND dateref = new.dateref;
+                INSERT INTO daily_summary(modelref, dateref, imports, flights, duration, max_duration, max_distance, max_altitude, max_h_speed, max_v_speed, traveled)
+                    SELECT modelref, dateref, count(1), sum(flights), sum(duration), max(max_duration), max(max_distance), max(max_altitude), max(max_h_speed), max(max_v_speed), sum(traveled)
+                    FROM import_summary WHERE modelref = new.modelref AND dateref = new.dateref
+                    GROUP BY modelref, dateref;
+                UPDATE model_summary SET
+                    imports = imports + 1,
+                    flights = flights + new.flights,
+                    duration = duration + coalesce(new.duration, 0),
+                    traveled = traveled + coalesce(new.traveled, 0),
+                    max_duration = coalesce(max(max_duration, new.max_duration), max_duration, new.max_duration),
+                    max_distance = coalesce(max(max_distance, new.max_distance), max_distance, new.max_distance),
+                    max_altitude = coalesce(max(max_altitude, new.max_altitude), max_altitude, new.max_altitude),
+                    max_h_speed = coalesce(max(max_h_speed, new.max_h_speed), max_h_speed, new.max_h_speed),
+                    max_v_speed = coalesce(max(max_v_speed, new.max_v_speed), max_v_speed, new.max_v_speed)
+                WHERE modelref = new.modelref;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS import_summary_update AFTER UPDATE ON import_summary BEGIN
+                DELETE FROM daily_summary WHERE modelref = new.modelref AND dateref = new.dateref;
+                INSERT INTO daily_summary(modelref, dateref, imports, flights, duration, max_duration, max_distance, max_altitude, max_h_speed, max_v_speed, traveled)
+                    SELECT modelref, dateref, count(1), sum(flights), sum(duration), max(max_duration), max(max_distance), max(max_altitude), max(max_h_speed), max(max_v_speed), sum(traveled)
+                    FROM import_summary WHERE modelref = new.modelref AND dateref = new.dateref
+                    GROUP BY modelref, dateref;
+                UPDATE model_summary SET
+                    flights = flights + new.flights - old.flights,
+                    duration = duration + coalesce(new.duration, 0) - coalesce(old.duration, 0),
+                    traveled = traveled + coalesce(new.traveled, 0) - coalesce(old.traveled, 0),
+                    max_duration = CASE WHEN old.max_duration IS NULL OR old.max_duration < max_duration THEN coalesce(max(max_duration, new.max_duration), max_duration, new.max_duration) ELSE (SELECT max(max_duration) FROM daily_summary WHERE modelref = new.modelref) END,
+                    max_distance = CASE WHEN old.max_distance IS NULL OR old.max_distance < max_distance THEN coalesce(max(max_distance, new.max_distance), max_distance, new.max_distance) ELSE (SELECT max(max_distance) FROM daily_summary WHERE modelref = new.modelref) END,
+                    max_altitude = CASE WHEN old.max_altitude IS NULL OR old.max_altitude < max_altitude THEN coalesce(max(max_altitude, new.max_altitude), max_altitude, new.max_altitude) ELSE (SELECT max(max_altitude) FROM daily_summary WHERE modelref = new.modelref) END,
+                    max_h_speed = CASE WHEN old.max_h_speed IS NULL OR old.max_h_speed < max_h_speed THEN coalesce(max(max_h_speed, new.max_h_speed), max_h_speed, new.max_h_speed) ELSE (SELECT max(max_h_speed) FROM daily_summary WHERE modelref = new.modelref) END,
+                    max_v_speed = CASE WHEN old.max_v_speed IS NULL OR old.max_v_speed < max_v_speed THEN coalesce(max(max_v_speed, new.max_v_speed), max_v_speed, new.max_v_speed) ELSE (SELECT max(max_v_speed) FROM daily_summary WHERE modelref = new.modelref) END
+                WHERE modelref = new.modelref;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS import_summary_delete AFTER DELETE ON import_summary BEGIN
+                DELETE FROM daily_summary WHERE modelref = old.modelref AND dateref = old.dateref;
+                INSERT INTO daily_summary(modelref, dateref, imports, flights, duration, max_duration, max_distance, max_altitude, max_h_speed, max_v_speed, traveled)
+                    SELECT modelref, dateref, count(1), sum(flights), sum(duration), max(max_duration), max(max_distance), max(max_altitude), max(max_h_speed), max(max_v_speed), sum(traveled)
+                    FROM import_summary WHERE modelref = old.modelref AND dateref = old.dateref
+                    GROUP BY modelref, dateref;
+                UPDATE model_summary SET
+                    imports = imports - 1,
+                    flights = flights - old.flights,
+                    duration = duration - coalesce(old.duration, 0),
+                    traveled = traveled - coalesce(old.traveled, 0),
+                    max_duration = CASE WHEN old.max_duration IS NULL OR old.max_duration < max_duration THEN max_duration ELSE (SELECT max(max_duration) FROM daily_summary WHERE modelref = old.modelref) END,
+                    max_distance = CASE WHEN old.max_distance IS NULL OR old.max_distance < max_distance THEN max_distance ELSE (SELECT max(max_distance) FROM daily_summary WHERE modelref = old.modelref) END,
+                    max_altitude = CASE WHEN old.max_altitude IS NULL OR old.max_altitude < max_altitude THEN max_altitude ELSE (SELECT max(max_altitude) FROM daily_summary WHERE modelref = old.modelref) END,
+                    max_h_speed = CASE WHEN old.max_h_speed IS NULL OR old.max_h_speed < max_h_speed THEN max_h_speed ELSE (SELECT max(max_h_speed) FROM daily_summary WHERE modelref = old.modelref) END,
+                    max_v_speed = CASE WHEN old.max_v_speed IS NULL OR old.max_v_speed < max_v_speed THEN max_v_speed ELSE (SELECT max(max_v_speed) FROM daily_summary WHERE modelref = old.modelref) END
+                WHERE modelref = old.modelref;
+            END
+            """
+        ] + summaryPopulate),
+        (5, "Flight bounding boxes with an R*Tree index", [
+            "ALTER TABLE flight_stats ADD COLUMN min_lat REAL",
+            "ALTER TABLE flight_stats ADD COLUMN min_lon REAL",
+            "ALTER TABLE flight_stats ADD COLUMN max_lat REAL",
+            "ALTER TABLE flight_stats ADD COLUMN max_lon REAL",
+            "CREATE VIRTUAL TABLE IF NOT EXISTS flight_bbox USING rtree(id, min_lat, max_lat, min_lon, max_lon)",
+            """
+            CREATE TRIGGER IF NOT EXISTS flight_stats_bbox_insert AFTER INSERT ON flight_stats WHEN new.min_lat IS NOT NULL BEGIN
+                INSERT INTO flight_bbox(id, min_lat, max_lat, min_lon, max_lon) VALUES(new.rowid, new.min_lat, new.max_lat, new.min_lon, new.max_lon);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS flight_stats_bbox_update AFTER UPDATE OF min_lat, min_lon, max_lat, max_lon ON flight_stats BEGIN
+                DELETE FROM flight_bbox WHERE id = old.rowid;
+                INSERT INTO flight_bbox(id, min_lat, max_lat, min_lon, max_lon)
+                    SELECT new.rowid, new.min_lat, new.max_lat, new.min_lon, new.max_lon WHERE new.min_lat IS NOT NULL;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS flight_stats_bbox_delete AFTER DELETE ON flight_stats BEGIN
+                DELETE FROM flight_bbox WHERE id = old.rowid;
+            END
+            """
+        ]),
+        (6, "Content hashes of log files", [
+            "ALTER TABLE log_file_meta ADD COLUMN content_hash TEXT",
+            "ALTER TABLE log_file_meta ADD COLUMN verified_on TEXT"
+        ]),
+        (7, "Heatmap grid", [
+            """
+            CREATE TABLE IF NOT EXISTS heatmap_bins(
+                importref TEXT NOT NULL,
+                modelref TEXT NOT NULL,
+                level INTEGER NOT NULL,
+                cell_x INTEGER NOT NULL,
+                cell_y INTEGER NOT NULL,
+                samples INTEGER NOT NULL,
+                rssi_sum INTEGER NOT NULL,
+                rssi_samples INTEGER NOT NULL,
+                min_satellites INTEGER,
+                max_altitude REAL,
+                PRIMARY KEY (importref, level, cell_x, cell_y),
+                FOREIGN KEY (importref) REFERENCES imports(importref) ON DELETE CASCADE ON UPDATE NO ACTION
+            ) WITHOUT ROWID
+            """,
+            "CREATE INDEX IF NOT EXISTS heatmap_bins_cell_index ON heatmap_bins(modelref, level, cell_x, cell_y)",
+            """
+            CREATE TABLE IF NOT EXISTS heatmap_grid(
+                modelref TEXT NOT NULL,
+                level INTEGER NOT NULL,
+                cell_x INTEGER NOT NULL,
+                cell_y INTEGER NOT NULL,
+                samples INTEGER NOT NULL,
+                rssi_sum INTEGER NOT NULL,
+                rssi_samples INTEGER NOT NULL,
+                min_satellites INTEGER,
+                max_altitude REAL,
+                PRIMARY KEY (modelref, level, cell_x, cell_y),
+                FOREIGN KEY (modelref) REFERENCES models(modelref) ON DELETE CASCADE ON UPDATE NO ACTION
+            ) WITHOUT ROWID
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS heatmap_bins_insert AFTER INSERT ON heatmap_bins BEGIN
+                INSERT INTO heatmap_grid(modelref, level, cell_x, cell_y, samples, rssi_sum, rssi_samples, min_satellites, max_altitude)
+                    VALUES(new.modelref, new.level, new.cell_x, new.cell_y, new.samples, new.rssi_sum, new.rssi_samples, new.min_satellites, new.max_altitude)
+                    ON CONFLICT(modelref, level, cell_x, cell_y) DO UPDATE SET
+                        samples = samples + excluded.samples,
+                        rssi_sum = rssi_sum + excluded.rssi_sum,
+                        rssi_samples = rssi_samples + excluded.rssi_samples,
+                        min_satellites = coalesce(min(min_satellites, excluded.min_satellites), min_satellites, excluded.min_satellites),
+                        max_altitude = coalesce(max(max_altitude, excluded.max_altitude), max_altitude, excluded.max_altitude);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS heatmap_bins_delete AFTER DELETE ON heatmap_bins BEGIN
+                UPDATE heatmap_grid SET
+                    samples = samples - old.samples,
+                    rssi_sum = rssi_sum - old.rssi_sum,
+                    rssi_samples = rssi_samples - old.rssi_samples,
+                    min_satellites = CASE WHEN old.min_satellites IS NULL OR old.min_satellites > min_satellites THEN min_satellites ELSE (
+                        SELECT min(min_satellites) FROM heatmap_bins WHERE modelref = old.modelref AND level = old.level AND cell_x = old.cell_x AND cell_y = old.cell_y
+                    ) END,
+                    max_altitude = CASE WHEN old.max_altitude IS NULL OR old.max_altitude < max_altitude THEN max_altitude ELSE (
+                        SELECT max(max_altitude) FROM heatmap_bins WHERE modelref = old.modelref AND level = old.level AND cell_x = old.cell_x AND cell_y = old.cell_y
+                    ) END
+                WHERE modelref = old.modelref AND level = old.level AND cell_x = old.cell_x AND cell_y = old.cell_y;
+                DELETE FROM heatmap_grid WHERE modelref = old.modelref AND level = old.level AND cell_x = old.cell_x AND cell_y = old.cell_y AND samples <= 0;
+            END
+            """
+        ]),
+        (8, "Simplified flight paths", [
+            """
+            CREATE TABLE IF NOT EXISTS flight_paths(
+                importref TEXT NOT NULL,
+                flight_number INTEGER NOT NULL,
+                detail INTEGER NOT NULL,
+                points INTEGER NOT NULL,
+                coords BLOB NOT NULL,
+                PRIMARY KEY (importref, flight_number, detail),
+                FOREIGN KEY (importref) REFERENCES imports(importref) ON DELETE CASCADE ON UPDATE NO ACTION
+            )
+            """
+        ]),
+        (9, "Launch sites", [
+            """
+            CREATE TABLE IF NOT EXISTS launch_sites(
+                site_id INTEGER PRIMARY KEY,
+                name TEXT,
+                lat REAL NOT NULL,
+                lon REAL NOT NULL,
+                flights INTEGER NOT NULL DEFAULT 0,
+                duration REAL NOT NULL DEFAULT 0,
+                last_flown TEXT
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS launch_sites_location_index ON launch_sites(lat, lon)",
+            "ALTER TABLE flight_stats ADD COLUMN home_lat REAL",
+            "ALTER TABLE flight_stats ADD COLUMN home_lon REAL",
+            "ALTER TABLE flight_stats ADD COLUMN site_id INTEGER",
+            "CREATE INDEX IF NOT EXISTS flight_stats_site_index ON flight_stats(site_id, importref)",
+            # The site location is the mean home point of its flights. Sites without flights are dropped, unless they were named.
+            """
+            CREATE TRIGGER IF NOT EXISTS flight_stats_site_update AFTER UPDATE OF site_id ON flight_stats BEGIN
+                UPDATE launch_sites SET
+                    flights = flights - 1,
+                    duration = duration - coalesce(old.duration, 0),
+                    lat = CASE WHEN flights > 1 THEN (lat * flights - old.home_lat) / (flights - 1) ELSE lat END,
+                    lon = CASE WHEN flights > 1 THEN (lon * flights - old.home_lon) / (flights - 1) ELSE lon END,
+                    last_flown = (SELECT max(i.dateref) FROM flight_stats s JOIN imports i ON i.importref = s.importref WHERE s.site_id = old.site_id)
+                WHERE site_id = old.site_id;
+                DELETE FROM launch_sites WHERE site_id = old.site_id AND flights <= 0 AND name IS NULL;
+                UPDATE launch_sites SET
+                    flights = flights + 1,
+                    duration = duration + coalesce(new.duration, 0),
+                    lat = (lat * flights + new.home_lat) / (flights + 1),
+                    lon = (lon * flights + new.home_lon) / (flights + 1),
+                    last_flown = (SELECT max(i.dateref) FROM flight_stats s JOIN imports i ON i.importref = s.importref WHERE s.site_id = new.site_id)
+                WHERE site_id = new.site_id;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS flight_stats_site_delete AFTER DELETE ON flight_stats WHEN old.site_id IS NOT NULL BEGIN
+                UPDATE launch_sites SET
+                    flights = flights - 1,
+                    duration = duration - coalesce(old.duration, 0),
+                    lat = CASE WHEN flights > 1 THEN (lat * flights - old.home_lat) / (flights - 1) ELSE lat END,
+                    lon = CASE WHEN flights > 1 THEN (lon * flights - old.home_lon) / (flights - 1) ELSE lon END,
+                    last_flown = (SELECT max(i.dateref) FROM flight_stats s JOIN imports i ON i.importref = s.importref WHERE s.site_id = old.site_id)
+                WHERE site_id = old.site_id;
+                DELETE FROM launch_sites WHERE site_id = old.site_id AND flights <= 0 AND name IS NULL;
+            END
+            """
+        ]),
+        (10, "Merge unchanged import maxima directly in the model summary, instead of recomputing them", [
+            "DROP TRIGGER IF EXISTS import_summary_update",
+            """
+            CREATE TRIGGER import_summary_update AFTER UPDATE ON import_summary BEGIN
+                DELETE FROM daily_summary WHERE modelref = new.modelref AND dateref = new.dateref;
+                INSERT INTO daily_summary(modelref, dateref, imports, flights, duration, max_duration, max_distance, max_altitude, max_h_speed, max_v_speed, traveled)
+                    SELECT modelref, dateref, count(1), sum(flights), sum(duration), max(max_duration), max(max_distance), max(max_altitude), max(max_h_speed), max(max_v_speed), sum(traveled)
+                    FROM import_summary WHERE modelref = new.modelref AND dateref = new.dateref
+                    GROUP BY modelref, dateref;
+                UPDATE model_summary SET
+                    flights = flights + new.flights - old.flights,
+                    duration = duration + coalesce(new.duration, 0) - coalesce(old.duration, 0),
+                    traveled = traveled + coalesce(new.traveled, 0) - coalesce(old.traveled, 0),
+                    max_duration = CASE WHEN old.max_duration IS NULL OR old.max_duration < max_duration OR new.max_duration >= old.max_duration THEN coalesce(max(max_duration, new.max_duration), max_duration, new.max_duration) ELSE (SELECT max(max_duration) FROM daily_summary WHERE modelref = new.modelref) END,
+                    max_distance = CASE WHEN old.max_distance IS NULL OR old.max_distance < max_distance OR new.max_distance >= old.max_distance THEN coalesce(max(max_distance, new.max_distance), max_distance, new.max_distance) ELSE (SELECT max(max_distance) FROM daily_summary WHERE modelref = new.modelref) END,
+                    max_altitude = CASE WHEN old.max_altitude IS NULL OR old.max_altitude < max_altitude OR new.max_altitude >= old.max_altitude THEN coalesce(max(max_altitude, new.max_altitude), max_altitude, new.max_altitude) ELSE (SELECT max(max_altitude) FROM daily_summary WHERE modelref = new.modelref) END,
+                    max_h_speed = CASE WHEN old.max_h_speed IS NULL OR old.max_h_speed < max_h_speed OR new.max_h_speed >= old.max_h_speed THEN coalesce(max(max_h_speed, new.max_h_speed), max_h_speed, new.max_h_speed) ELSE (SELECT max(max_h_speed) FROM daily_summary WHERE modelref = new.modelref) END,
+                    max_v_speed = CASE WHEN old.max_v_speed IS NULL OR old.max_v_speed < max_v_speed OR new.max_v_speed >= old.max_v_speed THEN coalesce(max(max_v_speed, new.max_v_speed), max_v_speed, new.max_v_speed) ELSE (SELECT max(max_v_speed) FROM daily_summary WHERE modelref = new.modelref) END
+                WHERE modelref = new.modelref;
+            END
+            """
+        ]),
+        # The implicit rowid of flight_stats, which the R*Tree and the flight caches refer to, can be renumbered by a
+        # VACUUM and reused after deletes. Rebuild the table with an explicit key that keeps the current ids.
+        (11, "Stable flight ids", [
+            """
+            CREATE TABLE IF NOT EXISTS flight_stats_new(
+                flight_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                importref TEXT NOT NULL,
+                flight_number INTEGER NOT NULL,
+                duration INTEGER NOT NULL,
+                max_distance REAL NOT NULL,
+                max_altitude REAL NOT NULL,
+                max_h_speed REAL NOT NULL,
+                max_v_speed REAL NOT NULL,
+                traveled REAL NOT NULL,
+                min_lat REAL,
+                min_lon REAL,
+                max_lat REAL,
+                max_lon REAL,
+                home_lat REAL,
+                home_lon REAL,
+                site_id INTEGER,
+                FOREIGN KEY (importref) REFERENCES imports(importref) ON DELETE CASCADE ON UPDATE NO ACTION
+            )
+            """,
+            """
+            INSERT INTO flight_stats_new(flight_id, importref, flight_number, duration, max_distance, max_altitude, max_h_speed, max_v_speed, traveled, min_lat, min_lon, max_lat, max_lon, home_lat, home_lon, site_id)
+                SELECT rowid, importref, flight_number, duration, max_distance, max_altitude, max_h_speed, max_v_speed, traveled, min_lat, min_lon, max_lat, max_lon, home_lat, home_lon, site_id
+                FROM flight_stats
+            """,
+            "DROP TABLE flight_stats",
+            "ALTER TABLE flight_stats_new RENAME TO flight_stats",
+            "CREATE INDEX IF NOT EXISTS flight_stats_index ON flight_stats(importref)",
+            "CREATE INDEX IF NOT EXISTS flight_stats_site_index ON flight_stats(site_id, importref)",
+            "DELETE FROM flight_bbox",
+            "INSERT INTO flight_bbox(id, min_lat, max_lat, min_lon, max_lon) SELECT flight_id, min_lat, max_lat, min_lon, max_lon FROM flight_stats WHERE min_lat IS NOT NULL",
+            """
+            CREATE TRIGGER IF NOT EXISTS flight_stats_summary_insert AFTER INSERT ON flight_stats BEGIN
+                UPDATE import_summary SET
+                    flights = flights + 1,
+                    duration = coalesce(duration, 0) + new.duration,
+                    max_duration = coalesce(max(max_duration, new.duration), new.duration),
+                    max_distance = coalesce(max(max_distance, new.max_distance), new.max_distance),
+                    max_altitude = coalesce(max(max_altitude, new.max_altitude), new.max_altitude),
+                    max_h_speed = coalesce(max(max_h_speed, new.max_h_speed), new.max_h_speed),
+                    max_v_speed = coalesce(max(max_v_speed, new.max_v_speed), new.max_v_speed),
+                    traveled = coalesce(traveled, 0) + new.traveled
+                WHERE importref = new.importref;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS flight_stats_summary_delete AFTER DELETE ON flight_stats BEGIN
+                UPDATE import_summary SET (flights, duration, max_duration, max_distance, max_altitude, max_h_speed, max_v_speed, traveled) = (
+                    SELECT count(1), sum(duration), max(duration), max(max_distance), max(max_altitude), max(max_h_speed), max(max_v_speed), sum(traveled)
+                    FROM flight_stats WHERE importref = old.importref
+                ) WHERE importref = old.importref;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS flight_stats_bbox_insert AFTER INSERT ON flight_stats WHEN new.min_lat IS NOT NULL BEGIN
+                INSERT INTO flight_bbox(id, min_lat, max_lat, min_lon, max_lon) VALUES(new.flight_id, new.min_lat, new.max_lat, new.min_lon, new.max_lon);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS flight_stats_bbox_update AFTER UPDATE OF min_lat, min_lon, max_lat, max_lon ON flight_stats BEGIN
+                DELETE FROM flight_bbox WHERE id = old.flight_id;
+                INSERT INTO flight_bbox(id, min_lat, max_lat, min_lon, max_lon)
+                    SELECT new.flight_id, new.min_lat, new.max_lat, new.min_lon, new.max_lon WHERE new.min_lat IS NOT NULL;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS flight_stats_bbox_delete AFTER DELETE ON flight_stats BEGIN
+                DELETE FROM flight_bbox WHERE id = old.flight_id;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS flight_stats_site_update AFTER UPDATE OF site_id ON flight_stats BEGIN
+                UPDATE launch_sites SET
+                    flights = flights - 1,
+                    duration = duration - coalesce(old.duration, 0),
+                    lat = CASE WHEN flights > 1 THEN (lat * flights - old.home_lat) / (flights - 1) ELSE lat END,
+                    lon = CASE WHEN flights > 1 THEN (lon * flights - old.home_lon) / (flights - 1) ELSE lon END,
+                    last_flown = (SELECT max(i.dateref) FROM flight_stats s JOIN imports i ON i.importref = s.importref WHERE s.site_id = old.site_id)
+                WHERE site_id = old.site_id;
+                DELETE FROM launch_sites WHERE site_id = old.site_id AND flights <= 0 AND name IS NULL;
+                UPDATE launch_sites SET
+                    flights = flights + 1,
+                    duration = duration + coalesce(new.duration, 0),
+                    lat = (lat * flights + new.home_lat) / (flights + 1),
+                    lon = (lon * flights + new.home_lon) / (flights + 1),
+                    last_flown = (SELECT max(i.dateref) FROM flight_stats s JOIN imports i ON i.importref = s.importref WHERE s.site_id = new.site_id)
+                WHERE site_id = new.site_id;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS flight_stats_site_delete AFTER DELETE ON flight_stats WHEN old.site_id IS NOT NULL BEGIN
+                UPDATE launch_sites SET
+                    flights = flights - 1,
+                    duration = duration - coalesce(old.duration, 0),
+                    lat = CASE WHEN flights > 1 THEN (lat * flights - old.home_lat) / (flights - 1) ELSE lat END,
+                    lon = CASE WHEN flights > 1 THEN (lon * flights - old.home_lon) / (flights - 1) ELSE lon END,
+                    last_flown = (SELECT max(i.dateref) FROM flight_stats s JOIN imports i ON i.importref = s.importref WHERE s.site_id = old.site_id)
+                WHERE site_id = old.site_id;
+                DELETE FROM launch_sites WHERE site_id = old.site_id AND flights <= 0 AND name IS NULL;
+            END
+            """
+        ]),
+        (12, "Log files that changed since they were imported", [
+            "ALTER TABLE log_file_meta ADD COLUMN changed_on TEXT"
+        ])
+    ]
+
     def dataFile(self):
         return self.dbFile
 
+    def connection(self):
+        '''
+        Return the connection of the current thread. Connections stay open and are reused for subsequent calls.
+        '''
+        con = getattr(self.local, 'con', None)
+        if con is not None and self.local.generation == self.generation:
+            return con
+        con = sqlite3.connect(self.dbFile, isolation_level=None, check_same_thread=False, cached_statements=self.statementCacheSize, timeout=30)
+        if not self.extdb:
+            # External DBs (i.e. waypoints) are pushed back to the device as a single file, so they keep the default journal.
+            con.execute("PRAGMA journal_mode = WAL")
+            con.execute("PRAGMA synchronous = NORMAL") # Safe with WAL, avoids an fsync on every commit.
+            con.execute("PRAGMA foreign_keys = ON") # Enforce the declared cascades, this is off by default in SQLite.
+        con.execute("PRAGMA temp_store = MEMORY")
+        con.execute("PRAGMA cache_size = -8000") # 8MB page cache.
+        self.local.con = con
+        self.local.generation = self.generation
+        self.local.depth = 0
+        with self.lock:
+            # Close connections of threads that have since finished (i.e. imports).
+            liveThreads = set(thread.ident for thread in threading.enumerate())
+            for threadId in [threadId for threadId in self.connections if threadId not in liveThreads]:
+                self.connections.pop(threadId).close()
+            self.connections[threading.get_ident()] = con
+        return con
+
+    def close(self):
+        '''
+        Close the connections of all threads. They are re-opened on the next call.
+        '''
+        with self.lock:
+            self.generation = self.generation + 1
+            for con in self.connections.values():
+                try:
+                    con.close()
+                except Exception as e:
+                    print(f"Error closing DB connection: {e}")
+            self.connections = {}
+
+    def checkpoint(self):
+        '''
+        Write the WAL content back into the main DB file, i.e. before copying the file.
+        '''
+        if not self.extdb:
+            self.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    @contextmanager
+    def transaction(self):
+        '''
+        Run the enclosed statements in a single transaction. Nested transactions join the outer one. The outer
+        transaction is rolled back when the statements or the commit fail.
+        '''
+        con = self.connection()
+        if self.local.depth == 0:
+            con.execute("BEGIN IMMEDIATE")
+        self.local.depth = self.local.depth + 1
+        try:
+            yield self
+        except Exception:
+            if self.local.depth == 1 and con.in_transaction: # Some errors roll back the transaction by themselves.
+                con.execute("ROLLBACK")
+            raise
+        else:
+            if self.local.depth == 1:
+                try:
+                    con.execute("COMMIT")
+                except Exception:
+                    if con.in_transaction:
+                        con.execute("ROLLBACK")
+                    raise
+        finally:
+            self.local.depth = self.local.depth - 1
+
     def execute(self, expression, params=None):
         '''
         Run a SQL command and return results.
         '''
-        con = sqlite3.connect(self.dbFile)
-        cur = con.cursor()
+        startTs = time.perf_counter()
+        con = self.connection()
         if (params):
-            cur.execute(expression, params)
+            cur = con.execute(expression, params)
         else:
-            cur.execute(expression)
+            cur = con.execute(expression)
         results = cur.fetchall()
-        con.commit()
-        con.close()
+        self.log_slow_query(expression, startTs)
         return results
 
-    def __init__(self, file, extdb=False):
-        self.dbFile = file
-        if extdb:
-            return
+    def stream(self, expression, params=None, batchSize=1000):
+        '''
+        Run a SQL query and yield the rows as they are read, so large results are never loaded in memory at once.
+        '''
+        startTs = time.perf_counter()
+        cur = self.connection().execute(expression, params if params else ())
+        try:
+            while True:
+                rows = cur.fetchmany(batchSize)
+                if len(rows) == 0:
+                    break
+                yield from rows
+        finally:
+            cur.close()
+            self.log_slow_query(expression, startTs)
 
+    def executemany(self, expression, paramList):
+        '''
+        Run a SQL command for each set of parameters. All rows are committed together, or not at all.
         '''
-        Create the DB and schema.
+        startTs = time.perf_counter()
+        with self.transaction():
+            self.connection().executemany(expression, paramList)
+        self.log_slow_query(expression, startTs)
+
+    def migrate(self):
+        '''
+        Apply the schema migrations that were not applied to the DB yet.
         '''
         self.execute("""
-            CREATE TABLE IF NOT EXISTS models(
-                modelref TEXT PRIMARY KEY
+            CREATE TABLE IF NOT EXISTS schema_version(
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                appliedon TEXT NOT NULL
             )
         """)
-        self.execute("""
-            CREATE TABLE IF NOT EXISTS imports(
-                importref TEXT PRIMARY KEY,
-                modelref TEXT NOT NULL,
-                dateref TEXT NOT NULL,
-                importedon TEXT NOT NULL,
-                FOREIGN KEY (modelref) REFERENCES models(modelref) ON DELETE CASCADE ON UPDATE NO ACTION
+        for version, description, statements in self.migrations:
+            with self.transaction():
+                if len(self.execute("SELECT 1 FROM schema_version WHERE version = ?", (version,))) > 0:
+                    continue
+                print(f"Applying DB migration {version}: {description}")
+                for statement in statements:
+                    self.execute(statement)
+                self.execute(
+                    "INSERT INTO schema_version(version, description, appliedon) VALUES(?,?,?)",
+                    (version, description, datetime.datetime.now().isoformat())
+                )
+
+    def rebuild_summaries(self):
+        '''
+        Rebuild the summary tables from the detail tables and return the number of summary rows that were out of sync.
+        '''
+        summaryTables = ["import_summary", "daily_summary", "model_summary"]
+        def snapshot():
+            rows = set()
+            for table in summaryTables:
+                for row in self.execute(f"SELECT * FROM {table}"):
+                    rows.add((table,) + tuple(round(val, 6) if isinstance(val, float) else val for val in row))
+            return rows
+        with self.transaction():
+            before = snapshot()
+            for table in summaryTables:
+                self.execute(f"DELETE FROM {table}")
+            self.execute("DELETE FROM daily_summary") # Re-populated by the triggers while import_summary was emptied.
+            for statement in self.summaryPopulate:
+                self.execute(statement)
+            after = snapshot()
+        return len(before ^ after)
+
+    def flights_in_bbox(self, latMin, lonMin, latMax, lonMax):
+        '''
+        Return the flights whose bounding box overlaps the given area, most recent first. Flights imported before
+        bounding boxes were recorded are included once their log has been opened again. The CROSS JOIN keeps the
+        R*Tree as the outer loop, the planner has no statistics for it and can otherwise prefer scanning the imports.
+        '''
+        return self.execute("""
+            SELECT i.importref, i.modelref, i.dateref, s.flight_number, s.duration, s.traveled, s.min_lat, s.min_lon, s.max_lat, s.max_lon
+            FROM flight_bbox b
+            CROSS JOIN flight_stats s ON s.flight_id = b.id
+            JOIN imports i ON i.importref = s.importref
+            WHERE b.max_lat >= ? AND b.min_lat <= ? AND b.max_lon >= ? AND b.min_lon <= ?
+            ORDER BY i.dateref DESC, i.importref DESC, s.flight_number
+            """, (latMin, latMax, lonMin, lonMax)
+        )
+
+    def flight_bboxes(self, modelRef):
+        '''
+        Return the bounding boxes of all flights of a drone model as (min_lat, min_lon, max_lat, max_lon).
+        '''
+        return self.execute("""
+            SELECT s.min_lat, s.min_lon, s.max_lat, s.max_lon
+            FROM flight_stats s
+            JOIN imports i ON i.importref = s.importref
+            WHERE i.modelref = ? AND s.min_lat IS NOT NULL
+            """, (modelRef,)
+        )
+
+    def has_heatmap(self, importRef):
+        return len(self.execute("SELECT 1 FROM heatmap_bins WHERE importref = ? LIMIT 1", (importRef,))) > 0
+
+    def save_heatmap(self, importRef, cells):
+        '''
+        Store the heatmap grid cells of an import, replacing what was stored for it before. Each cell is a tuple with
+        the heatmap_bins columns, starting at level. The triggers merge the cells into the grid of the drone model.
+        '''
+        with self.transaction():
+            self.execute("DELETE FROM heatmap_bins WHERE importref = ?", (importRef,))
+            self.executemany(
+                "INSERT INTO heatmap_bins SELECT importref, modelref, ?, ?, ?, ?, ?, ?, ?, ? FROM imports WHERE importref = ?",
+                [cell + (importRef,) for cell in cells]
             )
-        """)
-        self.execute("""
-            CREATE TABLE IF NOT EXISTS log_files(
-                filename TEXT PRIMARY KEY,
-                importref TEXT NOT NULL,
-                bintype TEXT NOT NULL,
-                FOREIGN KEY (importref) REFERENCES imports(importref) ON DELETE CASCADE ON UPDATE NO ACTION
+
+    def heatmap_cells(self, modelRef, level, xMin, yMin, xMax, yMax):
+        '''
+        Return the heatmap grid cells of all imports of a drone model within a range of cells at a grid level, as
+        (cell_x, cell_y, samples, rssi_sum, rssi_samples, min_satellites, max_altitude).
+        '''
+        return self.execute("""
+            SELECT cell_x, cell_y, samples, rssi_sum, rssi_samples, min_satellites, max_altitude
+            FROM heatmap_grid
+            WHERE modelref = ? AND level = ? AND cell_x BETWEEN ? AND ? AND cell_y BETWEEN ? AND ?
+            """, (modelRef, level, xMin, xMax, yMin, yMax)
+        )
+
+    def has_flight_paths(self, importRef):
+        return len(self.execute("SELECT 1 FROM flight_paths WHERE importref = ? LIMIT 1", (importRef,))) > 0
+
+    def save_flight_paths(self, importRef, paths):
+        '''
+        Store the simplified flight paths of an import, replacing what was stored for it before. paths is a list of
+        (flight_number, detail, coords), coords is a list of [lon, lat] points. Coordinates are stored as little-endian
+        32 bit integers in 1e-7 degrees, as in the log files.
+        '''
+        with self.transaction():
+            self.execute("DELETE FROM flight_paths WHERE importref = ?", (importRef,))
+            self.executemany(
+                "INSERT INTO flight_paths(importref, flight_number, detail, points, coords) VALUES(?,?,?,?,?)",
+                [(importRef, flightNumber, detail, len(coords), struct.pack(f"<{len(coords)*2}i", *[round(value * 10000000) for coord in coords for value in coord])) for flightNumber, detail, coords in paths]
             )
-        """)
-        self.execute("""
-            CREATE TABLE IF NOT EXISTS flight_stats(
-                importref TEXT NOT NULL,
-                flight_number INTEGER NOT NULL,
-                duration INTEGER NOT NULL,
-                max_distance REAL NOT NULL,
-                max_altitude REAL NOT NULL,
-                max_h_speed REAL NOT NULL,
-                max_v_speed REAL NOT NULL,
-                traveled REAL NOT NULL,
-                FOREIGN KEY (importref) REFERENCES imports(importref) ON DELETE CASCADE ON UPDATE NO ACTION
+
+    def archive_paths(self, modelRef, detail, latMin, lonMin, latMax, lonMax, loadedIds):
+        '''
+        Return the flights of a drone model whose bounding box overlaps the given area, as (flightIds, geometries). A
+        flight id is the flight_id of its flight_stats record. geometries has (flightId, points) for the flights that are
+        not in loadedIds, with the simplified path at the detail level in normalized map coordinates. They are projected
+        here, off the main thread.
+        '''
+        flightIds = [flight[0] for flight in self.execute("""
+            SELECT s.flight_id
+            FROM flight_bbox b
+            CROSS JOIN flight_stats s ON s.flight_id = b.id
+            JOIN imports i ON i.importref = s.importref
+            WHERE i.modelref = ? AND b.max_lat >= ? AND b.min_lat <= ? AND b.max_lon >= ? AND b.min_lon <= ?
+            """, (modelRef, latMin, latMax, lonMin, lonMax)
+        )]
+        missingIds = [flightId for flightId in flightIds if flightId not in loadedIds]
+        geometries = []
+        for start in range(0, len(missingIds), self.maxQueryParams):
+            batch = missingIds[start:start+self.maxQueryParams]
+            for flightId, points, coords in self.execute(f"""
+                SELECT s.flight_id, p.points, p.coords
+                FROM flight_stats s
+                JOIN flight_paths p ON p.importref = s.importref AND p.flight_number = s.flight_number
+                WHERE p.detail = ? AND s.flight_id IN ({','.join(['?'] * len(batch))})
+                """, [detail] + batch
+            ):
+                values = struct.unpack(f"<{points*2}i", coords)
+                geometries.append((flightId, [project(values[idx] / 10000000, values[idx+1] / 10000000) for idx in range(0, len(values), 2)]))
+        return flightIds, geometries
+
+    def assign_launch_sites(self, importRef):
+        '''
+        Cluster the home points of the flights of an import into launch sites. A flight joins the site within
+        launchSiteRadiusKm of its home point, or starts a new site. When the home point is within reach of several
+        sites, they are merged into the one with the most flights, like density based clustering would.
+        '''
+        with self.transaction():
+            for flightId, homeLat, homeLon in self.execute(
+                "SELECT flight_id, home_lat, home_lon FROM flight_stats WHERE importref = ? AND site_id IS NULL AND home_lat IS NOT NULL",
+                (importRef,)
+            ):
+                latDelta = math.degrees(self.launchSiteRadiusKm / self.earthRadiusKm)
+                lonDelta = latDelta / max(math.cos(math.radians(homeLat)), 0.000001)
+                sites = [site for site in self.execute("""
+                    SELECT site_id, lat, lon, flights, name FROM launch_sites
+                    WHERE lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?
+                    ORDER BY flights DESC, site_id
+                    """, (homeLat - latDelta, homeLat + latDelta, homeLon - lonDelta, homeLon + lonDelta)
+                ) if self.distance_km(homeLat, homeLon, site[1], site[2]) <= self.launchSiteRadiusKm]
+                if len(sites) == 0:
+                    self.execute("INSERT INTO launch_sites(lat, lon) VALUES(?,?)", (homeLat, homeLon))
+                    siteId = self.execute("SELECT last_insert_rowid()")[0][0]
+                else:
+                    siteId = sites[0][0]
+                    for mergedSite in sites[1:]:
+                        self.execute("UPDATE flight_stats SET site_id = ? WHERE site_id = ?", (siteId, mergedSite[0]))
+                        self.execute("UPDATE launch_sites SET name = coalesce(name, ?) WHERE site_id = ?", (mergedSite[4], siteId))
+                        self.execute("DELETE FROM launch_sites WHERE site_id = ?", (mergedSite[0],))
+                self.execute("UPDATE flight_stats SET site_id = ? WHERE flight_id = ?", (siteId, flightId))
+
+    def launch_sites(self):
+        '''
+        Return the launch sites, most recently flown first, as (site_id, name, lat, lon, flights, duration, last_flown).
+        '''
+        return self.execute("SELECT site_id, name, lat, lon, flights, duration, last_flown FROM launch_sites WHERE flights > 0 ORDER BY last_flown DESC, site_id")
+
+    def launch_site_flights(self, siteId):
+        '''
+        Return the flights of a launch site, most recent first, in the same layout as flights_in_bbox().
+        '''
+        return self.execute("""
+            SELECT i.importref, i.modelref, i.dateref, s.flight_number, s.duration, s.traveled
+            FROM flight_stats s
+            JOIN imports i ON i.importref = s.importref
+            WHERE s.site_id = ?
+            ORDER BY i.dateref DESC, i.importref DESC, s.flight_number
+            """, (siteId,)
+        )
+
+    def rename_launch_site(self, siteId, name):
+        self.execute("UPDATE launch_sites SET name = ? WHERE site_id = ?", (name if name else None, siteId))
+
+    def flights_near(self, lat, lon, radiusKm):
+        '''
+        Return the flights that came within the given radius of a location, i.e. a launch point. The R*Tree narrows
+        the search down to a box around the location, the exact distance to each flight's bounding box is then checked.
+        '''
+        latDelta = math.degrees(radiusKm / self.earthRadiusKm)
+        lonDelta = latDelta / max(math.cos(math.radians(lat)), 0.000001)
+        flights = []
+        for flight in self.flights_in_bbox(lat - latDelta, lon - lonDelta, lat + latDelta, lon + lonDelta):
+            nearestLat = min(max(lat, flight[6]), flight[8]) # Closest point of the bounding box.
+            nearestLon = min(max(lon, flight[7]), flight[9])
+            if self.distance_km(lat, lon, nearestLat, nearestLon) <= radiusKm:
+                flights.append(flight)
+        return flights
+
+    def distance_km(self, lat1, lon1, lat2, lon2):
+        '''
+        Great-circle (haversine) distance between two coordinates.
+        '''
+        dLat = math.radians(lat2 - lat1)
+        dLon = math.radians(lon2 - lon1)
+        a = math.sin(dLat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dLon / 2) ** 2
+        return 2 * self.earthRadiusKm * math.asin(math.sqrt(a))
+
+    def schema_version(self):
+        '''
+        Return the version of the most recent migration applied to the DB.
+        '''
+        version = self.execute("SELECT max(version) FROM schema_version")
+        return version[0][0] if version[0][0] is not None else 0
+
+    def log_slow_query(self, expression, startTs):
+        if self.slowQueryMs is None:
+            return
+        elapsedMs = (time.perf_counter() - startTs) * 1000
+        if elapsedMs >= self.slowQueryMs:
+            print(f"Slow query ({elapsedMs:.1f} ms): {' '.join(expression.split())}")
+
+    def __init__(self, file, extdb=False, slowQueryMs=None):
+        self.dbFile = file
+        self.extdb = extdb
+        self.slowQueryMs = slowQueryMs # Log queries that take at least this long. None to disable.
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = {}
+        self.generation = 0
+        if not extdb:
+            self.migrate()
+
+
+class TelemetryDb(Db):
+    '''
+    Companion DB with the decoded records of all imports, so questions that span flights can be answered in SQL
+    without parsing the log files again. Values are stored as scaled integers: coordinates in 1e-7 degrees (as in
+    the log files), distances and altitudes in cm, speeds in cm/s, voltages in mV and timestamps in ms since the
+    epoch. The telemetry_readings view converts them back to regular units.
+    '''
+
+    motorStatusCodes = {MotorStatus.UNKNOWN: 0, MotorStatus.OFF: 1, MotorStatus.IDLE: 2, MotorStatus.LIFT: 3}
+
+    migrations = [
+        (1, "Telemetry schema", [
+            """
+            CREATE TABLE IF NOT EXISTS telemetry_imports(
+                importid INTEGER PRIMARY KEY,
+                importref TEXT NOT NULL UNIQUE
             )
-        """)
-        self.execute("CREATE INDEX IF NOT EXISTS flight_stats_index ON flight_stats(importref)")
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS telemetry(
+                importid INTEGER NOT NULL,
+                recnum INTEGER NOT NULL,
+                flight INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                lat INTEGER NOT NULL,
+                lon INTEGER NOT NULL,
+                ctrl_lat INTEGER NOT NULL,
+                ctrl_lon INTEGER NOT NULL,
+                home_lat INTEGER NOT NULL,
+                home_lon INTEGER NOT NULL,
+                altitude INTEGER,
+                distance INTEGER,
+                h_speed INTEGER,
+                v_speed INTEGER,
+                satellites INTEGER NOT NULL,
+                gps INTEGER,
+                battery_level INTEGER NOT NULL,
+                battery_temp INTEGER NOT NULL,
+                battery_current INTEGER NOT NULL,
+                battery_voltage INTEGER NOT NULL,
+                motor_status INTEGER NOT NULL,
+                drone_action INTEGER NOT NULL,
+                flight_mode INTEGER NOT NULL,
+                position_mode INTEGER NOT NULL,
+                rssi INTEGER,
+                channel INTEGER,
+                PRIMARY KEY (importid, recnum),
+                FOREIGN KEY (importid) REFERENCES telemetry_imports(importid) ON DELETE CASCADE ON UPDATE NO ACTION
+            ) WITHOUT ROWID
+            """,
+            "CREATE INDEX IF NOT EXISTS telemetry_time_index ON telemetry(ts)",
+            "CREATE INDEX IF NOT EXISTS telemetry_flight_index ON telemetry(importid, flight)",
+            """
+            CREATE VIEW IF NOT EXISTS telemetry_readings AS
+                SELECT i.importref, t.recnum, t.flight, datetime(t.ts / 1000.0, 'unixepoch', 'localtime') AS ts,
+                    t.lat / 10000000.0 AS lat, t.lon / 10000000.0 AS lon,
+                    t.ctrl_lat / 10000000.0 AS ctrl_lat, t.ctrl_lon / 10000000.0 AS ctrl_lon,
+                    t.home_lat / 10000000.0 AS home_lat, t.home_lon / 10000000.0 AS home_lon,
+                    t.altitude / 100.0 AS altitude, t.distance / 100.0 AS distance,
+                    t.h_speed / 100.0 AS h_speed, t.v_speed / 100.0 AS v_speed,
+                    t.satellites, t.gps, t.battery_level, t.battery_temp, t.battery_current, t.battery_voltage / 1000.0 AS battery_voltage,
+                    t.motor_status, t.drone_action, t.flight_mode, t.position_mode, t.rssi, t.channel
+                FROM telemetry t
+                JOIN telemetry_imports i ON i.importid = t.importid
+            """
+        ])
+    ]
+
+    def has_import(self, importRef):
+        return len(self.execute("SELECT 1 FROM telemetry_imports WHERE importref = ?", (importRef,))) > 0
+
+    def save_import(self, importRef, records):
+        '''
+        Store the records of an import, replacing what was stored for it before. Each record is a tuple with the
+        telemetry columns, starting at recnum.
+        '''
+        with self.transaction():
+            self.execute("DELETE FROM telemetry_imports WHERE importref = ?", (importRef,))
+            self.execute("INSERT INTO telemetry_imports(importref) VALUES(?)", (importRef,))
+            importId = self.execute("SELECT importid FROM telemetry_imports WHERE importref = ?", (importRef,))[0][0]
+            self.executemany(
+                f"INSERT INTO telemetry VALUES({','.join(['?'] * 26)})",
+                [(importId,) + record for record in records]
+            )
+
+    def delete_import(self, importRef):
+        self.execute("DELETE FROM telemetry_imports WHERE importref = ?", (importRef,))
+
+    def prune(self, importRefs):
+        '''
+        Delete the telemetry of imports that are not in the given list (anymore).
+        '''
+        importRefs = set(importRefs)
+        with self.transaction():
+            for storedRef in [importRef[0] for importRef in self.execute("SELECT importref FROM telemetry_imports")]:
+                if storedRef not in importRefs:
+                    self.delete_import(storedRef)
+
+
+class TileCacheDb(Db):
+    '''
+    Map tile cache of a single map source, in the MBTiles layout: tile rows are counted from the bottom of the map,
+    like the map widget does. Next to the MBTiles columns, each tile has its size and when it was last shown, to evict
+    the least recently used tiles once the cache outgrows its budget. Pinned tiles (offline tile packs and tiles that
+    were downloaded ahead of time) are never evicted, they can take up the whole budget but not more.
+    '''
+
+    evictTarget = 0.9 # Evict down to this part of the budget, so not every new tile triggers an eviction.
+    usageBatchSize = 100 # Tile usage is recorded in batches, so showing a tile does not cost a write.
+
+    migrations = [
+        (1, "Tile cache schema", [
+            """
+            CREATE TABLE IF NOT EXISTS metadata(
+                name TEXT PRIMARY KEY,
+                value TEXT
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS tiles(
+                zoom_level INTEGER NOT NULL,
+                tile_column INTEGER NOT NULL,
+                tile_row INTEGER NOT NULL,
+                tile_data BLOB NOT NULL,
+                tile_size INTEGER NOT NULL,
+                last_used INTEGER NOT NULL,
+                pinned INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (zoom_level, tile_column, tile_row)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS tiles_lru_index ON tiles(pinned, last_used)"
+        ])
+    ]
+
+    def has_tile(self, zoom, x, row):
+        return len(self.execute("SELECT 1 FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?", (zoom, x, row))) > 0
+
+    def get_tile(self, zoom, x, row):
+        '''
+        Return the image data of a tile, or None if it is not cached.
+        '''
+        rows = self.execute("SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?", (zoom, x, row))
+        with self.statsLock:
+            if len(rows) == 0:
+                self.misses = self.misses + 1
+                return None
+            self.hits = self.hits + 1
+            self.usedTiles[(zoom, x, row)] = int(time.time())
+            flushUsage = len(self.usedTiles) >= self.usageBatchSize
+        if flushUsage:
+            self.flush_usage()
+        return rows[0][0]
+
+    def put_tile(self, zoom, x, row, data, pinned=False):
+        '''
+        Store a tile, then evict the least recently used tiles if the cache is over budget. A tile that was pinned
+        stays pinned when the map downloads it again. A pinned tile that does not fit in the budget next to the other
+        pinned tiles is not stored, then False is returned.
+        '''
+        with self.transaction():
+            oldTile = self.execute("SELECT tile_size, pinned FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?", (zoom, x, row))
+            oldBytes = oldTile[0][0] if len(oldTile) > 0 else 0
+            oldPinned = len(oldTile) > 0 and oldTile[0][1] == 1
+            isPinned = pinned or oldPinned
+            pinnedBytes = self.pinnedBytes + len(data) - (oldBytes if oldPinned else 0)
+            if isPinned and pinnedBytes > self.budgetBytes:
+                print(f"Tile cache {self.name} is full, pinned tiles take {self.pinnedBytes} of {self.budgetBytes} bytes")
+                return False
+            self.execute(
+                "INSERT OR REPLACE INTO tiles(zoom_level, tile_column, tile_row, tile_data, tile_size, last_used, pinned) VALUES(?,?,?,?,?,?,?)",
+                (zoom, x, row, data, len(data), int(time.time()), 1 if isPinned else 0)
+            )
+        with self.statsLock:
+            self.stores = self.stores + 1
+            self.totalBytes = self.totalBytes + len(data) - oldBytes
+            if isPinned:
+                self.pinnedBytes = pinnedBytes
+            overBudget = self.over_budget()
+        if overBudget:
+            self.evict()
+        return True
+
+    def flush_usage(self):
+        with self.statsLock:
+            usedTiles = self.usedTiles
+            self.usedTiles = {}
+        if len(usedTiles) > 0:
+            self.executemany(
+                "UPDATE tiles SET last_used = ? WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                [(lastUsed,) + tile for tile, lastUsed in usedTiles.items()]
+            )
+
+    def over_budget(self):
+        return self.totalBytes > self.budgetBytes
+
+    def count_bytes(self):
+        self.totalBytes, self.pinnedBytes = self.execute("SELECT coalesce(sum(tile_size), 0), coalesce(sum(tile_size * pinned), 0) FROM tiles")[0]
+
+    def evict(self):
+        '''
+        Delete the least recently used tiles that are not pinned, until the cache is back within its budget.
+        '''
+        self.flush_usage()
+        with self.transaction():
+            excessBytes = self.totalBytes - round(self.budgetBytes * self.evictTarget)
+            evictedTiles = []
+            lruTiles = self.stream("SELECT rowid, tile_size FROM tiles WHERE pinned = 0 ORDER BY last_used")
+            for rowId, tileSize in lruTiles:
+                if excessBytes <= 0:
+                    break
+                evictedTiles.append((rowId,))
+                excessBytes = excessBytes - tileSize
+            lruTiles.close()
+            self.executemany("DELETE FROM tiles WHERE rowid = ?", evictedTiles)
+            self.count_bytes()
+        with self.statsLock:
+            self.evictions = self.evictions + len(evictedTiles)
+
+    def unpin(self, excessBytes):
+        '''
+        Unpin the least recently used pinned tiles, until at least excessBytes are unpinned. They are evicted like
+        any other tile from then on.
+        '''
+        self.flush_usage()
+        with self.transaction():
+            unpinnedTiles = []
+            pinnedTiles = self.stream("SELECT rowid, tile_size FROM tiles WHERE pinned = 1 ORDER BY last_used")
+            for rowId, tileSize in pinnedTiles:
+                if excessBytes <= 0:
+                    break
+                unpinnedTiles.append((rowId,))
+                excessBytes = excessBytes - tileSize
+            pinnedTiles.close()
+            self.executemany("UPDATE tiles SET pinned = 0 WHERE rowid = ?", unpinnedTiles)
+            self.count_bytes()
+
+    def set_budget(self, budgetBytes):
+        '''
+        Change the budget. When the pinned tiles take more than the new budget, the least recently used ones are
+        unpinned, so the budget bounds the size of the whole cache.
+        '''
+        self.budgetBytes = budgetBytes
+        if self.pinnedBytes > self.budgetBytes:
+            self.unpin(self.pinnedBytes - self.budgetBytes)
+        if self.over_budget():
+            self.evict()
+
+    def average_tile_size(self):
+        return self.execute("SELECT avg(tile_size) FROM tiles")[0][0]
+
+    def clear(self):
+        '''
+        Delete all tiles, pinned tiles too.
+        '''
+        with self.statsLock:
+            self.usedTiles = {}
+        self.execute("DELETE FROM tiles")
+        self.execute("VACUUM")
+        self.totalBytes = 0
+        self.pinnedBytes = 0
+
+    def export_pack(self, filename):
+        '''
+        Write all cached tiles to a standalone MBTiles file.
+        '''
+        self.flush_usage()
+        pack = sqlite3.connect(filename)
+        try:
+            self.connection().backup(pack)
+            pack.execute("PRAGMA journal_mode = DELETE") # A single file, without WAL.
+        finally:
+            pack.close()
+
+    def import_pack(self, filename):
+        '''
+        Add the tiles of an MBTiles file to the cache, pinned so they stay available offline. Returns the number of
+        tiles imported. A pack that does not fit in the budget next to the pinned tiles is not imported.
+        '''
+        if not os.path.isfile(filename):
+            raise FileNotFoundError(filename) # Attaching a missing file would create an empty DB.
+        self.execute("ATTACH DATABASE ? AS pack", (filename,))
+        try:
+            if len(self.execute("SELECT 1 FROM pack.sqlite_master WHERE name = 'tiles'")) == 0:
+                raise ValueError("not an MBTiles file")
+            packFormat = self.execute("SELECT value FROM pack.metadata WHERE name = 'format'") if len(self.execute("SELECT 1 FROM pack.sqlite_master WHERE name = 'metadata'")) > 0 else []
+            if len(packFormat) > 0 and packFormat[0][0] != self.imageExt:
+                raise ValueError(f"tiles are in {packFormat[0][0]} format, not {self.imageExt}")
+            with self.transaction():
+                addedBytes = self.execute("""
+                    SELECT coalesce(sum(length(p.tile_data)), 0) - coalesce(sum(t.tile_size * t.pinned), 0) FROM pack.tiles p
+                    LEFT JOIN tiles t ON t.zoom_level = p.zoom_level AND t.tile_column = p.tile_column AND t.tile_row = p.tile_row
+                    """
+                )[0][0]
+                if self.pinnedBytes + addedBytes > self.budgetBytes:
+                    raise ValueError(f"the tiles need {math.ceil(addedBytes / 1048576)} MB, the tile cache has {max(self.budgetBytes - self.pinnedBytes, 0) // 1048576} MB left for offline tiles")
+                self.execute("""
+                    INSERT OR REPLACE INTO tiles(zoom_level, tile_column, tile_row, tile_data, tile_size, last_used, pinned)
+                    SELECT zoom_level, tile_column, tile_row, tile_data, length(tile_data), ?, 1 FROM pack.tiles
+                    """, (int(time.time()),)
+                )
+                imported = self.execute("SELECT changes()")[0][0]
+                self.count_bytes()
+        finally:
+            self.execute("DETACH DATABASE pack")
+        if self.over_budget():
+            self.evict()
+        return imported
+
+    def stats(self):
+        with self.statsLock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'evictions': self.evictions,
+                'bytes': self.totalBytes,
+                'pinned_bytes': self.pinnedBytes,
+                'budget': self.budgetBytes
+            }
+
+    def __init__(self, file, name, imageExt, budgetBytes, slowQueryMs=None):
+        super().__init__(file, slowQueryMs=slowQueryMs)
+        self.name = name
+        self.imageExt = imageExt
+        self.budgetBytes = budgetBytes
+        self.statsLock = threading.Lock()
+        self.usedTiles = {}
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.executemany(
+            "INSERT OR REPLACE INTO metadata(name, value) VALUES(?,?)",
+            [('name', name), ('format', imageExt), ('type', 'baselayer'), ('version', '1.3')]
+        )
+        self.count_bytes()
+
+
+class AsyncDb():
+    '''
+    Run DB access off the UI thread. Writes go through a single writer thread and queued writes are batched
+    into one transaction. Reads run on a small pool of reader threads. Each call returns a Future, and the
+    optional callback is invoked with the result through the dispatcher (i.e. kivy's mainthread).
+    '''
+
+    batchSize = 100 # Max number of queued writes committed together.
+
+    def __init__(self, db, dispatcher=None, readers=2):
+        self.db = db
+        self.dispatcher = dispatcher
+        self.readPool = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+        self.writeQueue = queue.Queue()
+        self.metricsLock = threading.Lock()
+        self.metrics = {}
+        self.writer = threading.Thread(target=self.write_loop, name="db-writer", daemon=True)
+        self.writer.start()
+
+    def query(self, expression, params=None, callback=None):
+        '''
+        Run a read-only query on the reader pool.
+        '''
+        return self.submit_read(self.db.execute, (expression, params), callback)
+
+    def write(self, expression, params=None, callback=None):
+        '''
+        Queue a write statement for the writer thread.
+        '''
+        return self.submit_write(self.db.execute, (expression, params), callback)
+
+    def call(self, func, *args, callback=None, write=True):
+        '''
+        Run a function that accesses the DB, either on the writer thread (inside the write transaction) or on the reader pool.
+        '''
+        if write:
+            return self.submit_write(func, args, callback)
+        return self.submit_read(func, args, callback)
+
+    def submit_read(self, func, args, callback):
+        queuedTs = time.perf_counter()
+        future = self.readPool.submit(self.run_timed, 'read', queuedTs, func, args)
+        self.add_callback(future, callback)
+        return future
+
+    def submit_write(self, func, args, callback):
+        future = Future()
+        self.writeQueue.put((future, time.perf_counter(), func, args))
+        self.add_callback(future, callback)
+        return future
+
+    def add_callback(self, future, callback):
+        if callback is None:
+            return
+        def done(future):
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"DB call failed: {e}")
+                return
+            if self.dispatcher:
+                self.dispatcher(callback)(result)
+            else:
+                callback(result)
+        future.add_done_callback(done)
+
+    def run_timed(self, kind, queuedTs, func, args):
+        startTs = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.record_metric(kind, startTs - queuedTs, time.perf_counter() - startTs)
+
+    def write_loop(self):
+        '''
+        Writer thread. Takes all queued writes (up to batchSize) and commits them together. Each write runs in
+        its own savepoint, so a failing statement does not roll back the others in the batch.
+        '''
+        while True:
+            batch = [self.writeQueue.get()]
+            while len(batch) < self.batchSize:
+                try:
+                    batch.append(self.writeQueue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            batch = [item for item in batch if item is not None]
+            if len(batch) > 0:
+                results = []
+                try:
+                    with self.db.transaction():
+                        con = self.db.connection()
+                        for future, queuedTs, func, args in batch:
+                            if not future.set_running_or_notify_cancel():
+                                continue
+                            con.execute("SAVEPOINT write_item")
+                            try:
+                                results.append((future, self.run_timed('write', queuedTs, func, args), None))
+                                con.execute("RELEASE write_item")
+                            except Exception as e:
+                                con.execute("ROLLBACK TO write_item")
+                                con.execute("RELEASE write_item")
+                                results.append((future, None, e))
+                except Exception as e:
+                    # The transaction itself failed, none of the writes were saved.
+                    results = []
+                    for future, queuedTs, func, args in batch:
+                        if future.running() or (not future.done() and future.set_running_or_notify_cancel()):
+                            results.append((future, None, e))
+                for future, result, error in results:
+                    if error is None:
+                        future.set_result(result)
+                    else:
+                        future.set_exception(error)
+            if stop:
+                return
+
+    def record_metric(self, kind, waitTime, runTime):
+        with self.metricsLock:
+            metric = self.metrics.setdefault(kind, {"count": 0, "wait_ms": 0.0, "total_ms": 0.0, "max_ms": 0.0})
+            metric["count"] = metric["count"] + 1
+            metric["wait_ms"] = metric["wait_ms"] + waitTime * 1000
+            metric["total_ms"] = metric["total_ms"] + runTime * 1000
+            metric["max_ms"] = max(metric["max_ms"], runTime * 1000)
+
+    def stats(self):
+        '''
+        Query latency metrics per kind (read/write): count, average wait in the queue, average and max run time in ms.
+        '''
+        with self.metricsLock:
+            return {
+                kind: {
+                    "count": metric["count"],
+                    "avg_wait_ms": metric["wait_ms"] / metric["count"],
+                    "avg_ms": metric["total_ms"] / metric["count"],
+                    "max_ms": metric["max_ms"]
+                } for kind, metric in self.metrics.items()
+            }
+
+    def shutdown(self):
+        '''
+        Finish the queued writes and stop the worker threads.
+        '''
+        self.writeQueue.put(None)
+        self.writer.join()
+        self.readPool.shutdown(wait=True)
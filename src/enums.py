@@ -34,3 +34,31 @@ class SelectableTileServer(Enum):
   GOOGLE_STANDARD = 'Google Standard'
   GOOGLE_SATELLITE = 'Google Satellite'
   OPEN_TOPO = 'Open Topo'
+
+class ImportStage(Enum):
+  STARTED = 'started'
+  COPYING = 'copying'
+  PARSING = 'parsing'
+
+class RecordLayout(Enum):
+  LEGACY = 'Legacy'
+  CURRENT = 'Current'
+  MIXED = 'Mixed'
+
+class FpvPlatform(Enum):
+  IOS = 'iOS'
+  ANDROID = 'Android'
+
+class PathMetric(Enum):
+  NONE = 'none'
+  ALTITUDE = 'altitude'
+  SPEED = 'speed'
+  BATTERY = 'battery'
+  RSSI = 'rssi'
+
+class HeatmapMetric(Enum):
+  NONE = 'none'
+  ACTIVITY = 'activity'
+  RSSI = 'rssi'
+  SATELLITES = 'satellites'
+  ALTITUDE = 'altitude'
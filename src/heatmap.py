@@ -0,0 +1,61 @@
+'''
+Archive-wide heatmap grid - Developer: Koen Aerts
+'''
+import math
+
+from mercator import project
+
+
+class HeatmapBinner():
+    '''
+    Accumulate the readings of a log in a grid over the Web Mercator map, so the heatmap of all imports can be drawn
+    without parsing the logs again. The grid has multiple levels: a level has 2^level x 2^level cells over the whole
+    map, counted from the bottom left like the normalized map coordinates. Readings are binned at the finest level,
+    the coarser levels are rolled up from it. Each cell keeps the number of readings, the sum and number of RSSI
+    readings (for the mean), the lowest satellite count and the highest altitude.
+    '''
+    levels = (8, 10, 12, 14, 16, 18, 20)
+
+    def __init__(self):
+        self.cells = {}
+
+
+    def add(self, lon, lat, altitude, satellites, rssi):
+        x, y = project(lon, lat)
+        cellCount = 2 ** self.levels[-1]
+        key = (min(int(x * cellCount), cellCount-1), min(int(y * cellCount), cellCount-1))
+        altitude = altitude if math.isfinite(altitude) else None
+        cell = self.cells.get(key)
+        if cell is None:
+            self.cells[key] = [1, rssi or 0, 0 if rssi is None else 1, satellites, altitude]
+        else:
+            self.merge(cell, (1, rssi or 0, 0 if rssi is None else 1, satellites, altitude))
+
+
+    def merge(self, cell, other):
+        cell[0] = cell[0] + other[0]
+        cell[1] = cell[1] + other[1]
+        cell[2] = cell[2] + other[2]
+        cell[3] = other[3] if cell[3] is None else cell[3] if other[3] is None else min(cell[3], other[3])
+        cell[4] = other[4] if cell[4] is None else cell[4] if other[4] is None else max(cell[4], other[4])
+
+
+    def rows(self):
+        '''
+        The cells of all levels as (level, cell_x, cell_y, samples, rssi_sum, rssi_samples, min_satellites,
+        max_altitude).
+        '''
+        rows = []
+        finestLevel = self.levels[-1]
+        for level in self.levels:
+            shift = finestLevel - level
+            levelCells = {}
+            for (x, y), cell in self.cells.items():
+                key = (x >> shift, y >> shift)
+                levelCell = levelCells.get(key)
+                if levelCell is None:
+                    levelCells[key] = list(cell)
+                else:
+                    self.merge(levelCell, cell)
+            rows.extend((level, x, y, *cell) for (x, y), cell in levelCells.items())
+        return rows
@@ -0,0 +1,152 @@
+'''
+Log archive integrity checks - Developer: Koen Aerts
+'''
+import os
+import hashlib
+import datetime
+import threading
+
+from kivy.clock import mainthread
+
+
+class IntegrityChecker():
+    '''
+    Reconcile the log files on disk with the DB in the background: delete files that are no longer referenced,
+    drop imports whose files went missing, collect missing file metadata and verify file content hashes.
+    '''
+    hashBudgetBytes = 256 * 1024 * 1024 # Bytes hashed per run, the rest of the archive is verified in later runs.
+    verifyIntervalDays = 30 # Files are hashed again once their last verification is older than this.
+    hashChunkSize = 1024 * 1024
+
+    def __init__(self, parent):
+        self.parent = parent
+        self.lock = threading.Lock()
+        self.running = False
+        self.rerun = False
+
+
+    def start(self):
+        '''
+        Run a check in the background. When a check is already running, another one follows when it is done.
+        '''
+        with self.lock:
+            if self.running:
+                self.rerun = True
+                return
+            self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+
+
+    def run(self):
+        while True:
+            try:
+                report = self.check()
+                print(f"Integrity check: {report}")
+                mainthread(self.parent.integrity_check_done)(report)
+            except Exception as e:
+                print(f"Integrity check failed: {e}")
+            with self.lock:
+                if not self.rerun:
+                    self.running = False
+                    return
+                self.rerun = False
+
+
+    def check(self):
+        report = {
+            'purged_imports': 0,
+            'deleted_files': 0,
+            'scanned_files': 0,
+            'hashed_files': 0,
+            'changed_files': 0
+        }
+        db = self.parent.db
+        logfileDir = self.parent.logfileDir
+        db.execute("CREATE TEMP TABLE IF NOT EXISTS disk_files(filename TEXT PRIMARY KEY, filesize INTEGER NOT NULL)")
+        with db.transaction():
+            db.execute("DELETE FROM temp.disk_files")
+            db.executemany(
+                "INSERT INTO temp.disk_files(filename, filesize) VALUES(?,?)",
+                [(entry.name, entry.stat().st_size) for entry in os.scandir(logfileDir) if entry.is_file()]
+            )
+
+        # Imports with missing files are dropped as a whole. Imports in progress are left alone.
+        for importRef in [importRef[0] for importRef in db.execute("""
+            SELECT DISTINCT importref FROM log_files
+            WHERE filename NOT IN (SELECT filename FROM temp.disk_files)
+            AND importref NOT IN (SELECT importref FROM import_journal)
+            """)]:
+            if self.parent.asyncDb.call(self.purge_import, importRef).result():
+                report['purged_imports'] = report['purged_imports'] + 1
+
+        # Files of an import in progress are copied before they are referenced, so nothing is deleted until it is done.
+        if len(db.execute("SELECT 1 FROM import_journal LIMIT 1")) == 0:
+            for binBaseName in [fileRef[0] for fileRef in db.execute("SELECT filename FROM temp.disk_files WHERE filename NOT IN (SELECT filename FROM log_files)")]:
+                print(f"Deleting unreferenced file {binBaseName}")
+                try:
+                    os.remove(os.path.join(logfileDir, binBaseName))
+                    report['deleted_files'] = report['deleted_files'] + 1
+                except Exception as e:
+                    print(f"Error deleting {binBaseName}: {e}")
+
+        # Metadata of files that were imported before it was captured at import time.
+        for binBaseName, binType in db.execute("""
+            SELECT l.filename, l.bintype FROM log_files l
+            JOIN temp.disk_files d ON d.filename = l.filename
+            WHERE l.filename NOT IN (SELECT filename FROM log_file_meta)
+            """):
+            self.parent.save_log_file_meta(binBaseName, binType)
+            report['scanned_files'] = report['scanned_files'] + 1
+
+        # New files are hashed first, then the files that were verified longest ago. A file that changed keeps the
+        # hash it had when it was imported, so it is reported until it is restored or its import is deleted.
+        budget = self.hashBudgetBytes
+        verifiedBefore = (datetime.datetime.now() - datetime.timedelta(days=self.verifyIntervalDays)).isoformat()
+        for binBaseName, fileSize, diskSize, contentHash, changedOn in db.execute("""
+            SELECT m.filename, m.filesize, d.filesize, m.content_hash, m.changed_on FROM log_file_meta m
+            JOIN temp.disk_files d ON d.filename = m.filename
+            WHERE m.content_hash IS NULL OR m.verified_on < ?
+            ORDER BY m.content_hash IS NOT NULL, m.verified_on
+            """, (verifiedBefore,)):
+            if budget <= 0:
+                break
+            digest = self.file_hash(os.path.join(logfileDir, binBaseName))
+            budget = budget - diskSize
+            verifiedOn = datetime.datetime.now().isoformat()
+            if contentHash is None:
+                db.execute("UPDATE log_file_meta SET content_hash = ?, verified_on = ? WHERE filename = ?", (digest, verifiedOn, binBaseName))
+            elif digest != contentHash or diskSize != fileSize:
+                if changedOn is None:
+                    print(f"Log file {binBaseName} changed since it was imported")
+                    report['changed_files'] = report['changed_files'] + 1
+                db.execute("UPDATE log_file_meta SET changed_on = coalesce(changed_on, ?), verified_on = ? WHERE filename = ?", (verifiedOn, verifiedOn, binBaseName))
+            else:
+                db.execute("UPDATE log_file_meta SET changed_on = NULL, verified_on = ? WHERE filename = ?", (verifiedOn, binBaseName))
+            report['hashed_files'] = report['hashed_files'] + 1
+
+        if self.parent.telemetryDb is not None:
+            self.parent.telemetryDb.prune([importRef[0] for importRef in db.execute("SELECT importref FROM imports")])
+        return report
+
+
+    def purge_import(self, importRef):
+        '''
+        Runs on the DB writer thread, like the deletes of the user, so an import that was deleted in the meantime is
+        skipped. Returns True if the import was purged.
+        '''
+        if len(self.parent.db.execute("SELECT 1 FROM imports WHERE importref = ? AND importref NOT IN (SELECT importref FROM import_journal)", (importRef,))) == 0:
+            return False
+        print(f"Purging import {importRef}, its log files are missing")
+        self.parent.purge_import(importRef)
+        return True
+
+
+    def file_hash(self, filePath):
+        digest = hashlib.sha256()
+        with open(filePath, mode='rb') as binFile:
+            while True:
+                chunk = binFile.read(self.hashChunkSize)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        return digest.hexdigest()
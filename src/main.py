@@ -6,6 +6,7 @@ import subprocess
 import glob
 import shutil
 import math
+import bisect
 import datetime
 import tempfile
 import time
@@ -17,15 +18,19 @@ import json
 import requests
 import webbrowser
 
-from enums import DroneStatus, FlightMode, SelectableTileServer
+from enums import DroneStatus, FlightMode, SelectableTileServer, ImportStage, PathMetric, HeatmapMetric
 from exports import ExportCsv, ExportKml
 from widgets import SplashScreen, MaxDistGraph, TotDistGraph, TotDurationGraph
 from common import Common
-from parser import AtomBaseLogParser, DreamerBaseLogParser
-from db import Db
+from parser import AtomBaseLogParser, DreamerBaseLogParser, LogFileScanner
+from db import Db, AsyncDb, TelemetryDb, TileCacheDb
+from integrity import IntegrityChecker
+from tiles import CachedMapSource, TileFetcher, TilePrefetcher
+from playback import FlightPlayback, interpolate
+from maplayers import FlightPathLayer, HeatmapLayer, ArchivePathLayer, RotatingMapMarker
+from mercator import fit_bbox
 from pathlib import Path
 from zipfile import ZipFile
-from PIL import Image as PILImage
 
 from kivy.core.window import Window
 Window.allow_screensaver = False
@@ -44,8 +49,8 @@ from kivymd.uix.menu import MDDropdownMenu
 from kivymd.uix.progressindicator.progressindicator import MDCircularProgressIndicator
 from kivymd.uix.screen import MDScreen
 from kivymd.uix.snackbar import MDSnackbar, MDSnackbarText
-from kivy_garden.mapview import MapSource, MapMarker, MapMarkerPopup, MarkerMapLayer
-from kivy_garden.mapview.geojson import GeoJsonMapLayer
+from kivymd.uix.textfield import MDTextField, MDTextFieldHintText
+from kivy_garden.mapview import MapMarker, MapMarkerPopup, MarkerMapLayer
 from kivy_garden.mapview.utils import haversine
 
 # Platform specific imports.
@@ -83,11 +88,17 @@ class MainApp(MDApp):
     defaultMapZoom = 3
     pathWidths = [ "1.0", "1.5", "2.0", "2.5", "3.0" ]
     refreshRates = ['0.125s', '0.25s', '0.50s', '1.00s', '1.50s', '2.00s']
+    tileCacheSizes = ['100 MB', '250 MB', '500 MB', '1000 MB', '2000 MB'] # Per map source.
+    archivePathColor = "#5f5f5fb3" # Flights of the archive overlay, behind the flights of the opened log.
+    archivePathWidth = 1.0 # dp
     assetColors = [ "#ed1c24", "#0000ff", "#22b14c", "#7f7f7f", "#ffffff", "#c3c3c3", "#000000", "#ffff00", "#a349a4", "#aad2fa" ]
     columns = ('recnum', 'recid', 'flight','timestamp','tod','time','distance1','dist1lat','dist1lon','distance2','dist2lat','dist2lon','distance3','altitude1','altitude2','altitude2metric','speed1','speed1lat','speed1lon','speed2','speed2lat','speed2lon','speed1vert','speed2vert','satellites','ctrllat','ctrllon','homelat','homelon','dronelat','dronelon','orientation1','orientation2','roll','winddirection','motor1status','motor2status','motor3status','motor4status','motorstatus','dronestatus','droneaction','rssi','channel','flightctrlconnected','remoteconnected','droneconnected','rth','positionmode','gps','inuse','traveled','batterylevel','batterytemp','batterycurrent','batteryvoltage','batteryvoltage1','batteryvoltage2','flightmode','flightcounter')
     showColsBasicDreamer = ('flight','tod','time','altitude1','distance1','satellites','homelat','homelon','dronelat','dronelon')
     configFilename = "FlightLogViewer.ini"
     dbFilename = "FlightLogData.db"
+    telemetryDbFilename = "FlightTelemetry.db"
+    maxFlightsInView = 25 # Most recent flights listed for the map area.
+    dbSlowQueryMs = 250 # Log DB queries that take longer than this.
     languages = {
         'en_GB': 'English (GB)',
         'en_US': 'English (US)',
@@ -98,8 +109,6 @@ class MainApp(MDApp):
         'nl_NL': 'Nederlands',
         'id_ID': 'Indonesia'
     }
-    head_lat_2 = 0
-    head_lon_2 = 0
 
 
     def parse_atom_logs(self, importRef):
@@ -107,6 +116,7 @@ class MainApp(MDApp):
         parser.parse(importRef)
         mainthread(self.show_flight_date)(importRef)
         mainthread(self.show_flight_stats)()
+        mainthread(self.reload_archive_layers)() # Imports from before the heatmap and the flight archive overlay were just added to them.
         mainthread(self.init_gauges)()
 
 
@@ -157,7 +167,7 @@ class MainApp(MDApp):
         lcDM = droneModel.lower()
         if 'p1a' in lcDM or 'atom' in lcDM:
             already_imported = self.db.execute("SELECT importedon FROM imports WHERE importref = ?", (zipBaseName,))
-            if already_imported is None or len(already_imported) == 0:
+            if already_imported is None or len(already_imported) == 0 or self.get_import_stage(zipBaseName) is not None:
                 self.dialog_wait.open()
                 threading.Thread(target=self.import_file, args=(droneModel, zipBaseName, selectedFile)).start()
             else:
@@ -166,14 +176,75 @@ class MainApp(MDApp):
                 return
 
 
+    def get_import_stage(self, importRef):
+        '''
+        Return the stage an unfinished import has reached, or None if the import is not in progress.
+        '''
+        journal = self.db.execute("SELECT stage FROM import_journal WHERE importref = ?", (importRef,))
+        return journal[0][0] if journal is not None and len(journal) > 0 else None
+
+
+    def set_import_stage(self, importRef, stage, droneModel=None, selectedFile=None):
+        '''
+        Checkpoint the progress of an import in the import journal.
+        '''
+        now = datetime.datetime.now().isoformat()
+        if droneModel is not None and selectedFile is not None:
+            self.db.execute(
+                "INSERT OR REPLACE INTO import_journal(importref, modelref, sourcefile, stage, updatedon) VALUES(?,?,?,?,?)",
+                (importRef, droneModel, selectedFile, stage.value, now)
+            )
+        else:
+            self.db.execute("UPDATE import_journal SET stage = ?, updatedon = ? WHERE importref = ?", (stage.value, now, importRef))
+
+
     def import_file(self, droneModel, zipBaseName, selectedFile):
+        '''
+        Import the log files from the zip file. Each stage is checkpointed in the import journal so
+        an interrupted import resumes where it left off instead of starting over.
+        '''
+        try:
+            lcDM = droneModel.lower()
+            stage = self.get_import_stage(zipBaseName)
+            self.set_import_stage(zipBaseName, ImportStage(stage) if stage else ImportStage.STARTED, droneModel, selectedFile)
+            hasFc = True if stage == ImportStage.PARSING.value else self.copy_import_files(droneModel, zipBaseName, selectedFile)
+            if hasFc:
+                self.set_import_stage(zipBaseName, ImportStage.PARSING)
+                self.show_info_message(message=_('log_import_completed'))
+                self.map_rebuild_required = False
+                mainthread(self.open_view)("Screen_Map")
+                if ('p1a' in lcDM):
+                    self.parse_dreamer_logs(zipBaseName)
+                else:
+                    if (not 'atom' in lcDM):
+                        self.show_warning_message(message=_('drone_not_supported').format(modelname=droneModel))
+                    self.parse_atom_logs(zipBaseName)
+                self.db.execute("DELETE FROM import_journal WHERE importref = ?", (zipBaseName,))
+                mainthread(self.set_default_flight)()
+                mainthread(self.generate_map_layers)()
+                mainthread(self.select_flight)()
+                mainthread(self.select_drone_model)(droneModel)
+                mainthread(self.list_log_files)()
+            else:
+                self.db.execute("DELETE FROM import_journal WHERE importref = ?", (zipBaseName,))
+                self.show_warning_message(message=_('nothing_to_import'))
+            self.post_import_cleanup(selectedFile)
+        finally:
+            self.dialog_wait.dismiss()
+
+
+    def copy_import_files(self, droneModel, zipBaseName, selectedFile):
+        '''
+        Extract the bin files and copy to the app data directory, then update the DB references. Files that were
+        already copied by an earlier, interrupted attempt are skipped. Returns True if the zip file contains flight data.
+        '''
         hasFc = False
-        lcDM = droneModel.lower()
         fpvList = []
-        # Extract the bin files and copy to the app data directory, then update the DB references.
+        copiedFiles = set(fileRef[0] for fileRef in self.db.execute("SELECT filename FROM log_files WHERE importref = ?", (zipBaseName,)))
         shutil.rmtree(self.tempDir, ignore_errors=True) # Delete old temp files if they were missed before.
         with ZipFile(selectedFile, 'r') as unzip:
             unzip.extractall(path=self.tempDir)
+        self.set_import_stage(zipBaseName, ImportStage.COPYING)
         for binFile in glob.glob(os.path.join(self.tempDir, '**/*'), recursive=True):
             binBaseName = os.path.basename(binFile)
             binType = "FPV" if binBaseName.endswith("-FPV.bin") else (
@@ -185,46 +256,98 @@ class MainApp(MDApp):
                 else:
                     if not hasFc:
                         logDate = re.sub(r"-.*", r"", zipBaseName) # Extract date section from zip filename.
-                        self.db.execute("INSERT OR IGNORE INTO models(modelref) VALUES(?)", (droneModel,))
-                        self.db.execute(
-                            "INSERT OR IGNORE INTO imports(importref, modelref, dateref, importedon) VALUES(?,?,?,?)",
-                            (zipBaseName, droneModel, logDate, datetime.datetime.now().isoformat())
-                        )
+                        with self.db.transaction():
+                            self.db.execute("INSERT OR IGNORE INTO models(modelref) VALUES(?)", (droneModel,))
+                            self.db.execute(
+                                "INSERT OR IGNORE INTO imports(importref, modelref, dateref, importedon) VALUES(?,?,?,?)",
+                                (zipBaseName, droneModel, logDate, datetime.datetime.now().isoformat())
+                            )
                         hasFc = True
-                    shutil.copyfile(binFile, os.path.join(self.logfileDir, binBaseName))
-                    self.db.execute(
-                        "INSERT INTO log_files(filename, importref, bintype) VALUES(?,?,?)",
-                        (binBaseName, zipBaseName, binType)
-                    )
+                    if binBaseName not in copiedFiles:
+                        self.copy_log_file(binFile, zipBaseName, binType)
         if hasFc:
             # Once we have FC bin/fc files, we will also import FVP files as well.
             for fpvFile in fpvList:
-                fpvBaseName = os.path.basename(fpvFile)
-                shutil.copyfile(fpvFile, os.path.join(self.logfileDir, fpvBaseName))
-                self.db.execute(
-                    "INSERT INTO log_files(filename, importref, bintype) VALUES(?,?,?)",
-                    (fpvBaseName, zipBaseName, "FPV")
-                )
+                if os.path.basename(fpvFile) not in copiedFiles:
+                    self.copy_log_file(fpvFile, zipBaseName, "FPV")
         shutil.rmtree(self.tempDir, ignore_errors=True) # Delete temp files.
-        if hasFc:
-            self.show_info_message(message=_('log_import_completed'))
-            self.map_rebuild_required = False
-            mainthread(self.open_view)("Screen_Map")
-            if ('p1a' in lcDM):
-                self.parse_dreamer_logs(zipBaseName)
+        return hasFc
+
+
+    def copy_log_file(self, binFile, importRef, binType):
+        '''
+        Copy a single log file into the app data directory. The file is copied under a temporary name first and only
+        referenced in the DB once it is complete, so a file listed in log_files is never truncated.
+        '''
+        binBaseName = os.path.basename(binFile)
+        targetFile = os.path.join(self.logfileDir, binBaseName)
+        shutil.copyfile(binFile, f"{targetFile}.part")
+        os.replace(f"{targetFile}.part", targetFile)
+        self.db.execute(
+            "INSERT OR IGNORE INTO log_files(filename, importref, bintype) VALUES(?,?,?)",
+            (binBaseName, importRef, binType)
+        )
+        self.save_log_file_meta(binBaseName, binType)
+
+
+    def save_log_file_meta(self, binBaseName, binType):
+        '''
+        Scan a log file and store its metadata (record counts, layout, time span, FPV platform) so it
+        can be looked up later without opening the file again.
+        '''
+        try:
+            meta = LogFileScanner().scan(os.path.join(self.logfileDir, binBaseName), binType)
+        except Exception as e:
+            print(f"Could not scan log file {binBaseName}: {e}")
+            return
+        self.db.execute(
+            "INSERT OR REPLACE INTO log_file_meta(filename, filesize, records, invalid_records, tail_bytes, layout, fpv_platform, first_ts, last_ts) VALUES(?,?,?,?,?,?,?,?,?)",
+            (binBaseName, meta['filesize'], meta['records'], meta['invalid_records'], meta['tail_bytes'], meta['layout'], meta['fpv_platform'], meta['first_ts'], meta['last_ts'])
+        )
+
+
+    def resume_imports(self):
+        '''
+        Resume imports that were interrupted, for instance because the app was killed. Imports for which
+        the zip file is no longer available and that did not get past copying the files are rolled back.
+        '''
+        journal = self.db.execute("SELECT importref, modelref, sourcefile, stage FROM import_journal ORDER BY updatedon")
+        resumable = []
+        for importRef, modelRef, sourceFile, stage in journal:
+            if stage == ImportStage.PARSING.value or os.path.isfile(sourceFile):
+                print(f"Resuming interrupted import of {importRef}")
+                resumable.append((modelRef, importRef, sourceFile))
             else:
-                if (not 'atom' in lcDM):
-                    self.show_warning_message(message=_('drone_not_supported').format(modelname=droneModel))
-                self.parse_atom_logs(zipBaseName)
-            mainthread(self.set_default_flight)()
-            mainthread(self.generate_map_layers)()
-            mainthread(self.select_flight)()
-            mainthread(self.select_drone_model)(droneModel)
-            mainthread(self.list_log_files)()
-        else:
-            self.show_warning_message(message=_('nothing_to_import'))
-        self.post_import_cleanup(selectedFile)
-        self.dialog_wait.dismiss()
+                print(f"Rolling back interrupted import of {importRef}")
+                self.purge_import(importRef)
+                self.db.execute("DELETE FROM import_journal WHERE importref = ?", (importRef,))
+                self.integrityChecker.start() # Collects the files that were already copied.
+        if len(resumable) > 0:
+            threading.Thread(target=self.resume_import_files, args=(resumable,)).start()
+
+
+    def resume_import_files(self, resumable):
+        for modelRef, importRef, sourceFile in resumable:
+            mainthread(self.dialog_wait.open)()
+            self.import_file(modelRef, importRef, sourceFile)
+
+
+    def purge_import(self, importRef):
+        '''
+        Delete the DB records of an import. The model is deleted as well if it has no imports left, in which case
+        True is returned. The log files are left for the integrity checker, which deletes unreferenced files.
+        '''
+        with self.db.transaction():
+            modelRef = self.db.execute("SELECT modelref FROM imports WHERE importref = ?", (importRef,))
+            self.db.execute("DELETE FROM imports WHERE importref = ?", (importRef,)) # Cascades to flight_stats, log_files and log_file_meta.
+            if self.telemetryDb is not None:
+                self.telemetryDb.delete_import(importRef)
+            if modelRef is not None and len(modelRef) > 0:
+                importCount = self.db.execute("SELECT count (1) FROM imports WHERE modelref = ?", (modelRef[0][0],))
+                if importCount is None or len(importCount) == 0 or importCount[0][0] == 0:
+                    self.db.execute("DELETE FROM models WHERE modelref = ?", (modelRef[0][0],))
+                    return True
+        return False
 
 
     def post_import_cleanup(self, selectedFile):
@@ -232,7 +355,10 @@ class MainApp(MDApp):
         Delete the import zip file. Applies to iOS only.
         '''
         if self.is_ios:
-            os.remove(selectedFile)
+            try:
+                os.remove(selectedFile)
+            except FileNotFoundError:
+                pass # A resumed import that was past copying the files may have deleted it already.
 
 
     def ios_doc_path(self):
@@ -438,63 +564,63 @@ class MainApp(MDApp):
         tileSource = self.root.ids.selected_mapsource.text
         mapSource = None
         if (tileSource == SelectableTileServer.GOOGLE_STANDARD.value):
-            mapSource = MapSource(url="https://mt0.google.com/vt/lyrs=m&hl=en&x={x}&y={y}&z={z}&s=Ga", cache_key="gmn", min_zoom=0, max_zoom=22, attribution="Google Maps") # Google Maps Normal 
+            mapSource = CachedMapSource(self.tile_cache("gmn", "png"), self.tileFetcher, url="https://mt0.google.com/vt/lyrs=m&hl=en&x={x}&y={y}&z={z}&s=Ga", cache_key="gmn", min_zoom=0, max_zoom=22, attribution="Google Maps") # Google Maps Normal 
         elif (tileSource == SelectableTileServer.GOOGLE_SATELLITE.value):
-            mapSource = MapSource(url="https://mt0.google.com/vt/lyrs=s&hl=en&x={x}&y={y}&z={z}&s=Ga", cache_key="gms", min_zoom=0, max_zoom=22, attribution="Google Maps") # Google Maps Satellite
+            mapSource = CachedMapSource(self.tile_cache("gms", "jpg"), self.tileFetcher, url="https://mt0.google.com/vt/lyrs=s&hl=en&x={x}&y={y}&z={z}&s=Ga", cache_key="gms", min_zoom=0, max_zoom=22, attribution="Google Maps") # Google Maps Satellite
         elif (tileSource == SelectableTileServer.OPEN_TOPO.value):
-            mapSource = MapSource(url="https://tile.opentopomap.org/{z}/{x}/{y}.png", cache_key="otm", min_zoom=0, max_zoom=18, attribution="Open Topo Map") # Open Topo Map
+            mapSource = CachedMapSource(self.tile_cache("otm", "png"), self.tileFetcher, url="https://tile.opentopomap.org/{z}/{x}/{y}.png", cache_key="otm", min_zoom=0, max_zoom=18, attribution="Open Topo Map") # Open Topo Map
         else:
-            mapSource = MapSource(cache_key="osm") # OpenStreetMap (default)
+            mapSource = CachedMapSource(self.tile_cache("osm", "png"), self.tileFetcher, cache_key="osm") # OpenStreetMap (default)
         self.root.ids.map.map_source = mapSource
         self.root.ids.waymap.map_source = mapSource
 
 
+    def tile_cache(self, cacheKey, imageExt):
+        '''
+        The tile cache DB of a map source, which serves its tiles as imageExt images (MBTiles format: png or jpg). It is
+        opened the first time the map source is selected.
+        '''
+        tileCache = self.tileCaches.get(cacheKey)
+        if tileCache is None:
+            cacheDir = self.root.ids.map.cache_dir
+            Path(cacheDir).mkdir(parents=True, exist_ok=True)
+            tileCache = TileCacheDb(os.path.join(cacheDir, f"{cacheKey}.mbtiles"), name=cacheKey, imageExt=imageExt, budgetBytes=self.tile_cache_budget(), slowQueryMs=self.dbSlowQueryMs)
+            self.tileCaches[cacheKey] = tileCache
+        return tileCache
+
+
+    def tile_cache_budget(self):
+        return int(re.sub(r"[^0-9]", "", Config.get('preferences', 'tile_cache_size'))) * 1048576
+
+
     def generate_map_layers(self):
         '''
         Called when checkbox for Path view is selected (to show or hide drone path on the map).
         '''
-        self.flightPaths = []
-        if not self.pathCoords:
+        self.flightPathLayer = None
+        if not self.pathLODs:
             return
-        color = self.assetColors[int(self.root.ids.selected_flight_path_color.value)]
-        for pathCoord in self.pathCoords:
-            flightPath = []
-            for pathSegment in pathCoord:
-                geojson = {
-                    "geojson": {
-                        "type": "Feature",
-                        "properties": {
-                            "stroke": color,
-                            "stroke-width": self.pathWidths[int(self.root.ids.selected_flight_path_width.value)]
-                        },
-                        "geometry": {
-                            "type": "LineString",
-                            "coordinates": pathSegment
-                        }
-                    }
-                }
-                maplayer = GeoJsonMapLayer(**geojson)
-                flightPath.append(maplayer)
-            self.flightPaths.append(flightPath)
+        self.flightPathLayer = FlightPathLayer(
+            self.pathLODs,
+            color=self.assetColors[int(self.root.ids.selected_flight_path_color.value)],
+            lineWidth=float(self.pathWidths[int(self.root.ids.selected_flight_path_width.value)]),
+            values=self.pathValues,
+            metric=PathMetric(Config.get('preferences', 'flight_path_metric'))
+        )
 
 
     def clear_map(self):
         '''
         Clear out the Map. Remove all markers, flight paths and layers.
         '''
-        self.stop_flight(True)
+        self.stop_flight()
         if self.layer_drone:
             self.root.ids.map.remove_marker(self.dronemarker)
             self.root.ids.map.remove_layer(self.layer_drone)
             self.layer_drone = None
             self.dronemarker = None
-        if self.flightPaths:
-            for flightPath in self.flightPaths:
-                for maplayer in flightPath:
-                    try:
-                        self.root.ids.map.remove_layer(maplayer)
-                    except:
-                        ... # Do nothing
+        if self.flightPathLayer and self.flightPathLayer.parent:
+            self.root.ids.map.remove_layer(self.flightPathLayer)
         if self.layer_ctrl:
             self.root.ids.map.remove_marker(self.ctrlmarker)
             self.root.ids.map.remove_layer(self.layer_ctrl)
@@ -511,9 +637,9 @@ class MainApp(MDApp):
         '''
         Build layers on the Map with markers and flight paths.
         '''
-        if not self.flightPaths:
+        if not self.flightPathLayer:
             return
-        self.stop_flight(True)
+        self.stop_flight()
         # Home Marker
         self.layer_home = MarkerMapLayer()
         self.layer_home.opacity = 1 if self.root.ids.selected_home_marker.active else 0
@@ -528,29 +654,17 @@ class MainApp(MDApp):
         self.root.ids.map.add_marker(self.ctrlmarker, self.layer_ctrl)
         # Flight Paths
         flightNum = 0 if (self.root.ids.selected_path.text == '--') else int(re.sub(r"[^0-9]", r"", self.root.ids.selected_path.text))
-        if (flightNum == 0):
-            # Show all flight paths in the log file.
-            for flightPath in self.flightPaths:
-                for maplayer in flightPath:
-                    self.root.ids.map.add_layer(maplayer)
-        else:
-            # Show selected flight path.
-            flightNum = int(re.sub(r"[^0-9]", r"", self.root.ids.selected_path.text))
-            flightPath = self.flightPaths[flightNum-1]
-            for maplayer in flightPath:
-                self.root.ids.map.add_layer(maplayer)
+        self.flightPathLayer.show_flight(flightNum) # 0 shows all flight paths in the log file.
+        self.root.ids.map.add_layer(self.flightPathLayer)
         # Drone Marker. This layer is always visible.
         self.layer_drone = MarkerMapLayer()
-        self.dronemarker = MapMarker(source=f"assets/Drone-{str(int(self.root.ids.selected_marker_drone_color.value)+1)}.png", anchor_y=0.5)
+        self.dronemarker = RotatingMapMarker(source=f"assets/Drone-{str(int(self.root.ids.selected_marker_drone_color.value)+1)}.png", anchor_y=0.5)
         self.root.ids.map.add_layer(self.layer_drone)
         self.root.ids.map.add_marker(self.dronemarker, self.layer_drone)
 
 
     def init_gauges(self):
-        self.root.ids.HSPDgauge.display_unit = self.common.speed_unit()
-        self.root.ids.VSPDgauge.display_unit = self.common.speed_unit()
-        self.root.ids.ALgauge.display_unit = self.common.dist_unit()
-        self.root.ids.DSgauge.display_unit = self.common.dist_unit()
+        self.root.ids.gauges.set_units(self.common.speed_unit(), self.common.dist_unit())
 
 
     def zoom_to_fit(self):
@@ -558,16 +672,17 @@ class MainApp(MDApp):
         Zooms the map so that the entire flight path will fit.
         '''
         flightNum = 0 if (self.root.ids.selected_path.text == '--') else int(re.sub(r"[^0-9]", r"", self.root.ids.selected_path.text))
-        # Find appropriate zoom level that shows the entire flight path.
-        zoom = self.root.ids.map.map_source.max_zoom
-        self.root.ids.map.zoom = zoom
-        self.root.ids.map.center_on(self.centerlat, self.centerlon)
-        while zoom > self.root.ids.map.map_source.min_zoom:
-            bbox = self.root.ids.map.get_bbox()
-            if self.flightStats[flightNum][4] >= bbox[0] and self.flightStats[flightNum][5] >= bbox[1] and self.flightStats[flightNum][6] <= bbox[2] and self.flightStats[flightNum][7] <= bbox[3]:
-                break
-            zoom = zoom - 1
-            self.root.ids.map.zoom = zoom
+        self.fit_map(self.root.ids.map, self.flightStats[flightNum][4], self.flightStats[flightNum][5], self.flightStats[flightNum][6], self.flightStats[flightNum][7])
+
+
+    def fit_map(self, mapview, latMin, lonMin, latMax, lonMax):
+        '''
+        Zoom and center a map in a single step, so that the bounding box fits.
+        '''
+        mapSource = mapview.map_source
+        zoom, lat, lon = fit_bbox(latMin, lonMin, latMax, lonMax, mapview.width, mapview.height, mapSource.min_zoom, mapSource.max_zoom, tileSize=mapSource.dp_tile_size)
+        mapview.zoom = zoom
+        mapview.center_on(lat, lon)
 
 
     def center_map(self):
@@ -695,146 +810,194 @@ class MainApp(MDApp):
         self.open_view("Screen_Log_Files")
 
 
-    def set_markers(self, updateSlider=True):
+    def flight_frame(self, rowIdx):
         '''
-        Update ctrl/home/drone markers on the map as well as other labels with flight information.
+        The display values of a record of the selected flight, built on first use and kept until another flight is
+        selected, so showing a frame again during playback is a lookup.
         '''
-        if not self.currentRowIdx:
-            return
-        record = self.logdata[self.currentRowIdx]
-        rthDesc = "RTH" if record[self.columns.index('rth')] == 1 else ''
-        batteryLevel = record[self.columns.index('batterylevel')]
-        batLevelRnd = math.floor(batteryLevel / 10 + 0.5) * 10 # round to nearest 10.
-        batteryTemp = record[self.columns.index('batterytemp')]
-        batteryVoltage = locale.format_string("%.1f", round(record[self.columns.index('batteryvoltage')], 1), grouping=True, monetary=False)
-        batteryCurrent = locale.format_string("%.1f", round(record[self.columns.index('batterycurrent')]/1000, 1), grouping=True, monetary=False)
-        flightMode = record[self.columns.index('flightmode')]
-        dronestatus = record[self.columns.index('dronestatus')]
-
-        self.root.ids.value1_alt.text = f"{record[self.columns.index('altitude2')]} {self.common.dist_unit()}"
-        self.root.ids.value1_traveled.text = f"{record[self.columns.index('traveled')]} {self.common.dist_unit()}"
-        self.root.ids.value1_traveled_short.text = f"({self.common.shorten_dist_val(record[self.columns.index('traveled')])} {self.common.dist_unit_km()})"
-        self.root.ids.value1_flightmode.text = flightMode
-        self.root.ids.value1_dist.text = f"{record[self.columns.index('distance3')]} {self.common.dist_unit()}"
-        self.root.ids.value1_hspeed.text = f"{record[self.columns.index('speed2')]} {self.common.speed_unit()}"
-        self.root.ids.value1_vspeed.text = f"{record[self.columns.index('speed2vert')]} {self.common.speed_unit()}"
-
-        self.root.ids.value1_batterylevel1.text = f"{record[self.columns.index('batterylevel')]}% / {batteryVoltage}V"
-        self.root.ids.value1_batterylevel2.text = f"{batteryTemp}C / {batteryCurrent}A"
-        self.root.ids.value1_rth_desc.text = dronestatus if len(rthDesc) == 0 else rthDesc
-        elapsed = record[5]
-        elapsed = elapsed - datetime.timedelta(microseconds=elapsed.microseconds) # truncate to milliseconds
-        self.root.ids.value1_elapsed.text = str(elapsed)
+        frame = self.frames.get(rowIdx)
+        if frame is None:
+            frame = self.build_frame(self.logdata[rowIdx])
+            self.frames[rowIdx] = frame
+        return frame
 
-        self.root.ids.battery_level.icon = "battery" if batLevelRnd == 100 else f"battery-{batLevelRnd}"
-        self.root.ids.battery_level.icon_color = "red" if batteryLevel < 30 else "orange" if batteryLevel < 65 else "green"
-        self.root.ids.flight_mode.icon = "alpha-v-box" if flightMode == FlightMode.VIDEO.value else "alpha-s-box" if flightMode == FlightMode.SPORT.value else "alpha-n-box" if flightMode == FlightMode.NORMAL.value else "crosshairs-question"
-        self.root.ids.flight_mode.icon_color = "green" if flightMode == FlightMode.VIDEO.value else "orange" if flightMode == FlightMode.SPORT.value else "blue" if flightMode == FlightMode.NORMAL.value else "red"
-        self.root.ids.drone_connection.icon = "signal" if record[self.columns.index('droneconnected')] == 1 else "signal-off"
-        self.root.ids.drone_connection.icon_color = "green" if record[self.columns.index('droneconnected')] == 1 else "red"
-        self.root.ids.drone_action.icon = "airplane-marker" if record[self.columns.index('rth')] == 1 else "airplane-takeoff" if dronestatus == DroneStatus.LIFT.value else "airplane-landing" if dronestatus == DroneStatus.LANDING.value else "airplane" if dronestatus == DroneStatus.FLYING.value else "car-break-parking" if dronestatus == DroneStatus.IDLE.value else "crosshairs-question"
-        self.root.ids.drone_action.icon_color = "red" if record[self.columns.index('rth')] == 1 else "orange" if dronestatus == DroneStatus.LIFT.value else "orange" if dronestatus == DroneStatus.LANDING.value else "green" if dronestatus == DroneStatus.FLYING.value else "blue" if dronestatus == DroneStatus.IDLE.value else "red"
 
+    def build_frame(self, record):
+        '''
+        Labels and icons as (widget id, property, value), the gauge values, the slider position and the marker
+        positions of a record.
+        '''
+        col = self.columnIdx
+        distUnit = self.common.dist_unit()
+        speedUnit = self.common.speed_unit()
+        rth = record[col['rth']] == 1
+        droneConnected = record[col['droneconnected']] == 1
+        batteryLevel = record[col['batterylevel']]
+        batLevelRnd = math.floor(batteryLevel / 10 + 0.5) * 10 # round to nearest 10.
+        batteryVoltage = locale.format_string("%.1f", round(record[col['batteryvoltage']], 1), grouping=True, monetary=False)
+        batteryCurrent = locale.format_string("%.1f", round(record[col['batterycurrent']]/1000, 1), grouping=True, monetary=False)
+        flightMode = record[col['flightmode']]
+        dronestatus = record[col['dronestatus']]
+        altitude = record[col['altitude2']]
+        distance = record[col['distance3']]
+        hSpeed = record[col['speed2']]
+        vSpeed = record[col['speed2vert']]
+        traveledShort = self.common.shorten_dist_val(record[col['traveled']])
+        rotation = self.rotation(record[col['orientation2']])
+        elapsed = record[col['time']]
+        elapsed = elapsed - datetime.timedelta(microseconds=elapsed.microseconds) # truncate to milliseconds
+        labels = (
+            ('value1_alt', 'text', f"{altitude} {distUnit}"),
+            ('value1_traveled', 'text', f"{record[col['traveled']]} {distUnit}"),
+            ('value1_traveled_short', 'text', f"({traveledShort} {self.common.dist_unit_km()})"),
+            ('value1_flightmode', 'text', flightMode),
+            ('value1_dist', 'text', f"{distance} {distUnit}"),
+            ('value1_hspeed', 'text', f"{hSpeed} {speedUnit}"),
+            ('value1_vspeed', 'text', f"{vSpeed} {speedUnit}"),
+            ('value1_batterylevel1', 'text', f"{batteryLevel}% / {batteryVoltage}V"),
+            ('value1_batterylevel2', 'text', f"{record[col['batterytemp']]}C / {batteryCurrent}A"),
+            ('value1_rth_desc', 'text', "RTH" if rth else dronestatus),
+            ('value1_elapsed', 'text', str(elapsed)),
+            ('battery_level', 'icon', "battery" if batLevelRnd == 100 else f"battery-{batLevelRnd}"),
+            ('battery_level', 'icon_color', "red" if batteryLevel < 30 else "orange" if batteryLevel < 65 else "green"),
+            ('flight_mode', 'icon', "alpha-v-box" if flightMode == FlightMode.VIDEO.value else "alpha-s-box" if flightMode == FlightMode.SPORT.value else "alpha-n-box" if flightMode == FlightMode.NORMAL.value else "crosshairs-question"),
+            ('flight_mode', 'icon_color', "green" if flightMode == FlightMode.VIDEO.value else "orange" if flightMode == FlightMode.SPORT.value else "blue" if flightMode == FlightMode.NORMAL.value else "red"),
+            ('drone_connection', 'icon', "signal" if droneConnected else "signal-off"),
+            ('drone_connection', 'icon_color', "green" if droneConnected else "red"),
+            ('drone_action', 'icon', "airplane-marker" if rth else "airplane-takeoff" if dronestatus == DroneStatus.LIFT.value else "airplane-landing" if dronestatus == DroneStatus.LANDING.value else "airplane" if dronestatus == DroneStatus.FLYING.value else "car-break-parking" if dronestatus == DroneStatus.IDLE.value else "crosshairs-question"),
+            ('drone_action', 'icon_color', "red" if rth else "orange" if dronestatus == DroneStatus.LIFT.value else "orange" if dronestatus == DroneStatus.LANDING.value else "green" if dronestatus == DroneStatus.FLYING.value else "blue" if dronestatus == DroneStatus.IDLE.value else "red"),
+            ('map_metrics_ribbon', 'text', f" {_('map_time')} {'{:>6}'.format(str(elapsed))[-5:]} | {_('map_dist')} {'{:>9}'.format(distance)} {distUnit} | {_('map_alt')} {'{:>6}'.format(altitude)} {distUnit} | {_('map_hs')} {'{:>5}'.format(hSpeed)} {speedUnit}" + (f" | {_('map_vs')} {'{:>6}'.format(vSpeed)} {speedUnit}" if self.is_desktop else "") + f" | {_('map_sats')} {'{:>2}'.format(record[col['satellites']])} | {_('map_distance_flown')} {traveledShort} {self.common.dist_unit_km()}")
+        )
         # TODO - Implement later, need new widgets
-        #self.root.ids.map_img_roll.source = self.get_roll_icon_source()
-        #self.root.ids.map_img_wind.source = self.get_wind_icon_source()
-
-        if self.root.ids.selected_gauges.active:
-            # Set horizontal, vertical and altitude gauge values. Use rounded values.
-            self.root.ids.HSPDgauge.value = round(locale.atof(record[self.columns.index('speed2')]))
-            # "peg out" the gauge if beyond the vertical limits
-            if abs(round(locale.atof(record[self.columns.index('speed2vert')])) > 14):
-                self.root.ids.VSPDgauge.value = 14
-            else: 
-                self.root.ids.VSPDgauge.value = round(locale.atof(record[self.columns.index('speed2vert')]))
-
-            self.root.ids.ALgauge.value = round(locale.atof(record[self.columns.index('altitude2')]))
-            self.root.ids.DSgauge.value = round(locale.atof(record[self.columns.index('distance3')]))
-
-            # Set up vars for HDgauge calcs
-            if self.root.ids.value_duration.text == "":
-                self.head_lat_2 = float(record[self.columns.index('dronelat')])
-                self.head_lon_2 = float(record[self.columns.index('dronelon')])
-            else:
-                head_lat_1 = self.head_lat_2
-                head_lon_1 = self.head_lon_2
-                self.head_lat_2 = float(record[self.columns.index('dronelat')])
-                self.head_lon_2 = float(record[self.columns.index('dronelon')])
-                # determine bearing.
-                dLon = (self.head_lon_2 - head_lon_1)
-                x = math.cos(math.radians(self.head_lat_2)) * math.sin(math.radians(dLon))
-                y = math.cos(math.radians(head_lat_1)) * math.sin(math.radians(self.head_lat_2)) - math.sin(math.radians(head_lat_1)) * math.cos(math.radians(self.head_lat_2)) * math.cos(math.radians(dLon))
-                brng = math.atan2(x,y)
-                brng = math.degrees(brng)
-                G_orientation = round(math.degrees(record[self.columns.index('orientation2')])) # Drone orientation in degrees, -180 to 180.
-                G_rotation = abs(G_orientation) if G_orientation <= 0 else 360 - G_orientation # Convert to 0 - 359 range.
-                self.root.ids.HDgauge.value = G_rotation
-
-        if self.is_desktop:
-            self.root.ids.map_metrics_ribbon.text = f" {_('map_time')} {'{:>6}'.format(str(elapsed))[-5:]} | {_('map_dist')} {'{:>9}'.format(record[self.columns.index('distance3')])} {self.common.dist_unit()} | {_('map_alt')} {'{:>6}'.format(record[self.columns.index('altitude2')])} {self.common.dist_unit()} | {_('map_hs')} {'{:>5}'.format(record[self.columns.index('speed2')])} {self.common.speed_unit()} | {_('map_vs')} {'{:>6}'.format(record[self.columns.index('speed2vert')])} {self.common.speed_unit()} | {_('map_sats')} {'{:>2}'.format(record[self.columns.index('satellites')])} | {_('map_distance_flown')} {self.common.shorten_dist_val(record[self.columns.index('traveled')])} {self.common.dist_unit_km()}"
-        else:
-            self.root.ids.map_metrics_ribbon.text = f" {_('map_time')} {'{:>6}'.format(str(elapsed))[-5:]} | {_('map_dist')} {'{:>9}'.format(record[self.columns.index('distance3')])} {self.common.dist_unit()} | {_('map_alt')} {'{:>6}'.format(record[self.columns.index('altitude2')])} {self.common.dist_unit()} | {_('map_hs')} {'{:>5}'.format(record[self.columns.index('speed2')])} {self.common.speed_unit()} | {_('map_sats')} {'{:>2}'.format(record[self.columns.index('satellites')])} | {_('map_distance_flown')} {self.common.shorten_dist_val(record[self.columns.index('traveled')])} {self.common.dist_unit_km()}"
-
-        if updateSlider:
-            if self.root.ids.value_duration.text != "":
-                durstr = self.root.ids.value_duration.text.split(":")
-                durval = datetime.timedelta(hours=int(durstr[0]), minutes=int(durstr[1]), seconds=int(durstr[2]))
-                if durval != 0: # Prevent division by zero
-                    self.root.ids.flight_progress.value = elapsed / durval * 100
-                else:
-                    self.root.ids.flight_progress.value = 0
-        # Controller Marker.
+        #self.root.ids.map_img_roll.rotation = self.get_rotation('roll')
+        #self.root.ids.map_img_wind.rotation = self.get_rotation('winddirection')
+        gauges = self.gauge_values([round(value) for value in self.gauge_readings(record)] + [rotation])
+        markers = {}
         try:
-            ctrllat = float(record[self.columns.index('ctrllat')])
-            ctrllon = float(record[self.columns.index('ctrllon')])
-            self.ctrlmarker.lat = ctrllat
-            self.ctrlmarker.lon = ctrllon
+            markers['ctrl'] = (float(record[col['ctrllat']]), float(record[col['ctrllon']]))
         except:
             ... # Do nothing
-        # Drone Home (RTH) Marker.
         try:
-            homelat = float(record[self.columns.index('homelat')])
-            homelon = float(record[self.columns.index('homelon')])
-            self.homemarker.lat = homelat
-            self.homemarker.lon = homelon
+            markers['home'] = (float(record[col['homelat']]), float(record[col['homelon']]))
         except:
             ... # Do nothing
-        # Drone marker.
         try:
-            dronelat = float(record[self.columns.index('dronelat')])
-            dronelon = float(record[self.columns.index('dronelon')])
-            self.dronemarker.lat = dronelat
-            self.dronemarker.lon = dronelon
-            self.dronemarker.source = self.get_drone_icon_source()
+            markers['drone'] = (float(record[col['dronelat']]), float(record[col['dronelon']]))
         except:
             ... # Do nothing
+        return {
+            'labels': labels,
+            'gauges': gauges,
+            'progress': elapsed.total_seconds() / self.flightDuration * 100 if self.flightDuration > 0 else 0,
+            'markers': markers,
+            'rotation': rotation
+        }
+
+
+    def gauge_readings(self, record):
+        '''
+        Horizontal speed, vertical speed, altitude and distance of a record as numbers, for the gauges.
+        '''
+        col = self.columnIdx
+        return [locale.atof(record[col[column]]) for column in ('speed2', 'speed2vert', 'altitude2', 'distance3')]
+
+
+    def gauge_values(self, values):
+        '''
+        The values for GaugeCluster.set_values() from the horizontal speed, vertical speed, altitude, distance and
+        heading. The vertical speed gauge is "pegged out" beyond its limits.
+        '''
+        hSpeed, vSpeed, altitude, distance, heading = values
+        return (distance, altitude, hSpeed, 14 if abs(vSpeed) > 14 else vSpeed, heading)
+
+
+    def track_point(self, rowIdx):
+        '''
+        Numeric readings of a record of the selected flight to interpolate the drone between records: position (None
+        when it cannot be read), heading and gauge readings. Built on first use and kept like the frames.
+        '''
+        point = self.trackPoints.get(rowIdx)
+        if point is None:
+            record = self.logdata[rowIdx]
+            col = self.columnIdx
+            try:
+                position = (float(record[col['dronelat']]), float(record[col['dronelon']]))
+            except:
+                position = None
+            point = (position, [self.rotation(record[col['orientation2']])] + self.gauge_readings(record))
+            self.trackPoints[rowIdx] = point
+        return point
+
+
+    def show_values(self, values):
+        '''
+        Assign (widget id, property, value) to the widgets, skipping the ones that still show that value.
+        '''
+        ids = self.root.ids
+        for widgetId, prop, value in values:
+            if self.shownValues.get((widgetId, prop)) != value:
+                setattr(ids[widgetId], prop, value)
+                self.shownValues[(widgetId, prop)] = value
+
+
+    def set_markers(self, updateSlider=True, updateDrone=True):
+        '''
+        Update ctrl/home/drone markers on the map as well as other labels with flight information. During playback
+        the drone and gauges are moved by playback_motion instead (updateDrone False).
+        '''
+        if not self.currentRowIdx:
+            return
+        frame = self.flight_frame(self.currentRowIdx)
+        self.show_values(frame['labels'])
+        if updateDrone and self.root.ids.selected_gauges.active:
+            self.root.ids.gauges.set_values(*frame['gauges'])
+
+        if updateSlider:
+            self.root.ids.flight_progress.value = frame['progress']
+        markers = frame['markers']
+        # Controller Marker.
+        if self.ctrlmarker is not None and 'ctrl' in markers:
+            self.ctrlmarker.lat, self.ctrlmarker.lon = markers['ctrl']
+        # Drone Home (RTH) Marker.
+        if self.homemarker is not None and 'home' in markers:
+            self.homemarker.lat, self.homemarker.lon = markers['home']
+        # Drone marker.
+        if updateDrone and self.dronemarker is not None and 'drone' in markers:
+            self.dronemarker.lat, self.dronemarker.lon = markers['drone']
+            self.dronemarker.rotation = frame['rotation']
         self.root.ids.map.trigger_update(False)
 
 
-    def set_frame(self):
+    def playback_frame(self, rowIdx):
         '''
-        Update ctrl/home/drone markers on the map with the next set of coordinates in the table list.
+        Show a frame of the flight playback. The slider and the drone are moved by playback_motion.
         '''
-        self.root.ids.flight_progress.is_updating = True
-        self.isPlaying = True
-        self.root.ids.playbutton.icon = "pause"
-        refreshRate = float(re.sub(r"[^0-9\.]", "", self.root.ids.selected_refresh_rate.text))
-        totalTimeElapsed = self.logdata[self.currentRowIdx][self.columns.index('time')]
-        prevTs = None
-        timeElapsed = None
-        while (not self.stopRequested) and (self.currentRowIdx < self.currentEndIdx):
-            mainthread(self.set_markers)()
-            time.sleep(refreshRate)
-            now = datetime.datetime.now()
-            timeElapsed = now - prevTs if prevTs else datetime.timedelta()
-            if self.playback_speed > 1:
-                timeElapsed = timeElapsed * self.playback_speed
-            totalTimeElapsed = totalTimeElapsed + timeElapsed
-            prevTs = now
-            while self.currentRowIdx <= self.currentEndIdx and self.logdata[self.currentRowIdx][self.columns.index('time')] < totalTimeElapsed:
-                self.currentRowIdx = self.currentRowIdx + 1
-        self.isPlaying = False
-        self.stopRequested = False
+        self.currentRowIdx = rowIdx
+        self.set_markers(False, False)
+
+
+    def playback_motion(self, rowIdx, fraction, flightTime):
+        '''
+        Move the drone, gauges and slider between records on every display frame of the flight playback.
+        '''
+        position, readings = self.track_point(rowIdx)
+        if fraction > 0 and rowIdx < self.currentEndIdx:
+            nextPosition, nextReadings = self.track_point(rowIdx + 1)
+            readings = interpolate(readings, nextReadings, fraction, angles=(0,))
+            if position is not None and nextPosition is not None:
+                position = interpolate(position, nextPosition, fraction)
+        if self.dronemarker is not None and position is not None:
+            self.dronemarker.lat, self.dronemarker.lon = position
+            self.dronemarker.rotation = readings[0]
+        if self.root.ids.selected_gauges.active:
+            self.root.ids.gauges.set_values(*self.gauge_values(readings[1:] + readings[:1]))
+        if self.flightDuration > 0:
+            self.root.ids.flight_progress.value = min(flightTime / self.flightDuration * 100, 100)
+        self.root.ids.map.trigger_update(False)
+
+
+    def playback_stopped(self):
+        self.set_markers() # Settle the drone, gauges and slider on the current record.
         self.root.ids.playbutton.icon = "play"
         self.root.ids.flight_progress.is_updating = False
 
@@ -846,30 +1009,19 @@ class MainApp(MDApp):
             return # Do nothing
         if (self.root.ids.selected_path.text == '--'):
             return # Do nothing
-        # Determine approximate selected duration based on slider position
-        durstr = self.root.ids.value_duration.text.split(":")
-        durval = datetime.timedelta(hours=int(durstr[0]), minutes=int(durstr[1]), seconds=int(durstr[2]))
-        newdur = durval / 100 * slider.value
-        minDiff = None
-        nearestIdx = -1
-        for idx in range(self.currentStartIdx, self.currentEndIdx+1):
-            dur = self.logdata[idx][self.columns.index('time')]
-            diff = abs(dur-newdur)
-            if not minDiff:
-                minDiff = diff
-                nearestIdx = idx
-            elif diff < minDiff:
-                minDiff = diff
-                nearestIdx = idx
-            elif diff > minDiff:
-                break
-        if nearestIdx >= 0:
-            self.currentRowIdx = nearestIdx
+        # Find the record nearest to the time at the slider position.
+        newTime = self.flightDuration * slider.value / 100
+        pos = bisect.bisect_left(self.flightTimes, newTime)
+        if pos == len(self.flightTimes) or (pos > 0 and newTime - self.flightTimes[pos-1] <= self.flightTimes[pos] - newTime):
+            pos = pos - 1
+        if pos >= 0 and self.currentStartIdx + pos != self.currentRowIdx:
+            self.currentRowIdx = self.currentStartIdx + pos
             self.set_markers(False)
 
 
     def change_playback_speed(self):
         self.playback_speed = self.playback_speed << 1 if self.playback_speed < 16 else 1
+        self.playback.speed = self.playback_speed
         self.root.ids.speed_indicator.icon = f"numeric-{self.playback_speed}-box" if self.playback_speed < 16 else f"rocket-launch"
 
 
@@ -883,7 +1035,7 @@ class MainApp(MDApp):
         if (self.root.ids.selected_path.text == '--'):
             self.show_info_message(message=_('no_flight_selected'))
             return
-        self.stop_flight(True)
+        self.stop_flight()
         if self.currentRowIdx > self.currentStartIdx:
             self.currentRowIdx = self.currentStartIdx
             self.root.ids.flight_progress.is_updating = True
@@ -913,7 +1065,7 @@ class MainApp(MDApp):
         if (self.root.ids.selected_path.text == '--'):
             self.show_info_message(message=_('no_flight_selected'))
             return
-        self.stop_flight(True)
+        self.stop_flight()
         if self.currentRowIdx < self.currentEndIdx:
             self.currentRowIdx = self.currentEndIdx
             self.root.ids.flight_progress.is_updating = True
@@ -937,9 +1089,8 @@ class MainApp(MDApp):
         '''
         Start or resume playback of the selected flight. If flight is finished, restart from beginning.
         '''
-        self.stopRequested = False
-        if (self.isPlaying):
-            self.stop_flight(True)
+        if self.playback.is_playing():
+            self.stop_flight()
             return
         if len(self.logdata) == 0:
             self.show_warning_message(message=_('no_data_to_play_back'))
@@ -949,19 +1100,17 @@ class MainApp(MDApp):
             return
         if self.currentRowIdx == self.currentEndIdx:
             self.currentRowIdx = self.currentStartIdx
-        threading.Thread(target=self.set_frame, args=()).start()
+        refreshRate = float(re.sub(r"[^0-9\.]", "", self.root.ids.selected_refresh_rate.text))
+        self.root.ids.flight_progress.is_updating = True
+        self.root.ids.playbutton.icon = "pause"
+        self.playback.start(self.flightTimes, self.currentStartIdx, self.currentRowIdx, refreshRate, self.playback_speed)
 
 
-    def stop_flight(self, wait=False):
+    def stop_flight(self):
         '''
         Stop flight playback.
         '''
-        if not self.isPlaying:
-            return
-        self.stopRequested = True
-        if wait:
-            while (self.isPlaying):
-                time.sleep(0.25)
+        self.playback.stop()
 
 
     def flight_path_width_selection(self, slider, coords):
@@ -985,61 +1134,103 @@ class MainApp(MDApp):
         self.map_rebuild_required = True
 
 
-    def get_drone_icon_source(self):
+    def open_path_metric_selection(self, item):
         '''
-        Return reference to the drone icon image. If it needs to be rotated, it will be generated from the base icon image.
+        Flight Path colouring dropdown functions. Opened from the Preferences and from the Map.
         '''
-        base_filename = f"Drone-{str(int(self.root.ids.selected_marker_drone_color.value)+1)}"
-        if not self.currentRowIdx:
-            # Return base image if there is no current rotation (orientation).
-            return f"assets/{base_filename}.png"
-        record = self.logdata[self.currentRowIdx]
-        orientation = round(math.degrees(record[self.columns.index('orientation2')])) # Drone orientation in degrees, -180 to 180.
-        rotation = abs(orientation) if orientation <= 0 else 360 - orientation # Convert to 0 - 359 range.
-        rotated_filename = os.path.join(self.root.ids.map.cache_dir, f"{base_filename}-{rotation}.png")
-        if not os.path.exists(rotated_filename):
-            drone_base_icon = PILImage.open(f"assets/{base_filename}.png")
-            drone_rotated_icon = drone_base_icon.rotate(rotation, expand=True)
-            drone_rotated_icon.save(rotated_filename)
-        return rotated_filename
+        menu_items = []
+        for pathMetric in PathMetric:
+            menu_items.append({"text": _(f"path_metric_{pathMetric.value}"), "on_release": lambda x=pathMetric: self.path_metric_selection_callback(x)})
+        self.path_metric_selection_menu = MDDropdownMenu(caller = item, items = menu_items)
+        self.path_metric_selection_menu.open()
+    def path_metric_selection_callback(self, pathMetric):
+        self.root.ids.selected_path_metric.text = _(f"path_metric_{pathMetric.value}")
+        self.path_metric_selection_menu.dismiss()
+        Config.set('preferences', 'flight_path_metric', pathMetric.value)
+        Config.write()
+        if self.flightPathLayer:
+            self.flightPathLayer.set_metric(pathMetric) # Colours are cached by the layer, no need to rebuild the map.
 
 
-    def get_roll_icon_source(self):
+    def open_heatmap_selection(self, item):
         '''
-        Return reference to the roll icon image. If it needs to be rotated, it will be generated from the base icon image.
+        Heatmap dropdown functions. The heatmap covers all imports of the selected drone model.
         '''
-        base_filename = f"roll"
-        if not self.currentRowIdx:
-            # Return base image if there is no current rotation (orientation).
-            return f"assets/{base_filename}.png"
-        record = self.logdata[self.currentRowIdx]
-        orientation = round(math.degrees(record[self.columns.index('roll')])) # Drone roll in degrees, -180 to 180.
-        rotation = abs(orientation) if orientation <= 0 else 360 - orientation # Convert to 0 - 359 range.
-        rotated_filename = os.path.join(self.root.ids.map.cache_dir, f"{base_filename}-{rotation}.png")
-        if not os.path.exists(rotated_filename):
-            drone_base_icon = PILImage.open(f"assets/{base_filename}.png")
-            drone_rotated_icon = drone_base_icon.rotate(rotation, expand=False)
-            drone_rotated_icon.save(rotated_filename)
-        return rotated_filename
+        menu_items = []
+        for heatmapMetric in HeatmapMetric:
+            menu_items.append({"text": _(f"heatmap_metric_{heatmapMetric.value}"), "on_release": lambda x=heatmapMetric: self.heatmap_selection_callback(x)})
+        self.heatmap_selection_menu = MDDropdownMenu(caller = item, items = menu_items)
+        self.heatmap_selection_menu.open()
+    def heatmap_selection_callback(self, heatmapMetric):
+        self.heatmap_selection_menu.dismiss()
+        Config.set('preferences', 'heatmap_metric', heatmapMetric.value)
+        Config.write()
+        self.show_heatmap()
+
+
+    def show_heatmap(self):
+        heatmapMetric = HeatmapMetric(Config.get('preferences', 'heatmap_metric'))
+        if heatmapMetric == HeatmapMetric.NONE:
+            if self.heatmapLayer:
+                self.root.ids.map.remove_layer(self.heatmapLayer)
+                self.heatmapLayer = None
+        elif self.heatmapLayer:
+            self.heatmapLayer.set_metric(heatmapMetric)
+        else:
+            self.heatmapLayer = HeatmapLayer(self.load_heatmap_cells, heatmapMetric)
+            self.root.ids.map.add_layer(self.heatmapLayer)
+
+
+    def load_heatmap_cells(self, level, cellRange, callback):
+        self.asyncDb.call(self.db.heatmap_cells, self.root.ids.selected_model.text, level, *cellRange, callback=callback, write=False)
 
 
-    def get_wind_icon_source(self):
+    def toggle_archive_overlay(self):
         '''
-        Return reference to the wind direction icon image. If it needs to be rotated, it will be generated from the base icon image.
+        Show or hide the flights of all imports of the selected drone model on the map.
+        '''
+        Config.set('preferences', 'archive_overlay', not Config.getboolean('preferences', 'archive_overlay'))
+        Config.write()
+        self.show_archive_overlay()
+
+
+    def show_archive_overlay(self):
+        if not Config.getboolean('preferences', 'archive_overlay'):
+            if self.archivePathLayer:
+                self.root.ids.map.remove_layer(self.archivePathLayer)
+                self.archivePathLayer = None
+        elif not self.archivePathLayer:
+            self.archivePathLayer = ArchivePathLayer(self.load_archive_paths, self.archivePathColor, self.archivePathWidth)
+            self.root.ids.map.add_layer(self.archivePathLayer)
+
+
+    def load_archive_paths(self, detail, bbox, loadedIds, callback):
+        self.asyncDb.call(self.db.archive_paths, self.root.ids.selected_model.text, detail, *bbox, loadedIds, callback=callback, write=False)
+
+
+    def reload_archive_layers(self):
+        if self.heatmapLayer:
+            self.heatmapLayer.reload()
+        if self.archivePathLayer:
+            self.archivePathLayer.reload()
+
+
+    def get_rotation(self, column):
+        '''
+        Rotation in degrees (0 - 359, counter-clockwise) of an angle reading of the current record, e.g. the drone
+        orientation, to rotate an icon with.
         '''
-        base_filename = f"wind"
         if not self.currentRowIdx:
-            # Return base image if there is no current rotation (orientation).
-            return f"assets/{base_filename}.png"
-        record = self.logdata[self.currentRowIdx]
-        orientation = round(math.degrees(record[self.columns.index('winddirection')])) # Wind Direction in degrees, -180 to 180.
-        rotation = abs(orientation) if orientation <= 0 else 360 - orientation # Convert to 0 - 359 range.
-        rotated_filename = os.path.join(self.root.ids.map.cache_dir, f"{base_filename}-{rotation}.png")
-        if not os.path.exists(rotated_filename):
-            drone_base_icon = PILImage.open(f"assets/{base_filename}.png")
-            drone_rotated_icon = drone_base_icon.rotate(rotation, expand=False)
-            drone_rotated_icon.save(rotated_filename)
-        return rotated_filename
+            return 0
+        return self.rotation(self.logdata[self.currentRowIdx][self.columnIdx[column]])
+
+
+    def rotation(self, angle):
+        '''
+        Convert an angle reading in radians, -pi to pi, to a rotation in degrees.
+        '''
+        orientation = round(math.degrees(angle)) # Degrees, -180 to 180.
+        return abs(orientation) if orientation <= 0 else 360 - orientation # Convert to 0 - 359 range.
 
 
     def marker_drone_color_selection(self, slider, coords):
@@ -1052,7 +1243,7 @@ class MainApp(MDApp):
         Config.set('preferences', 'marker_drone_color', colorIdx)
         Config.write()
         if self.dronemarker:
-            self.dronemarker.source = self.get_drone_icon_source()
+            self.dronemarker.source = f"assets/Drone-{str(colorIdx+1)}.png"
             self.set_markers()
 
 
@@ -1102,8 +1293,10 @@ class MainApp(MDApp):
         self.select_flight()
 
 
-    def set_default_flight(self):
-        if len(self.flightOptions) > 0:
+    def set_default_flight(self, flightNum=None):
+        if flightNum is not None and f"{flightNum}" in self.flightOptions:
+            self.root.ids.selected_path.text = f"{flightNum}"
+        elif len(self.flightOptions) > 0:
             self.root.ids.selected_path.text = self.flightOptions[0]
         else:
             self.root.ids.selected_path.text = "--"
@@ -1111,6 +1304,9 @@ class MainApp(MDApp):
 
     def select_flight(self, skip_to_end=False):
         self.clear_map()
+        self.frames = {}
+        self.trackPoints = {}
+        self.shownValues = {}
         self.init_map_layers()
         flightNum = 0 if (self.root.ids.selected_path.text == '--') else int(re.sub(r"[^0-9]", r"", self.root.ids.selected_path.text))
         if (flightNum == 0):
@@ -1132,6 +1328,10 @@ class MainApp(MDApp):
         else:
             self.currentStartIdx = self.flightStarts[self.root.ids.selected_path.text]
             self.currentEndIdx = self.flightEnds[self.root.ids.selected_path.text]
+            timeCol = self.columnIdx['time']
+            self.flightTimes = [self.logdata[idx][timeCol].total_seconds() for idx in range(self.currentStartIdx, self.currentEndIdx+1)]
+            duration = self.flightStats[flightNum][3] if self.flightStats and len(self.flightStats) > flightNum else None
+            self.flightDuration = duration.total_seconds() if duration else self.flightTimes[-1]
             if skip_to_end:
                 self.currentRowIdx = self.currentEndIdx
             else:
@@ -1182,6 +1382,113 @@ class MainApp(MDApp):
         Config.write()
 
 
+    def tile_cache_size_selection(self, item):
+        '''
+        Change the Map Tile Cache Size (Preferences).
+        '''
+        menu_items = []
+        for tileCacheSize in self.tileCacheSizes:
+            menu_items.append({"text": tileCacheSize, "on_release": lambda x=tileCacheSize: self.tile_cache_size_selection_callback(x)})
+        self.tile_cache_size_selection_menu = MDDropdownMenu(caller = item, items = menu_items)
+        self.tile_cache_size_selection_menu.open()
+    def tile_cache_size_selection_callback(self, text_item):
+        self.root.ids.selected_tile_cache_size.text = text_item
+        self.tile_cache_size_selection_menu.dismiss()
+        Config.set('preferences', 'tile_cache_size', text_item)
+        Config.write()
+        for tileCache in self.tileCaches.values():
+            tileCache.set_budget(self.tile_cache_budget())
+
+
+    def export_tile_pack(self):
+        '''
+        Save the cached tiles of the selected map source as an MBTiles file, i.e. to use on another device.
+        '''
+        mapSource = self.root.ids.map.map_source
+        dtpart = re.sub("[^0-9]", "", datetime.datetime.now().isoformat())
+        packName = f"{self.appPathName}_{mapSource.cache_key}_Tiles_{dtpart}.mbtiles"
+        if self.is_android:
+            packFile = os.path.join(self.shared_storage.get_cache_dir(), packName)
+            try:
+                mapSource.tileCache.export_pack(packFile)
+                url = self.shared_storage.copy_to_shared(packFile)
+                ShareSheet().share_file(url)
+            except Exception as e:
+                msg = _('error_tile_pack').format(filename=packFile, error=e)
+                print(msg)
+                self.show_error_message(message=msg)
+        elif self.is_ios:
+            packFile = os.path.join(self.ios_doc_path(), packName)
+            try:
+                mapSource.tileCache.export_pack(packFile)
+                self.show_info_message(message=_('data_exported_to').format(filename=packFile))
+            except Exception as e:
+                msg = _('error_tile_pack').format(filename=packFile, error=e)
+                print(msg)
+                self.show_error_message(message=msg)
+        else:
+            oldwd = os.getcwd() # Remember current workdir. Windows File Explorer is nasty and changes it, causing all sorts of mapview issues.
+            myFiles = filechooser.choose_dir(title=_('save_tile_pack_file'))
+            newwd = os.getcwd()
+            if oldwd != newwd:
+                os.chdir(oldwd) # Change it back!
+            if myFiles and len(myFiles) > 0 and os.path.isdir(myFiles[0]):
+                packFile = os.path.join(myFiles[0], packName)
+                try:
+                    mapSource.tileCache.export_pack(packFile)
+                    self.show_info_message(message=_('data_exported_to').format(filename=packFile))
+                except Exception as e:
+                    msg = _('error_tile_pack').format(filename=packFile, error=e)
+                    print(msg)
+                    self.show_error_message(message=msg)
+
+
+    def open_tile_pack_import_dialog(self):
+        '''
+        Add the tiles of an MBTiles file to the cache of the selected map source, for offline use.
+        '''
+        if self.is_android:
+            # Open Android Shared Storage.
+            self.chosenFile = None
+            self.chooser.choose_content("*/*")
+            self.chooser_open = True
+            while (self.chooser_open):
+                time.sleep(0.2)
+            if self.chosenFile is not None:
+                self.import_tile_pack(self.chosenFile)
+        elif self.is_ios:
+            # Import the most recent tile pack, if there are multiple.
+            packFiles = sorted(glob.glob(os.path.join(self.ios_doc_path(), '*.mbtiles'), recursive=False), reverse=True)
+            if len(packFiles) > 0:
+                self.import_tile_pack(packFiles[0])
+            else:
+                self.show_warning_message(message=_('nothing_to_import'))
+        else:
+            oldwd = os.getcwd() # Remember current workdir. Windows File Explorer is nasty and changes it, causing all sorts of mapview issues.
+            myFiles = filechooser.open_file(title=_('select_tile_pack_file'), filters=[(_('mbtiles_files'), "*.mbtiles")])
+            newwd = os.getcwd()
+            if oldwd != newwd:
+                os.chdir(oldwd) # Change it back!
+            if myFiles and len(myFiles) > 0 and os.path.isfile(myFiles[0]):
+                self.import_tile_pack(myFiles[0])
+
+
+    def import_tile_pack(self, packFile):
+        self.dialog_wait.open()
+        threading.Thread(target=self.import_tile_pack_background, args=(self.root.ids.map.map_source.tileCache, packFile), daemon=True).start()
+
+
+    def import_tile_pack_background(self, tileCache, packFile):
+        try:
+            tiles = tileCache.import_pack(packFile)
+            mainthread(self.show_info_message)(message=_('tile_pack_imported').format(tiles=tiles))
+        except Exception as e:
+            msg = _('error_tile_pack').format(filename=packFile, error=e)
+            print(msg)
+            mainthread(self.show_error_message)(message=msg)
+        mainthread(self.dialog_wait.dismiss)()
+
+
     def home_marker_selection(self, item):
         '''
         Change Display of Home Marker (Preferences).
@@ -1210,7 +1517,7 @@ class MainApp(MDApp):
         '''
         Config.set('preferences', 'rounded_readings', item.active)
         Config.write()
-        self.stop_flight(True)
+        self.stop_flight()
         self.show_info_message(message=_('reopen_log_for_changes_to_take_effect'))
 
 
@@ -1230,6 +1537,19 @@ class MainApp(MDApp):
         Config.write()
 
 
+    def telemetry_selection(self, item):
+        '''
+        Enable or disable storing the telemetry of opened and imported logs in the telemetry DB (Preferences).
+        '''
+        Config.set('preferences', 'telemetry', item.active)
+        Config.write()
+        if item.active and self.telemetryDb is None:
+            self.telemetryDb = TelemetryDb(os.path.join(self.dataDir, self.telemetryDbFilename), slowQueryMs=self.dbSlowQueryMs)
+        elif not item.active and self.telemetryDb is not None:
+            self.telemetryDb.close()
+            self.telemetryDb = None
+
+
     def language_selection(self, item):
         '''
         Change Language (Preferences).
@@ -1252,7 +1572,10 @@ class MainApp(MDApp):
         Dropdown selection with different drone models determined from the imported log files.
         Model names are slightly inconsistent based on the version of the Potensic app they were generated in.
         '''
-        models = self.db.execute("SELECT modelref FROM models ORDER BY modelref")
+        self.asyncDb.query("SELECT modelref FROM models ORDER BY modelref", callback=lambda models: self.open_model_selection(item, models))
+
+
+    def open_model_selection(self, item, models):
         menu_items = []
         for modelRef in models:
             menu_items.append({"text": modelRef[0], "on_release": lambda x=modelRef[0]: self.model_selection_callback(x)})
@@ -1261,7 +1584,7 @@ class MainApp(MDApp):
     def model_selection_callback(self, text_item):
         self.select_drone_model(text_item)
         self.model_selection_menu.dismiss()
-        self.stop_flight(True)
+        self.stop_flight()
         self.list_log_files()
 
 
@@ -1271,19 +1594,29 @@ class MainApp(MDApp):
         Config.write()
 
 
-    def list_log_files(self):
+    def query_import_summaries(self, callback):
         '''
-        Retrieve and display all flight logs imported to the app.
+        Retrieve the flight log summaries of the selected model in the background and pass them to the callback.
         '''
-        imports = self.db.execute("""
-            SELECT i.importref, i.dateref, count(s.flight_number), sum(duration), max(duration), max(max_distance), max(max_altitude), max(max_h_speed), max(max_v_speed), sum(traveled)
-            FROM imports i
-            LEFT OUTER JOIN flight_stats s ON s.importref = i.importref
+        self.asyncDb.query("""
+            SELECT importref, dateref, flights, duration, max_duration, max_distance, max_altitude, max_h_speed, max_v_speed, traveled
+            FROM import_summary
             WHERE modelref = ?
-            GROUP BY i.importref, i.dateref
-            ORDER BY i.dateref DESC
-            """, (self.root.ids.selected_model.text,)
+            AND (? IS NULL OR importref IN (SELECT importref FROM flight_stats WHERE site_id = ?))
+            ORDER BY dateref DESC, importref DESC
+            """, (self.root.ids.selected_model.text, self.launchSiteFilter, self.launchSiteFilter), callback=callback
         )
+
+
+    def list_log_files(self):
+        '''
+        Retrieve and display all flight logs imported to the app.
+        '''
+        self.query_import_summaries(self.show_log_files)
+        self.reload_archive_layers() # Imports were added or deleted, or another drone model was selected.
+
+
+    def show_log_files(self, imports):
         role = "medium" if self.is_desktop else "small"
         iconsize = [dp(40), dp(40)] if self.is_desktop else [dp(30), dp(30)]
         self.root.ids.log_files.clear_widgets()
@@ -1324,15 +1657,13 @@ class MainApp(MDApp):
         '''
         Generate global statistics from the displayed log files.
         '''
-        imports = self.db.execute("""
-            SELECT i.importref, i.dateref, count(s.flight_number), sum(duration), max(duration), max(max_distance), max(max_altitude), max(max_h_speed), max(max_v_speed), sum(traveled)
-            FROM imports i
-            LEFT OUTER JOIN flight_stats s ON s.importref = i.importref
-            WHERE modelref = ?
-            GROUP BY i.importref, i.dateref
-            ORDER BY i.dateref DESC
-            """, (self.root.ids.selected_model.text,)
-        )
+        self.query_import_summaries(self.show_gstat_graphs)
+
+
+    def show_gstat_graphs(self, imports):
+        if self.app_view != "gstats":
+            return # Screen was closed before the stats were retrieved.
+        self.root.ids.gstat_graphs.clear_widgets()
         self.root.ids.gstat_graphs.width = (dp(40) * len(imports)) + dp(100)
         self.root.ids.gstat_graphs.add_widget(MaxDistGraph(imports).buildGraph(self.common.dist_unit()))
         self.root.ids.gstat_graphs.add_widget(TotDistGraph(imports).buildGraph(self.common.dist_unit()))
@@ -1348,10 +1679,10 @@ class MainApp(MDApp):
         Called when a log file has been selected. It will be opened, parsed and displayed on the map screen.
         '''
         self.dialog_wait.open()
-        threading.Thread(target=self.select_log_file, args=(buttonObj.value,)).start()
+        threading.Thread(target=self.select_log_file, args=(buttonObj.value, getattr(buttonObj, 'flight', None))).start()
 
 
-    def select_log_file(self, importRef):
+    def select_log_file(self, importRef, flightNum=None):
         lcDM = self.root.ids.selected_model.text.lower()
         self.map_rebuild_required = False
         mainthread(self.open_view)("Screen_Map")
@@ -1359,12 +1690,290 @@ class MainApp(MDApp):
             self.parse_dreamer_logs(importRef)
         else:
             self.parse_atom_logs(importRef)
-        mainthread(self.set_default_flight)()
+        mainthread(self.set_default_flight)(flightNum)
         mainthread(self.generate_map_layers)()
         mainthread(self.select_flight)()
         self.dialog_wait.dismiss()
 
 
+    def find_flights_in_view(self):
+        '''
+        List all imported flights that pass through the area currently shown on the map.
+        '''
+        latMin, lonMin, latMax, lonMax = self.root.ids.map.get_bbox()
+        self.asyncDb.call(self.db.flights_in_bbox, latMin, lonMin, latMax, lonMax, callback=self.open_flights_in_view_dialog, write=False)
+
+
+    def open_flights_in_view_dialog(self, flights):
+        if len(flights) == 0:
+            self.show_info_message(message=_('no_flights_in_view'))
+            return
+        flightList = self.flight_list(flights)
+        self.dialog_flights_in_view = MDDialog(
+            MDDialogHeadlineText(
+                text = _('flights_in_view').format(count=len(flights)),
+                halign="left",
+            ),
+            MDDialogContentContainer(
+                flightList,
+                orientation="vertical",
+            ),
+            MDDialogButtonContainer(
+                Widget(),
+                MDButton(MDButtonText(text=_('cancel')), style="text", on_release=self.close_flights_in_view_dialog),
+                spacing="8dp",
+            ),
+        )
+        self.dialog_flights_in_view.open()
+
+
+    def flight_list(self, flights):
+        '''
+        Buttons that open the most recent flights of a flights_in_bbox() style list.
+        '''
+        flightList = MDGridLayout(cols=1, adaptive_height=True)
+        for flight in flights[:self.maxFlightsInView]:
+            dt = datetime.date.fromisoformat(flight[2]).strftime("%x")
+            flightBtn = MDButton(
+                MDButtonText(text=_('flight_in_view').format(date=dt, model=flight[1], flight=flight[3], duration=datetime.timedelta(seconds=flight[4]))),
+                style="text", on_release=self.open_flight_in_view
+            )
+            flightBtn.value = flight[0]
+            flightBtn.model = flight[1]
+            flightBtn.flight = flight[3]
+            flightList.add_widget(flightBtn)
+        return flightList
+
+
+    def close_flights_in_view_dialog(self, *args):
+        self.dialog_flights_in_view.dismiss()
+        self.dialog_flights_in_view = None
+
+
+    def open_flight_in_view(self, buttonObj):
+        self.close_flights_in_view_dialog(None)
+        self.stop_flight()
+        self.select_drone_model(buttonObj.model)
+        self.initiate_log_file(buttonObj)
+
+
+    def open_launch_sites(self, item):
+        '''
+        Launch sites dialog functions. Sites are clustered from the home points of the flights when logs are imported
+        or opened. A site lists its flights, and filters the log list.
+        '''
+        self.asyncDb.call(self.db.launch_sites, callback=self.open_launch_sites_dialog, write=False)
+
+
+    def open_launch_sites_dialog(self, sites):
+        if len(sites) == 0:
+            self.show_info_message(message=_('no_launch_sites'))
+            return
+        siteList = MDGridLayout(cols=1, adaptive_height=True)
+        siteList.add_widget(MDButton(MDButtonText(text=_('launch_site_all')), style="text", on_release=lambda x: self.launch_site_filter_selection(None)))
+        for site in sites:
+            dt = datetime.date.fromisoformat(site[6]).strftime("%x") if site[6] else ""
+            siteBtn = MDButton(
+                MDButtonText(text=_('launch_site_summary').format(name=self.launch_site_name(site), flights=site[4], duration=datetime.timedelta(seconds=round(site[5])), date=dt)),
+                style="text", on_release=lambda x, site=site: self.open_launch_site(site)
+            )
+            siteList.add_widget(siteBtn)
+        self.dialog_launch_sites = MDDialog(
+            MDDialogHeadlineText(
+                text = _('launch_sites'),
+                halign="left",
+            ),
+            MDDialogContentContainer(
+                siteList,
+                orientation="vertical",
+            ),
+            MDDialogButtonContainer(
+                Widget(),
+                MDButton(MDButtonText(text=_('cancel')), style="text", on_release=self.close_launch_sites_dialog),
+                spacing="8dp",
+            ),
+        )
+        self.dialog_launch_sites.open()
+
+
+    def close_launch_sites_dialog(self, *args):
+        if self.dialog_launch_sites:
+            self.dialog_launch_sites.dismiss()
+            self.dialog_launch_sites = None
+
+
+    def launch_site_name(self, site):
+        return site[1] if site[1] else _('launch_site_default_name').format(number=site[0])
+
+
+    def open_launch_site(self, site):
+        self.close_launch_sites_dialog()
+        self.asyncDb.call(self.db.launch_site_flights, site[0], callback=lambda flights: self.open_launch_site_dialog(site, flights), write=False)
+
+
+    def open_launch_site_dialog(self, site, flights):
+        siteName = MDTextField(MDTextFieldHintText(text=_('launch_site_name')), text=self.launch_site_name(site), mode="outlined")
+        content = MDGridLayout(cols=1, adaptive_height=True)
+        content.add_widget(siteName)
+        content.add_widget(self.flight_list(flights))
+        self.dialog_flights_in_view = MDDialog( # Opening one of the flights closes it like the flights in view dialog.
+            MDDialogHeadlineText(
+                text = _('launch_site_flights').format(name=self.launch_site_name(site), count=len(flights)),
+                halign="left",
+            ),
+            MDDialogContentContainer(
+                content,
+                orientation="vertical",
+            ),
+            MDDialogButtonContainer(
+                Widget(),
+                MDButton(MDButtonText(text=_('cancel')), style="text", on_release=self.close_flights_in_view_dialog),
+                MDButton(MDButtonText(text=_('launch_site_rename')), style="text", on_release=lambda x: self.rename_launch_site(site, siteName.text.strip())),
+                MDButton(MDButtonText(text=_('launch_site_filter')), style="text", on_release=lambda x: self.launch_site_filter_selection(site)),
+                spacing="8dp",
+            ),
+        )
+        self.dialog_flights_in_view.open()
+
+
+    def rename_launch_site(self, site, name):
+        self.close_flights_in_view_dialog()
+        if name == self.launch_site_name((site[0], None)):
+            name = "" # Keep the default name, so it follows the language.
+        self.asyncDb.call(self.db.rename_launch_site, site[0], name)
+        if self.launchSiteFilter == site[0]:
+            self.root.ids.selected_site.text = name if name else self.launch_site_name((site[0], None))
+
+
+    def launch_site_filter_selection(self, site):
+        '''
+        Show only the logs with flights from a launch site, or all logs when site is None.
+        '''
+        if site is None:
+            self.close_launch_sites_dialog()
+        else:
+            self.close_flights_in_view_dialog()
+        self.launchSiteFilter = None if site is None else site[0]
+        self.root.ids.selected_site.text = "--" if site is None else self.launch_site_name(site)
+        self.list_log_files()
+
+
+    def prefetch_flight_tiles(self):
+        '''
+        Download the map tiles around the flights of the opened log, for offline use.
+        '''
+        if not self.flightStats:
+            return
+        self.plan_tile_prefetch([(flightStat[4], flightStat[5], flightStat[6], flightStat[7]) for flightStat in self.flightStats[1:]])
+
+
+    def prefetch_model_tiles(self):
+        '''
+        Download the map tiles around all flights of the selected drone model, for offline use.
+        '''
+        self.asyncDb.call(self.db.flight_bboxes, self.root.ids.selected_model.text, callback=self.plan_tile_prefetch, write=False)
+
+
+    def plan_tile_prefetch(self, bboxes):
+        if self.tilePrefetcher.running:
+            self.show_info_message(message=_('tile_prefetch_running'))
+            return
+        if len(bboxes) == 0:
+            self.show_info_message(message=_('tile_prefetch_no_flights'))
+            return
+        threading.Thread(target=self.plan_tile_prefetch_background, args=(self.root.ids.map.map_source, bboxes), daemon=True).start()
+
+
+    def plan_tile_prefetch_background(self, mapSource, bboxes):
+        tiles, estimatedBytes = self.tilePrefetcher.plan(mapSource, bboxes)
+        mainthread(self.open_tile_prefetch_dialog)(mapSource, tiles, estimatedBytes)
+
+
+    def open_tile_prefetch_dialog(self, mapSource, tiles, estimatedBytes):
+        if len(tiles) == 0:
+            self.show_info_message(message=_('tile_prefetch_all_cached'))
+            return
+        tileCount = min(len(tiles), self.tilePrefetcher.maxTiles)
+        okBtn = MDButton(MDButtonText(text=_('download')), style="text", on_release=self.start_tile_prefetch)
+        okBtn.value = (mapSource, tiles)
+        self.dialog_tile_prefetch = MDDialog(
+            MDDialogHeadlineText(
+                text = _('tile_prefetch'),
+                halign="left",
+            ),
+            MDDialogContentContainer(
+                MDLabel(text=_('tile_prefetch_confirm').format(
+                    tiles=tileCount,
+                    size=self.common.fmt_num(estimatedBytes * tileCount / len(tiles) / 1048576, True),
+                    source=self.root.ids.selected_mapsource.text
+                ), adaptive_height=True),
+                orientation="vertical",
+            ),
+            MDDialogButtonContainer(
+                Widget(),
+                MDButton(MDButtonText(text=_('cancel')), style="text", on_release=self.close_tile_prefetch_dialog),
+                okBtn,
+                spacing="8dp",
+            ),
+        )
+        self.dialog_tile_prefetch.open()
+
+
+    def close_tile_prefetch_dialog(self, *args):
+        self.dialog_tile_prefetch.dismiss()
+        self.dialog_tile_prefetch = None
+
+
+    def start_tile_prefetch(self, buttonObj):
+        self.close_tile_prefetch_dialog(None)
+        mapSource, tiles = buttonObj.value
+        if not self.tilePrefetcher.start(mapSource, tiles):
+            self.show_info_message(message=_('tile_prefetch_running'))
+            return
+        self.tilePrefetchLabel = MDLabel(text=_('tile_prefetch_progress').format(done=0, total=min(len(tiles), self.tilePrefetcher.maxTiles), size=self.common.fmt_num(0, True)), adaptive_height=True)
+        self.dialog_tile_prefetch_progress = MDDialog(
+            MDDialogHeadlineText(
+                text = _('tile_prefetch'),
+                halign="left",
+            ),
+            MDDialogContentContainer(
+                self.tilePrefetchLabel,
+                orientation="vertical",
+            ),
+            MDDialogButtonContainer(
+                Widget(),
+                MDButton(MDButtonText(text=_('cancel')), style="text", on_release=self.cancel_tile_prefetch),
+                MDButton(MDButtonText(text=_('hide')), style="text", on_release=self.close_tile_prefetch_progress_dialog),
+                spacing="8dp",
+            ),
+        )
+        self.dialog_tile_prefetch_progress.open()
+
+
+    def close_tile_prefetch_progress_dialog(self, *args):
+        '''
+        Hide the progress, the download continues in the background.
+        '''
+        if self.dialog_tile_prefetch_progress:
+            self.dialog_tile_prefetch_progress.dismiss()
+            self.dialog_tile_prefetch_progress = None
+
+
+    def cancel_tile_prefetch(self, *args):
+        self.tilePrefetcher.cancel()
+        self.close_tile_prefetch_progress_dialog()
+
+
+    def tile_prefetch_progress(self, report):
+        if self.dialog_tile_prefetch_progress:
+            self.tilePrefetchLabel.text = _('tile_prefetch_progress').format(done=report['downloaded'] + report['failed'] + report['cancelled'], total=report['total'], size=self.common.fmt_num(report['bytes'] / 1048576, True))
+
+
+    def tile_prefetch_done(self, report):
+        self.close_tile_prefetch_progress_dialog()
+        self.show_info_message(message=_('tile_prefetch_done').format(tiles=report['downloaded'], failed=report['failed'], cancelled=report['cancelled'], size=self.common.fmt_num(report['bytes'] / 1048576, True)))
+
+
     def open_delete_log_dialog(self, buttonObj):
         okBtn = MDButton(MDButtonText(text=_('delete')), style="text", on_release=self.delete_log_file)
         okBtn.value = buttonObj.value
@@ -1389,21 +1998,22 @@ class MainApp(MDApp):
 
 
     def delete_log_file(self, buttonObj):
-        logFiles = self.db.execute("SELECT filename FROM log_files WHERE importref = ?", (buttonObj.value,))
-        for fileRef in logFiles:
-            file = fileRef[0]
-            os.remove(os.path.join(self.logfileDir, file))
-        modelRef = self.db.execute("SELECT modelref FROM imports WHERE importref = ?", (buttonObj.value,))
-        self.db.execute("DELETE FROM flight_stats WHERE importref = ?", (buttonObj.value,))
-        self.db.execute("DELETE FROM log_files WHERE importref = ?", (buttonObj.value,))
-        self.db.execute("DELETE FROM imports WHERE importref = ?", (buttonObj.value,))
-        if modelRef is not None and len(modelRef) > 0:
-            importRef = self.db.execute("SELECT count (1) FROM imports WHERE modelref = ?", (modelRef[0][0],))
-            if importRef is None or len(importRef) == 0 or importRef[0][0] == 0:
-                self.db.execute("DELETE FROM models WHERE modelref = ?", (modelRef[0][0],))
-                self.select_drone_model("--")
-        self.list_log_files()
         self.close_delete_log_dialog(None)
+        self.asyncDb.call(self.purge_import, buttonObj.value, callback=self.log_file_deleted)
+
+
+    def log_file_deleted(self, modelDeleted):
+        if modelDeleted:
+            self.select_drone_model("--")
+        self.list_log_files()
+        self.integrityChecker.start() # Deletes the log files in the background.
+
+
+    def integrity_check_done(self, report):
+        if report['purged_imports'] > 0 or report['changed_files'] > 0:
+            self.show_info_message(message=_('integrity_check_fixed').format(imports=report['purged_imports'], files=report['changed_files']))
+            if report['purged_imports'] > 0:
+                self.list_log_files()
 
 
     def open_backup_dialog(self):
@@ -1431,6 +2041,7 @@ class MainApp(MDApp):
         self.close_backup_dialog(None)
         dtpart = re.sub("[^0-9]", "", datetime.datetime.now().isoformat())
         backupName = f"{self.appPathName}_{self.appVersion}_Backup_{dtpart}.zip"
+        self.db.checkpoint() # Make sure the DB file is complete before it is zipped.
         if self.is_android:
             cache_dir = user_cache_dir(self.appPathName, self.appPathName)
             zipFile = os.path.join(cache_dir, backupName)
@@ -1553,6 +2164,11 @@ class MainApp(MDApp):
         oldDbFile = os.path.join(resDir, self.dbFilename)
         oldCfFile = os.path.join(resDir, self.configFilename)
         if os.path.isfile(oldDbFile) and os.path.isfile(oldCfFile):
+            dbFile = self.db.dataFile()
+            self.db.close()
+            for walFile in [f"{dbFile}-wal", f"{dbFile}-shm"]: # Must not be applied to the restored DB file.
+                if os.path.isfile(walFile):
+                    os.remove(walFile)
             for binFile in glob.glob(os.path.join(resDir, '**/*'), recursive=True):
                 binBaseName = os.path.basename(binFile)
                 if binBaseName == self.dbFilename:
@@ -1561,15 +2177,25 @@ class MainApp(MDApp):
                     shutil.copy(binFile, self.configFile)
                 else:
                     shutil.copy(binFile, os.path.join(self.logfileDir, binBaseName))
+            self.db = Db(dbFile, slowQueryMs=self.dbSlowQueryMs) # Re-open, this also adds tables missing from older backups.
+            self.asyncDb.db = self.db
+            self.asyncDb.call(self.db.rebuild_summaries, callback=self.summaries_rebuilt) # The backup may come from an older version.
             self.show_info_message(message=_('restored_from').format(filename=selectedFile))
             Config.read(self.configFile)
             self.init_prefs()
+            self.telemetry_selection(self.root.ids.selected_telemetry)
             self.reset()
         else:
             self.show_error_message(message=_('not_valid_backup_zip_file_specified').format(filename=selectedFile))
         shutil.rmtree(resDir, ignore_errors=True) # Delete temp files.
 
 
+    def summaries_rebuilt(self, mismatches):
+        if mismatches > 0:
+            print(f"Rebuilt flight summaries, {mismatches} rows were out of sync")
+        self.list_log_files()
+
+
     def get_waypoints(self, button):
         adbexe = self.root.ids.adb_path.text
         prc = subprocess.run([adbexe, "devices"], capture_output=True, text=True)
@@ -1673,15 +2299,7 @@ class MainApp(MDApp):
             marker.add_widget(widget)
             self.root.ids.waymap.add_marker(marker, self.waylayer)
         if count > 0:
-            zoom = self.root.ids.waymap.map_source.max_zoom
-            self.root.ids.waymap.zoom = zoom
-            self.root.ids.waymap.center_on((minlat + maxlat) / 2,  (minlon + maxlon) / 2)
-            while zoom > self.root.ids.waymap.map_source.min_zoom:
-                bbox = self.root.ids.waymap.get_bbox()
-                if minlat >= bbox[0] and minlon >= bbox[1] and maxlat <= bbox[2] and maxlon <= bbox[3]:
-                    break
-                zoom = zoom - 1
-                self.root.ids.waymap.zoom = zoom
+            self.fit_map(self.root.ids.waymap, minlat, minlon, maxlat, maxlon)
 
 
     def waymap_touch(self, mapObj, touch):
@@ -1800,22 +2418,24 @@ class MainApp(MDApp):
         if not self.waylayer or not self.potdb:
             return
         # Replace all waypoint data in the tables.
-        self.potdb.execute("DELETE FROM multipointbean")
-        self.potdb.execute("DELETE FROM flightrecordbean")
-        flightid = 1
-        markerid = 1
-        for waypointInfo in self.waypoints:
-            self.potdb.execute(
-                "INSERT INTO flightrecordbean(id,date,duration,height,mileage,num,speed) VALUES(?,?,?,?,?,?,?)",
-                (flightid, waypointInfo['date'], waypointInfo['duration'], waypointInfo['height'], waypointInfo['mileage'], waypointInfo['num'], waypointInfo['speed'])
-            )
-            for marker in waypointInfo['markers']:
+        with self.potdb.transaction():
+            self.potdb.execute("DELETE FROM multipointbean")
+            self.potdb.execute("DELETE FROM flightrecordbean")
+            flightid = 1
+            markerid = 1
+            for waypointInfo in self.waypoints:
                 self.potdb.execute(
-                    "INSERT INTO multipointbean(id,flightrecordbean_id,lat,lng) VALUES (?,?,?,?)",
-                    (markerid, flightid, marker['lat'], marker['lon'])
+                    "INSERT INTO flightrecordbean(id,date,duration,height,mileage,num,speed) VALUES(?,?,?,?,?,?,?)",
+                    (flightid, waypointInfo['date'], waypointInfo['duration'], waypointInfo['height'], waypointInfo['mileage'], waypointInfo['num'], waypointInfo['speed'])
                 )
-                markerid = markerid + 1
-            flightid = flightid + 1
+                for marker in waypointInfo['markers']:
+                    self.potdb.execute(
+                        "INSERT INTO multipointbean(id,flightrecordbean_id,lat,lng) VALUES (?,?,?,?)",
+                        (markerid, flightid, marker['lat'], marker['lon'])
+                    )
+                    markerid = markerid + 1
+                flightid = flightid + 1
+        self.potdb.close() # Release the file before it is pushed to the device.
 
         # Push the waypoint db file to the device. If direct file transfer via rooted device does not work, attempt file upload if the potensic app is debuggable.
         adbexe = self.root.ids.adb_path.text
@@ -1870,14 +2490,17 @@ class MainApp(MDApp):
         self.root.ids.selected_ctrl_marker.active = Config.getboolean('preferences', 'show_marker_ctrl')
         self.root.ids.selected_flight_path_width.value = Config.get('preferences', 'flight_path_width')
         self.root.ids.selected_flight_path_color.value = Config.getint('preferences', 'flight_path_color')
+        self.root.ids.selected_path_metric.text = _(f"path_metric_{Config.get('preferences', 'flight_path_metric')}")
         self.root.ids.selected_marker_drone_color.value = Config.getint('preferences', 'marker_drone_color')
         self.root.ids.selected_marker_ctrl_color.value = Config.getint('preferences', 'marker_ctrl_color')
         self.root.ids.selected_marker_home_color.value = Config.getint('preferences', 'marker_home_color')
         self.root.ids.selected_rounding.active = Config.getboolean('preferences', 'rounded_readings')
         self.root.ids.selected_gauges.active = Config.getboolean('preferences', 'gauges')
         self.root.ids.selected_splashscreen.active = Config.getboolean('preferences', 'splash')
+        self.root.ids.selected_telemetry.active = Config.getboolean('preferences', 'telemetry')
         self.root.ids.selected_mapsource.text = Config.get('preferences', 'map_tile_server')
         self.root.ids.selected_refresh_rate.text = Config.get('preferences', 'refresh_rate')
+        self.root.ids.selected_tile_cache_size.text = Config.get('preferences', 'tile_cache_size')
         self.root.ids.selected_model.text = Config.get('preferences', 'selected_model')
         self.root.ids.selected_language.text = self.languages.get(Config.get('preferences', 'language'))
         self.root.ids.adb_path.text = Config.get('preferences', 'adbpath')
@@ -1915,6 +2538,11 @@ class MainApp(MDApp):
             self.root.ids.value1_vspeed.text = ""
             self.root.ids.value1_elapsed.text = ""
             self.root.ids.map_metrics_ribbon.text = ""
+            self.frames = {}
+            self.trackPoints = {}
+            self.shownValues = {}
+            self.flightTimes = []
+            self.flightDuration = 0
             self.root.ids.flight_progress.is_updating = True
             self.root.ids.flight_progress.value = 0
             self.root.ids.flight_progress.is_updating = False
@@ -1922,8 +2550,10 @@ class MainApp(MDApp):
             self.root.ids.speed_indicator.icon = f"numeric-{self.playback_speed}-box"
         self.flightOptions = []
         self.logdata = []
-        self.flightPaths = None
+        self.flightPathLayer = None
         self.pathCoords = None
+        self.pathValues = None
+        self.pathLODs = None
         self.flightStarts = None
         self.flightEnds = None
         self.zipFilename = None
@@ -1935,55 +2565,20 @@ class MainApp(MDApp):
             self.center_map()
 
 
-    def cleanup_orphaned_refs(self):
-        '''
-        Delete unreferenced log files. Delete unreferenced DB records.
-        '''
-        importedFiles = []
-        for fileRef in self.db.execute("SELECT filename FROM log_files"):
-            importedFiles.append(fileRef[0])
-        filesOnDisk = []
-        for binFile in glob.glob(os.path.join(self.logfileDir, '*'), recursive=False):
-            binBasename = os.path.basename(binFile)
-            if binBasename in importedFiles:
-                filesOnDisk.append(binBasename)
-            else:
-                print(f"Deleting unreferenced file {binBasename}")
-                os.remove(binFile)
-        for importedFile in importedFiles:
-            if importedFile not in filesOnDisk:
-                print(f"Deleting orphaned reference to {importedFile}")
-                importRefRecs = self.db.execute("SELECT importref FROM log_files WHERE filename = ?", (importedFile,))
-                importRef = importRefRecs[0][0] if importRefRecs is not None and len(importRefRecs) > 0 else None
-                if importRef is not None:
-                    logFiles = self.db.execute("SELECT filename FROM log_files WHERE importref = ?", (importRef,))
-                    for fileRef in logFiles:
-                        file = fileRef[0]
-                        try:
-                            os.remove(os.path.join(self.logfileDir, file))
-                        except:
-                            # Do nothing.
-                            ...
-                    modelRef = self.db.execute("SELECT modelref FROM imports WHERE importref = ?", (importRef,))
-                    self.db.execute("DELETE FROM flight_stats WHERE importref = ?", (importRef,))
-                    self.db.execute("DELETE FROM log_files WHERE importref = ?", (importRef,))
-                    self.db.execute("DELETE FROM imports WHERE importref = ?", (importRef,))
-                    if modelRef is not None and len(modelRef) > 0:
-                        importRef = self.db.execute("SELECT count (1) FROM imports WHERE modelref = ?", (modelRef[0][0],))
-                        if importRef is None or len(importRef) == 0 or importRef[0][0] == 0:
-                            self.db.execute("DELETE FROM models WHERE modelref = ?", (modelRef[0][0],))
-                else:
-                    self.db.execute("DELETE FROM log_files WHERE filename = ?", (importedFile,))
-
-
     def clear_cache(self):
         '''
-        Clear the cache directory (where drone icons and map tiles are stored).
+        Clear the cache directory (where map tiles are stored).
         '''
         print(f"Clearing cache: {self.root.ids.map.cache_dir}")
+        tileCacheFiles = set()
+        for cacheKey, tileCache in self.tileCaches.items():
+            print(f"Tile cache {cacheKey} stats: {tileCache.stats()}")
+            tileCache.clear()
+            tileCacheFiles.update([tileCache.dataFile(), f"{tileCache.dataFile()}-wal", f"{tileCache.dataFile()}-shm"])
         for root, dirs, files in os.walk(self.root.ids.map.cache_dir, topdown=False):
             for name in files:
-                os.remove(os.path.join(root, name))
+                if os.path.join(root, name) not in tileCacheFiles: # Open tile caches were emptied above.
+                    os.remove(os.path.join(root, name))
             for name in dirs:
                 os.rmdir(os.path.join(root, name))
         self.show_info_message(message=_('cache_cleared'))
@@ -2131,6 +2726,7 @@ class MainApp(MDApp):
         '''
         self.open_view("Screen_Log_Files")
         self.center_map()
+        self.resume_imports()
 
 
     def swap_fullscreen_mode(self):
@@ -2169,7 +2765,14 @@ class MainApp(MDApp):
         self.logfileDir = os.path.join(self.dataDir, "logfiles") # Place where log bin files go.
         if not os.path.exists(self.logfileDir):
             Path(self.logfileDir).mkdir(parents=True, exist_ok=True)
-        self.db = Db(os.path.join(self.dataDir, self.dbFilename)) # sqlite DB file.
+        self.db = Db(os.path.join(self.dataDir, self.dbFilename), slowQueryMs=self.dbSlowQueryMs) # sqlite DB file.
+        self.asyncDb = AsyncDb(self.db, dispatcher=mainthread) # Keeps DB access triggered from the UI off the main thread.
+        self.integrityChecker = IntegrityChecker(self)
+        self.tilePrefetcher = TilePrefetcher(self)
+        self.tileCaches = {}
+        self.userAgent = f"{self.appName}/{self.appVersion}"
+        self.tileFetcher = TileFetcher(self.userAgent) # Shared by all map sources and the tile prefetcher.
+        self.dialog_tile_prefetch_progress = None
         self.potdb = None
         configDir = self.dataDir if self.is_ios else user_config_dir(self.appPathName, self.appPathName) # Place where app ini config file goes.
         if not os.path.exists(configDir):
@@ -2188,10 +2791,14 @@ class MainApp(MDApp):
             'rounded_readings': True,
             'flight_path_width': 0,
             'flight_path_color': 0,
+            'flight_path_metric': PathMetric.NONE.value,
+            'heatmap_metric': HeatmapMetric.NONE.value,
+            'archive_overlay': False,
             'marker_drone_color': 0,
             'marker_ctrl_color': 0,
             'marker_home_color': 0,
             'refresh_rate': "1.00s",
+            'tile_cache_size': "500 MB",
             'show_flight_path': True,
             'show_marker_home': True,
             'show_marker_ctrl': False,
@@ -2200,8 +2807,11 @@ class MainApp(MDApp):
             'language': 'en_US',
             'gauges': True,
             'splash': False,
+            'telemetry': False,
+            'stats': False, # Print the performance counters on exit.
             'adbpath': "adb"
         })
+        self.telemetryDb = TelemetryDb(os.path.join(self.dataDir, self.telemetryDbFilename), slowQueryMs=self.dbSlowQueryMs) if Config.getboolean('preferences', 'telemetry') else None
         langcode = Config.get('preferences', 'language')
         langpath = os.path.join(os.path.dirname(__file__), 'languages')
         lang = gettext.translation('messages', localedir=langpath, languages=[langcode])
@@ -2215,11 +2825,22 @@ class MainApp(MDApp):
         self.waypoints = None
         self.waylayer = None
         self.wait_for_marker_add_click = None
-        self.flightPaths = None
+        self.flightPathLayer = None
+        self.heatmapLayer = None
+        self.archivePathLayer = None
+        self.dialog_launch_sites = None
+        self.launchSiteFilter = None # Site of the logs listed, None for all logs.
         self.pathCoords = None
+        self.pathValues = None
+        self.pathLODs = None
         self.flightOptions = None
-        self.isPlaying = False
         self.currentRowIdx = None
+        self.columnIdx = {column: idx for idx, column in enumerate(self.columns)}
+        self.frames = {} # Display values per record of the selected flight.
+        self.trackPoints = {} # Numeric readings per record of the selected flight, for smooth playback.
+        self.shownValues = {} # Values last assigned to the widgets by set_markers.
+        self.flightTimes = [] # Elapsed seconds of the records of the selected flight, for seeking.
+        self.flightDuration = 0 # Seconds.
         self.layer_ctrl = None
         self.ctrlmarker = None
         self.layer_home = None
@@ -2227,8 +2848,8 @@ class MainApp(MDApp):
         self.layer_drone = None
         self.dronemarker = None
         self.flightStats = None
-        self.stopRequested = False
         self.playback_speed = 1
+        self.playback = FlightPlayback(self.playback_frame, self.playback_stopped, self.playback_motion)
         self.dialog_wait = MDDialog(
             MDDialogHeadlineText(
                 text=_('parsing_log_file')
@@ -2251,8 +2872,8 @@ class MainApp(MDApp):
 
 
     def on_start(self):
-        self.cleanup_orphaned_refs()
         threading.Thread(target=self.check_for_updates).start() # No need to hold up the app while checking for updates.
+        self.integrityChecker.start() # Reconciles the log files with the DB, off the startup path.
         if self.is_desktop:
             Window.bind(on_drop_file = self.on_file_drop)
             if not Config.getboolean('preferences', 'splash'):
@@ -2261,6 +2882,8 @@ class MainApp(MDApp):
         self.root.ids.selected_path.text = '--'
         self.reset()
         self.select_map_source()
+        self.show_heatmap()
+        self.show_archive_overlay()
         self.list_log_files()
         self.app_view = "loading"
         Clock.schedule_once(self.allow_app_interaction)
@@ -2268,7 +2891,7 @@ class MainApp(MDApp):
 
 
     def on_pause(self):
-        self.stop_flight(True)
+        self.stop_flight()
         return True
 
 
@@ -2276,10 +2899,26 @@ class MainApp(MDApp):
         '''
         Called when the app is exited.
         '''
-        self.stop_flight(True)
+        self.stop_flight()
         shutil.rmtree(self.tempDir, ignore_errors=True) # Delete temp files.
+        self.asyncDb.shutdown()
+        for tileCache in self.tileCaches.values():
+            tileCache.flush_usage()
+        if Config.getboolean('preferences', 'stats'):
+            self.print_stats()
         return super().on_stop()
 
 
+    def print_stats(self):
+        print(f"DB query stats: {self.asyncDb.stats()}")
+        for cacheKey, tileCache in self.tileCaches.items():
+            print(f"Tile cache {cacheKey} stats: {tileCache.stats()}")
+        print(f"Tile fetcher stats: {self.tileFetcher.stats()}")
+        print(f"Playback stats: {self.playback.stats()}")
+        print(f"Gauge stats: {self.root.ids.gauges.stats()}")
+        if self.flightPathLayer:
+            print(f"Flight path stats: {self.flightPathLayer.stats()}")
+
+
 if __name__ == "__main__":
     MainApp().run()
\ No newline at end of file
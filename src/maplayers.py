@@ -0,0 +1,732 @@
+'''
+Custom map layers and markers - Developer: Koen Aerts
+'''
+import math
+import collections
+
+from kivy.graphics import Color, Line, Mesh, Rectangle, PushMatrix, PopMatrix, Translate, Scale, Rotate, InstructionGroup, RenderContext
+from kivy.graphics.texture import Texture
+from kivy.properties import NumericProperty
+from kivy.metrics import dp
+from kivy.utils import get_color_from_hex
+from kivy_garden.mapview import MapLayer, MapMarker
+
+from enums import PathMetric, HeatmapMetric
+from heatmap import HeatmapBinner
+from mercator import project, unproject, map_size, project_bbox, expand_region, region_contains, regions_intersect, detail_zoom
+
+# Kivy's default shader only has a single colour per instruction, this one takes the colour of each vertex. Each
+# vertex is a point of the path moved to the edge of the line along v_normal, by half_width, so the line width can
+# follow the scale of the map without rebuilding the mesh.
+GRADIENT_VERTEX_SHADER = '''
+#ifdef GL_ES
+    precision highp float;
+#endif
+attribute vec2 v_pos;
+attribute vec2 v_normal;
+attribute vec4 v_color;
+uniform mat4 modelview_mat;
+uniform mat4 projection_mat;
+uniform float half_width;
+varying vec4 frag_color;
+void main() {
+    frag_color = v_color;
+    gl_Position = projection_mat * modelview_mat * vec4(v_pos + v_normal * half_width, 0.0, 1.0);
+}
+'''
+# The same for lines in a single colour.
+LINE_VERTEX_SHADER = '''
+#ifdef GL_ES
+    precision highp float;
+#endif
+attribute vec2 v_pos;
+attribute vec2 v_normal;
+uniform mat4 modelview_mat;
+uniform mat4 projection_mat;
+uniform float half_width;
+uniform vec4 line_color;
+varying vec4 frag_color;
+void main() {
+    frag_color = line_color;
+    gl_Position = projection_mat * modelview_mat * vec4(v_pos + v_normal * half_width, 0.0, 1.0);
+}
+'''
+GRADIENT_FRAGMENT_SHADER = '''
+#ifdef GL_ES
+    precision highp float;
+#endif
+varying vec4 frag_color;
+void main() {
+    gl_FragColor = frag_color;
+}
+'''
+
+
+def color_ramp(hexColors, size):
+    '''
+    Interpolate evenly spaced colour stops to a list of size colours.
+    '''
+    stops = [get_color_from_hex(hexColor) for hexColor in hexColors]
+    ramp = []
+    for idx in range(size):
+        pos = idx / (size-1) * (len(stops)-1)
+        stopIdx = min(int(pos), len(stops)-2)
+        frac = pos - stopIdx
+        ramp.append([stops[stopIdx][c] + (stops[stopIdx+1][c] - stops[stopIdx][c]) * frac for c in range(4)])
+    return ramp
+
+
+class FlightPathLayer(MapLayer):
+    '''
+    All flight paths of a log in a single layer. The paths are projected once per zoom level, relative to an origin
+    point, so panning only moves a Translate instruction and pinch zooming only changes a Scale instruction. Paths
+    are split in chunks and only the chunks around the visible part of the map are drawn. The line width is divided
+    by the Scale, so it stays the same on screen while pinch zooming.
+    '''
+    chunkSize = 1000 # Points per Line or Mesh instruction. A gradient mesh has 2 vertices per point and holds at most 65535.
+    cullMargin = 0.5 # Chunks within this many viewport sizes of the visible map are drawn too, so panning rarely redraws.
+    meshFormat = [(b'v_pos', 2, 'float'), (b'v_normal', 2, 'float'), (b'v_color', 4, 'float')]
+    refDistancePx = 1024 # Offset used to measure the scale of the map.
+    rampSize = 256 # Colours precomputed per colour ramp.
+    colorRamps = { # From the lowest to the highest reading of the log.
+        PathMetric.ALTITUDE: ["#0000ff", "#22b14c", "#ffff00", "#ed1c24"],
+        PathMetric.SPEED: ["#0000ff", "#22b14c", "#ffff00", "#ed1c24"],
+        PathMetric.BATTERY: ["#ed1c24", "#ffff00", "#22b14c"],
+        PathMetric.RSSI: ["#ed1c24", "#ffff00", "#22b14c"]
+    }
+    noValueColor = "#7f7f7f" # Points without a reading, e.g. no controller record.
+
+    def __init__(self, pathLODs, color, lineWidth, values=None, metric=PathMetric.NONE, **kwargs):
+        '''
+        pathLODs has a PathLOD for each flight path, built by the parser off the main thread. values has the metric
+        readings of each point of each flight path, as a dict of lists by PathMetric, and is needed to colour the paths
+        by a metric.
+        '''
+        super().__init__(**kwargs)
+        self.pathLODs = pathLODs
+        self.pathValues = values
+        self.color = get_color_from_hex(color)
+        self.lineWidth = lineWidth # Not width, that is the size of the widget.
+        self.metric = metric
+        self.flightNum = 0 # 0 = show all flight paths.
+        self.zoom = None
+        self.drawnRegion = None
+        self.levels = {}
+        self.chunks = {}
+        self.normals = {}
+        self.vertexColors = {}
+        self.readingRanges = {}
+        self.meshes = {}
+        self.draws = 0
+        self.verticesDrawn = 0
+        self.totalVertices = 0
+        self.lines = []
+        self.lineScale = 1 # Scale of the map the line width was last set for.
+        self.gradient = RenderContext(use_parent_projection=True, use_parent_modelview=True)
+        self.gradient.shader.vs = GRADIENT_VERTEX_SHADER
+        self.gradient.shader.fs = GRADIENT_FRAGMENT_SHADER
+        if not self.gradient.shader.success:
+            print("Gradient shader failed to compile, flight paths are drawn in a single colour")
+            self.gradient = None
+        else:
+            self.gradient['half_width'] = dp(self.lineWidth)
+        originCoord = next((pathLOD.coords[0] for pathLOD in pathLODs if len(pathLOD.coords) > 0), [0, 0])
+        self.originLon = originCoord[0]
+        self.originLat = originCoord[1]
+        self.originX, self.originY = project(self.originLon, self.originLat)
+        with self.canvas:
+            PushMatrix()
+            self.translate = Translate()
+            self.scale = Scale(1)
+            self.paths = InstructionGroup()
+            PopMatrix()
+
+
+    def show_flight(self, flightNum):
+        '''
+        Show a single flight path, or all of them when flightNum is 0.
+        '''
+        if flightNum != self.flightNum:
+            self.flightNum = flightNum
+            self.draw()
+
+
+    def set_metric(self, metric):
+        '''
+        Colour the flight paths by a metric, or in a single colour for PathMetric.NONE.
+        '''
+        if metric != self.metric:
+            self.metric = metric
+            self.draw()
+
+
+    def level(self, zoom):
+        '''
+        Line points of each flight path at a zoom level, in pixels relative to the origin.
+        '''
+        level = self.levels.get(zoom)
+        if level is None:
+            mapSize = map_size(zoom)
+            level = []
+            for pathLOD in self.pathLODs:
+                points = []
+                for idx in pathLOD.indexes(zoom):
+                    x, y = pathLOD.points[idx]
+                    points.append((x - self.originX) * mapSize)
+                    points.append((y - self.originY) * mapSize)
+                level.append(points)
+            self.levels[zoom] = level
+        return level
+
+
+    def path_chunks(self, pathIdx, zoom):
+        '''
+        The chunks of a flight path at a zoom level as (start, end, region): the range of its line points and the
+        region they cover in normalized map coordinates. Each chunk starts at the end of the previous one.
+        '''
+        key = (pathIdx, zoom)
+        chunks = self.chunks.get(key)
+        if chunks is None:
+            pathLOD = self.pathLODs[pathIdx]
+            indexes = pathLOD.indexes(zoom)
+            chunks = []
+            for start in range(0, max(len(indexes)-1, 1), self.chunkSize-1):
+                end = min(start + self.chunkSize, len(indexes))
+                xs = [pathLOD.points[indexes[idx]][0] for idx in range(start, end)]
+                ys = [pathLOD.points[indexes[idx]][1] for idx in range(start, end)]
+                chunks.append((start, end, (min(xs), min(ys), max(xs), max(ys))))
+            self.chunks[key] = chunks
+        return chunks
+
+
+    def visible_region(self):
+        '''
+        The part of the map shown by the map widget, in normalized map coordinates.
+        '''
+        return project_bbox(*self.parent.get_bbox())
+
+
+    def path_normals(self, pathIdx, zoom):
+        '''
+        The unit normal of the direction of a flight path at each of its points at a zoom level. The gradient mesh
+        offsets the path along it on both sides, like Kivy lines extend their width on both sides.
+        '''
+        key = (pathIdx, zoom)
+        normals = self.normals.get(key)
+        if normals is None:
+            points = self.level(zoom)[pathIdx]
+            count = len(points) // 2
+            normals = []
+            for idx in range(count):
+                prevIdx = max(idx-1, 0)
+                nextIdx = min(idx+1, count-1)
+                dx = points[nextIdx*2] - points[prevIdx*2]
+                dy = points[nextIdx*2+1] - points[prevIdx*2+1]
+                length = math.hypot(dx, dy)
+                normals.extend((-dy / length, dx / length) if length > 0 else (0, 1))
+            self.normals[key] = normals
+        return normals
+
+
+    def vertex_colors(self, pathIdx, metric):
+        '''
+        Colour of each point of a flight path for a metric. The ramp spans the readings of all flights in the log,
+        so the colours can be compared between flights.
+        '''
+        key = (pathIdx, metric)
+        colors = self.vertexColors.get(key)
+        if colors is None:
+            minReading, readingRange = self.reading_range(metric)
+            ramp = color_ramp(self.colorRamps[metric], self.rampSize)
+            noValueColor = get_color_from_hex(self.noValueColor)
+            colors = [
+                noValueColor if reading is None else ramp[round((reading - minReading) / readingRange * (self.rampSize-1)) if readingRange > 0 else 0]
+                for reading in self.pathValues[pathIdx][metric]
+            ]
+            self.vertexColors[key] = colors
+        return colors
+
+
+    def reading_range(self, metric):
+        '''
+        Lowest reading and the spread of the readings of a metric over all flights.
+        '''
+        readingRange = self.readingRanges.get(metric)
+        if readingRange is None:
+            readings = [reading for pathValue in self.pathValues for reading in pathValue[metric] if reading is not None]
+            minReading = min(readings, default=0)
+            readingRange = (minReading, max(readings, default=0) - minReading)
+            self.readingRanges[metric] = readingRange
+        return readingRange
+
+
+    def gradient_meshes(self, pathIdx, zoom, metric):
+        '''
+        Vertices and indices of the mesh of each chunk of a flight path coloured by a metric at a zoom level.
+        '''
+        key = (pathIdx, zoom, metric)
+        meshes = self.meshes.get(key)
+        if meshes is None:
+            points = self.level(zoom)[pathIdx]
+            normals = self.path_normals(pathIdx, zoom)
+            colors = self.vertex_colors(pathIdx, metric)
+            indexes = self.pathLODs[pathIdx].indexes(zoom)
+            meshes = []
+            for start, end, region in self.path_chunks(pathIdx, zoom):
+                vertices = []
+                for idx in range(start, end):
+                    x, y = points[idx*2:idx*2+2]
+                    nx, ny = normals[idx*2:idx*2+2]
+                    color = colors[indexes[idx]]
+                    vertices.extend((x, y, nx, ny))
+                    vertices.extend(color)
+                    vertices.extend((x, y, -nx, -ny))
+                    vertices.extend(color)
+                meshIndices = []
+                for segment in range(end - start - 1): # 2 triangles per segment.
+                    vertex = segment * 2
+                    meshIndices.extend((vertex, vertex+1, vertex+2, vertex+1, vertex+3, vertex+2))
+                meshes.append((vertices, meshIndices))
+            self.meshes[key] = meshes
+        return meshes
+
+
+    def draw(self):
+        self.paths.clear()
+        self.lines = []
+        if self.zoom is None or self.parent is None:
+            return
+        self.drawnRegion = expand_region(self.visible_region(), self.cullMargin)
+        level = self.level(self.zoom)
+        shownPaths = range(len(level)) if self.flightNum == 0 else [self.flightNum-1]
+        isGradient = self.metric != PathMetric.NONE and self.pathValues is not None and self.gradient is not None
+        self.draws = self.draws + 1
+        self.verticesDrawn = 0
+        self.totalVertices = 0
+        if isGradient:
+            self.gradient.clear()
+            self.paths.add(self.gradient)
+        else:
+            self.paths.add(Color(*self.color))
+        for pathIdx in shownPaths:
+            points = level[pathIdx]
+            chunks = self.path_chunks(pathIdx, self.zoom)
+            meshes = self.gradient_meshes(pathIdx, self.zoom, self.metric) if isGradient else None
+            for chunkIdx, (start, end, region) in enumerate(chunks):
+                if not regions_intersect(region, self.drawnRegion):
+                    continue
+                if isGradient:
+                    vertices, meshIndices = meshes[chunkIdx]
+                    self.gradient.add(Mesh(fmt=self.meshFormat, mode='triangles', vertices=vertices, indices=meshIndices))
+                else:
+                    line = Line(points=points[start*2:end*2], width=dp(self.lineWidth) / self.lineScale)
+                    self.lines.append(line)
+                    self.paths.add(line)
+                self.verticesDrawn = self.verticesDrawn + end - start
+            self.totalVertices = self.totalVertices + len(self.pathLODs[pathIdx].coords)
+
+
+    def stats(self):
+        '''
+        Number of redraws, and the vertices of the last one against all vertices of the flight paths it shows.
+        '''
+        return {
+            'draws': self.draws,
+            'zoom': self.zoom,
+            'vertices_drawn': self.verticesDrawn,
+            'vertices_total': self.totalVertices
+        }
+
+
+    def reposition(self):
+        mapview = self.parent
+        if mapview is None:
+            return
+        zoom = int(mapview.zoom)
+        if zoom != self.zoom:
+            self.zoom = zoom
+            self.draw()
+        elif self.drawnRegion is None or not region_contains(self.drawnRegion, self.visible_region()):
+            self.draw() # Panned beyond the chunks that were drawn.
+        # Measure where the origin ends up and how large a projected pixel is, which includes any pinch zoom scaling.
+        refLon, refLat = unproject(self.originX + self.refDistancePx / map_size(zoom), self.originY)
+        originX, originY = mapview.get_window_xy_from(self.originLat, self.originLon, zoom)
+        refX, refY = mapview.get_window_xy_from(refLat, refLon, zoom)
+        scale = (refX - originX) / self.refDistancePx
+        self.translate.xy = (originX, originY)
+        self.scale.xyz = (scale, scale, 1)
+        if scale > 0 and scale != self.lineScale:
+            self.set_line_scale(scale)
+
+
+    def set_line_scale(self, scale):
+        '''
+        Keep the width of the lines on screen at the scale of the map, i.e. while pinch zooming.
+        '''
+        self.lineScale = scale
+        for line in self.lines:
+            line.width = dp(self.lineWidth) / scale
+        if self.gradient is not None:
+            self.gradient['half_width'] = dp(self.lineWidth) / scale
+
+
+    def unload(self):
+        self.paths.clear()
+        self.levels = {}
+        self.chunks = {}
+        self.normals = {}
+        self.meshes = {}
+        self.drawnRegion = None
+        self.zoom = None
+
+
+class HeatmapLayer(MapLayer):
+    '''
+    Heatmap of the grid cells of all imports of a drone model, drawn as a single texture with a texel per cell. The
+    grid level follows the zoom level of the map, and only the cells around the visible part of the map are loaded.
+    '''
+    minCellPx = 4 # The finest grid level whose cells are at least this wide on the map is drawn.
+    loadMargin = 0.25 # Cells within this many viewport sizes of the visible map are loaded too, so panning rarely reloads.
+    maxTextureSize = 2048
+    alpha = 0.6
+    rampSize = 256
+    colorRamps = { # From the lowest to the highest value of the loaded cells.
+        HeatmapMetric.ACTIVITY: ["#0000ff", "#22b14c", "#ffff00", "#ed1c24"],
+        HeatmapMetric.RSSI: ["#ed1c24", "#ffff00", "#22b14c"],
+        HeatmapMetric.SATELLITES: ["#ed1c24", "#ffff00", "#22b14c"],
+        HeatmapMetric.ALTITUDE: ["#0000ff", "#22b14c", "#ffff00", "#ed1c24"]
+    }
+
+    def __init__(self, loader, metric, **kwargs):
+        '''
+        loader(level, cellRange, callback) loads the cells in a range (xMin, yMin, xMax, yMax) of cells at a grid level
+        and passes them to the callback, as returned by Db.heatmap_cells().
+        '''
+        super().__init__(**kwargs)
+        self.loader = loader
+        self.metric = metric
+        self.requested = None
+        self.loaded = None
+        self.cells = []
+        with self.canvas:
+            Color(1, 1, 1, 1)
+            self.rectangle = Rectangle(size=(0, 0))
+
+
+    def set_metric(self, metric):
+        if metric != self.metric:
+            self.metric = metric
+            self.draw()
+
+
+    def reload(self):
+        '''
+        Load the cells again, i.e. after imports were added or deleted, or for another drone model.
+        '''
+        self.requested = None
+        self.reposition()
+
+
+    def grid_level(self, zoom):
+        mapSize = map_size(zoom)
+        return max([level for level in HeatmapBinner.levels if mapSize / (2 ** level) >= self.minCellPx], default=HeatmapBinner.levels[0])
+
+
+    def cell_region(self, level, cellRange):
+        '''
+        The region covered by a range of cells, in normalized map coordinates.
+        '''
+        cellCount = 2 ** level
+        return (cellRange[0] / cellCount, cellRange[1] / cellCount, (cellRange[2]+1) / cellCount, (cellRange[3]+1) / cellCount)
+
+
+    def cell_range(self, level, region):
+        cellCount = 2 ** level
+        xMin = min(max(math.floor(region[0] * cellCount), 0), cellCount-1)
+        yMin = min(max(math.floor(region[1] * cellCount), 0), cellCount-1)
+        return (
+            xMin,
+            yMin,
+            min(max(math.floor(region[2] * cellCount), 0), cellCount-1, xMin + self.maxTextureSize-1),
+            min(max(math.floor(region[3] * cellCount), 0), cellCount-1, yMin + self.maxTextureSize-1)
+        )
+
+
+    def cell_value(self, cell):
+        x, y, samples, rssiSum, rssiSamples, minSatellites, maxAltitude = cell
+        if self.metric == HeatmapMetric.ACTIVITY:
+            return math.log(samples) # Readings per cell span orders of magnitude, between passing by and hovering.
+        if self.metric == HeatmapMetric.RSSI:
+            return rssiSum / rssiSamples if rssiSamples > 0 else None
+        if self.metric == HeatmapMetric.SATELLITES:
+            return minSatellites
+        return maxAltitude
+
+
+    def cells_loaded(self, key, cells):
+        if key != self.requested:
+            return # A newer load was requested in the meantime.
+        self.loaded = key
+        self.cells = cells
+        self.draw()
+
+
+    def draw(self):
+        if self.loaded is None:
+            return
+        level, (xMin, yMin, xMax, yMax) = self.loaded
+        values = [(cell[0] - xMin, cell[1] - yMin, self.cell_value(cell)) for cell in self.cells if cell[2] > 0]
+        values = [value for value in values if value[2] is not None]
+        if len(values) == 0:
+            self.rectangle.texture = None
+            self.rectangle.size = (0, 0)
+            return
+        minValue = min(value[2] for value in values)
+        valueRange = max(value[2] for value in values) - minValue
+        ramp = [bytes([round(rgba[0] * 255), round(rgba[1] * 255), round(rgba[2] * 255), round(self.alpha * 255)]) for rgba in color_ramp(self.colorRamps[self.metric], self.rampSize)]
+        width = xMax - xMin + 1
+        height = yMax - yMin + 1
+        texels = bytearray(width * height * 4) # Transparent where there are no readings.
+        for x, y, value in values:
+            offset = (y * width + x) * 4
+            texels[offset:offset+4] = ramp[round((value - minValue) / valueRange * (self.rampSize-1)) if valueRange > 0 else self.rampSize-1]
+        texture = Texture.create(size=(width, height), colorfmt='rgba')
+        texture.blit_buffer(bytes(texels), colorfmt='rgba', bufferfmt='ubyte')
+        self.rectangle.texture = texture
+        self.reposition()
+
+
+    def reposition(self):
+        mapview = self.parent
+        if mapview is None:
+            return
+        zoom = int(mapview.zoom)
+        level = self.grid_level(zoom)
+        visibleRegion = tuple(min(max(edge, 0), 1) for edge in project_bbox(*mapview.get_bbox())) # The map can show more than the whole world.
+        if self.requested is None or self.requested[0] != level or not region_contains(self.cell_region(*self.requested), visibleRegion):
+            self.requested = (level, self.cell_range(level, expand_region(visibleRegion, self.loadMargin)))
+            self.loader(*self.requested, lambda cells, key=self.requested: self.cells_loaded(key, cells))
+        if self.loaded is None or self.rectangle.texture is None:
+            return
+        xMin, yMin, xMax, yMax = self.cell_region(*self.loaded)
+        lonMin, latMin = unproject(xMin, yMin)
+        lonMax, latMax = unproject(xMax, yMax)
+        x1, y1 = mapview.get_window_xy_from(latMin, lonMin, zoom)
+        x2, y2 = mapview.get_window_xy_from(latMax, lonMax, zoom)
+        self.rectangle.pos = (x1, y1)
+        self.rectangle.size = (x2 - x1, y2 - y1)
+
+
+    def unload(self):
+        self.rectangle.texture = None
+        self.rectangle.size = (0, 0)
+        self.requested = None
+        self.loaded = None
+        self.cells = []
+
+
+class ArchivePathLayer(MapLayer):
+    '''
+    Simplified flight paths of all imports of a drone model. Only the flights whose bounding box overlaps the area
+    around the visible map are loaded, in the stored detail level that matches the zoom level. Loaded paths are kept in
+    an LRU cache with a bounded number of points. Like FlightPathLayer, the paths are projected relative to an origin
+    point, so panning only moves a Translate instruction. All paths go in a few triangle meshes, which are widened to
+    the line width by the line shader.
+    '''
+    loadMargin = 0.5 # Flights within this many viewport sizes of the visible map are loaded too, so panning rarely reloads.
+    maxCachedPoints = 500000
+    maxMeshVertices = 65535
+    meshFormat = [(b'v_pos', 2, 'float'), (b'v_normal', 2, 'float')]
+    refDistancePx = 1024 # Offset used to measure the scale of the map.
+
+    def __init__(self, loader, color, lineWidth, **kwargs):
+        '''
+        loader(detail, bbox, loadedIds, callback) loads the flights whose bounding box overlaps bbox (latMin, lonMin,
+        latMax, lonMax) and passes (flightIds, geometries) to the callback, as returned by Db.archive_paths(). loadedIds
+        are the flights whose path at that detail level is cached already.
+        '''
+        super().__init__(**kwargs)
+        self.loader = loader
+        self.lineWidth = lineWidth
+        self.paths = collections.OrderedDict() # (flightId, detail) -> points in normalized map coordinates, least recently shown first.
+        self.cachedPoints = 0
+        self.requested = None
+        self.detail = None
+        self.flightIds = []
+        self.zoom = None
+        self.originX = 0.5
+        self.originY = 0.5
+        self.lineScale = 1 # Scale of the map the line width was last set for.
+        self.lines = RenderContext(use_parent_projection=True, use_parent_modelview=True)
+        self.lines.shader.vs = LINE_VERTEX_SHADER
+        self.lines.shader.fs = GRADIENT_FRAGMENT_SHADER
+        if not self.lines.shader.success:
+            print("Line shader failed to compile, archive paths are drawn 1 pixel wide")
+            self.lines = None
+        else:
+            self.lines['line_color'] = get_color_from_hex(color)
+            self.lines['half_width'] = dp(self.lineWidth)
+        with self.canvas:
+            PushMatrix()
+            self.translate = Translate()
+            self.scale = Scale(1)
+            Color(*get_color_from_hex(color))
+            self.meshes = InstructionGroup()
+            PopMatrix()
+
+
+    def reload(self):
+        '''
+        Load the flights again, i.e. after imports were added or deleted, or for another drone model. The cached paths
+        are dropped, they can belong to flights that no longer exist or to another drone model.
+        '''
+        self.paths.clear()
+        self.cachedPoints = 0
+        self.requested = None
+        self.reposition()
+
+
+    def paths_loaded(self, key, flightIds, geometries):
+        if key != self.requested:
+            return # A newer load was requested in the meantime.
+        detail = key[0]
+        for flightId, points in geometries:
+            self.paths[(flightId, detail)] = points
+            self.cachedPoints = self.cachedPoints + len(points)
+        for flightId in flightIds:
+            if (flightId, detail) in self.paths:
+                self.paths.move_to_end((flightId, detail))
+        # The paths that are shown are the most recently used now, they are only evicted when they are not shown.
+        shownPaths = len([flightId for flightId in flightIds if (flightId, detail) in self.paths])
+        while self.cachedPoints > self.maxCachedPoints and len(self.paths) > shownPaths:
+            self.cachedPoints = self.cachedPoints - len(self.paths.popitem(last=False)[1])
+        self.detail = detail
+        self.flightIds = flightIds
+        self.originX = (key[1][0] + key[1][2]) / 2
+        self.originY = (key[1][1] + key[1][3]) / 2
+        self.draw()
+
+
+    def draw(self):
+        self.meshes.clear()
+        if self.zoom is None or self.detail is None:
+            return
+        if self.lines is not None:
+            self.draw_triangles()
+            self.reposition()
+            return
+        mapSize = map_size(self.zoom)
+        vertices = []
+        indices = []
+        for flightId in self.flightIds:
+            points = self.paths.get((flightId, self.detail))
+            if points is None:
+                continue
+            for start in range(0, len(points)-1, self.maxMeshVertices-1):
+                chunk = points[start:start+self.maxMeshVertices]
+                if len(vertices) // 4 + len(chunk) > self.maxMeshVertices:
+                    self.meshes.add(Mesh(mode='lines', vertices=vertices, indices=indices))
+                    vertices = []
+                    indices = []
+                firstVertex = len(vertices) // 4
+                for x, y in chunk:
+                    vertices.extend(((x - self.originX) * mapSize, (y - self.originY) * mapSize, 0, 0))
+                for idx in range(firstVertex, firstVertex + len(chunk) - 1):
+                    indices.extend((idx, idx+1))
+        if len(indices) > 0:
+            self.meshes.add(Mesh(mode='lines', vertices=vertices, indices=indices))
+        self.reposition()
+
+
+    def draw_triangles(self):
+        '''
+        Each point of a path is 2 vertices, at the point with the unit normal of the path on either side. 2 triangles
+        join the vertices of consecutive points.
+        '''
+        self.lines.clear()
+        self.meshes.add(self.lines)
+        mapSize = map_size(self.zoom)
+        vertices = []
+        indices = []
+        for flightId in self.flightIds:
+            points = self.paths.get((flightId, self.detail))
+            if points is None or len(points) < 2:
+                continue
+            pixels = [((x - self.originX) * mapSize, (y - self.originY) * mapSize) for x, y in points]
+            for start in range(0, len(pixels)-1, self.maxMeshVertices // 2 - 1):
+                end = min(start + self.maxMeshVertices // 2, len(pixels))
+                if len(vertices) // 4 + (end - start) * 2 > self.maxMeshVertices:
+                    self.lines.add(Mesh(fmt=self.meshFormat, mode='triangles', vertices=vertices, indices=indices))
+                    vertices = []
+                    indices = []
+                firstVertex = len(vertices) // 4
+                for idx in range(start, end):
+                    dx = pixels[min(idx+1, len(pixels)-1)][0] - pixels[max(idx-1, 0)][0]
+                    dy = pixels[min(idx+1, len(pixels)-1)][1] - pixels[max(idx-1, 0)][1]
+                    length = math.hypot(dx, dy)
+                    nx, ny = (-dy / length, dx / length) if length > 0 else (0, 1)
+                    x, y = pixels[idx]
+                    vertices.extend((x, y, nx, ny, x, y, -nx, -ny))
+                for segment in range(end - start - 1):
+                    vertex = firstVertex + segment * 2
+                    indices.extend((vertex, vertex+1, vertex+2, vertex+1, vertex+3, vertex+2))
+        if len(indices) > 0:
+            self.lines.add(Mesh(fmt=self.meshFormat, mode='triangles', vertices=vertices, indices=indices))
+
+
+    def reposition(self):
+        mapview = self.parent
+        if mapview is None:
+            return
+        zoom = int(mapview.zoom)
+        detail = detail_zoom(zoom)
+        visibleRegion = tuple(min(max(edge, 0), 1) for edge in project_bbox(*mapview.get_bbox())) # The map can show more than the whole world.
+        if self.requested is None or self.requested[0] != detail or not region_contains(self.requested[1], visibleRegion):
+            self.requested = (detail, expand_region(visibleRegion, self.loadMargin))
+            lonMin, latMin = unproject(self.requested[1][0], self.requested[1][1])
+            lonMax, latMax = unproject(self.requested[1][2], self.requested[1][3])
+            loadedIds = set(flightId for flightId, pathDetail in self.paths if pathDetail == detail)
+            self.loader(detail, (latMin, lonMin, latMax, lonMax), loadedIds, lambda result, key=self.requested: self.paths_loaded(key, *result))
+        if zoom != self.zoom:
+            self.zoom = zoom
+            self.draw()
+            return # draw() repositions.
+        # Measure where the origin ends up and how large a projected pixel is, which includes any pinch zoom scaling.
+        originLon, originLat = unproject(self.originX, self.originY)
+        refLon, refLat = unproject(self.originX + self.refDistancePx / map_size(zoom), self.originY)
+        originX, originY = mapview.get_window_xy_from(originLat, originLon, zoom)
+        refX, refY = mapview.get_window_xy_from(refLat, refLon, zoom)
+        scale = (refX - originX) / self.refDistancePx
+        self.translate.xy = (originX, originY)
+        self.scale.xyz = (scale, scale, 1)
+        if self.lines is not None and scale > 0 and scale != self.lineScale:
+            self.lineScale = scale
+            self.lines['half_width'] = dp(self.lineWidth) / scale # The same width on screen while pinch zooming.
+
+
+    def unload(self):
+        self.meshes.clear()
+        self.requested = None
+        self.zoom = None
+
+
+class RotatingMapMarker(MapMarker):
+    '''
+    Map marker that is rotated around its center by a canvas instruction. Changing the rotation reuses the texture
+    that is already loaded, so it costs no image processing or file access.
+    '''
+    rotation = NumericProperty(0) # Degrees, counter-clockwise.
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        with self.canvas.before:
+            PushMatrix()
+            self.rotate = Rotate(angle=self.rotation, origin=self.center)
+        with self.canvas.after:
+            PopMatrix()
+        self.bind(rotation=self.update_rotation, pos=self.update_rotation, size=self.update_rotation)
+
+
+    def update_rotation(self, *args):
+        self.rotate.angle = self.rotation
+        self.rotate.origin = self.center
@@ -0,0 +1,174 @@
+'''
+Web Mercator projection, viewport math and flight path level of detail - Developer: Koen Aerts
+'''
+import math
+
+TILE_SIZE = 256
+MAX_LATITUDE = 85.0511287798 # Latitude at which the Web Mercator map is square.
+PATH_DETAIL_ZOOMS = (8, 12, 16) # Zoom levels at which simplified flight paths are stored, for the flight archive overlay.
+
+
+def project(lon, lat):
+    '''
+    Project a coordinate to normalized map coordinates: x and y run from 0 to 1 across the whole map, with y pointing
+    up (north) like the Kivy and mapview coordinate systems. Multiply by map_size() to get pixels at a zoom level.
+    '''
+    lat = min(max(lat, -MAX_LATITUDE), MAX_LATITUDE)
+    x = (lon + 180.0) / 360.0
+    y = 0.5 + math.log(math.tan(math.pi / 4 + math.radians(lat) / 2)) / (2 * math.pi)
+    return x, y
+
+
+def unproject(x, y):
+    '''
+    Inverse of project(), returns (lon, lat).
+    '''
+    lon = x * 360.0 - 180.0
+    lat = math.degrees(2 * math.atan(math.exp((y - 0.5) * 2 * math.pi)) - math.pi / 2)
+    return lon, lat
+
+
+def map_size(zoom, tileSize=TILE_SIZE):
+    '''
+    Size of the whole map in pixels at the given zoom level.
+    '''
+    return tileSize * (2 ** zoom)
+
+
+def project_bbox(latMin, lonMin, latMax, lonMax):
+    '''
+    Project a bounding box, as returned by MapView.get_bbox(), to a region (xMin, yMin, xMax, yMax) in normalized map
+    coordinates.
+    '''
+    xMin, yMin = project(lonMin, latMin)
+    xMax, yMax = project(lonMax, latMax)
+    return (xMin, yMin, xMax, yMax)
+
+
+def expand_region(region, factor):
+    '''
+    Grow a region on all sides by a factor of its own size.
+    '''
+    marginX = (region[2] - region[0]) * factor
+    marginY = (region[3] - region[1]) * factor
+    return (region[0] - marginX, region[1] - marginY, region[2] + marginX, region[3] + marginY)
+
+
+def region_contains(outer, inner):
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and outer[2] >= inner[2] and outer[3] >= inner[3]
+
+
+def regions_intersect(region1, region2):
+    return region1[0] <= region2[2] and region2[0] <= region1[2] and region1[1] <= region2[3] and region2[1] <= region1[3]
+
+
+def tile_range(latMin, lonMin, latMax, lonMax, zoom):
+    '''
+    The map tiles covering a bounding box at a zoom level, as (xMin, yMin, xMax, yMax) tile numbers. Tile rows are
+    counted from the top of the map, like in the {x}/{y} tile server URLs.
+    '''
+    tileCount = 2 ** zoom
+    xMin, yMin, xMax, yMax = project_bbox(latMin, lonMin, latMax, lonMax)
+    return (
+        min(max(math.floor(xMin * tileCount), 0), tileCount-1),
+        min(max(math.floor((1 - yMax) * tileCount), 0), tileCount-1),
+        min(max(math.floor(xMax * tileCount), 0), tileCount-1),
+        min(max(math.floor((1 - yMin) * tileCount), 0), tileCount-1)
+    )
+
+
+def detail_zoom(zoom):
+    '''
+    The stored flight path detail level to draw at a zoom level: the coarsest one that is detailed enough.
+    '''
+    return next((detailZoom for detailZoom in PATH_DETAIL_ZOOMS if detailZoom >= zoom), PATH_DETAIL_ZOOMS[-1])
+
+
+def fit_bbox(latMin, lonMin, latMax, lonMax, width, height, minZoom, maxZoom, tileSize=TILE_SIZE):
+    '''
+    The highest zoom level at which a bounding box fits in a map widget of width x height pixels, and the center to
+    show it at, as (zoom, lat, lon). The Mercator map doubles in size with each zoom level, so the zoom follows from the
+    ratio of the widget size to the projected size of the box.
+    '''
+    xMin, yMin, xMax, yMax = project_bbox(latMin, lonMin, latMax, lonMax)
+    centerLon, centerLat = unproject((xMin + xMax) / 2, (yMin + yMax) / 2)
+    spanX = (xMax - xMin) * tileSize
+    spanY = (yMax - yMin) * tileSize
+    zoom = maxZoom
+    if spanX > 0 or spanY > 0:
+        scale = min(width / spanX if spanX > 0 else math.inf, height / spanY if spanY > 0 else math.inf)
+        zoom = math.floor(math.log2(scale)) if scale > 0 else minZoom
+    return (min(max(zoom, minZoom), maxZoom), centerLat, centerLon)
+
+
+class PathLOD():
+    '''
+    Level of detail for a flight path. Each vertex gets a significance with a single Douglas-Peucker pass: the
+    distance at which it would be dropped by the simplification. The vertices to draw at a zoom level are the ones
+    whose significance exceeds the pixel tolerance at that zoom, so each level is a filter and is cached once built.
+    '''
+    tolerancePx = 0.5 # Vertices that deviate less than this from the simplified line are not drawn.
+
+    def __init__(self, coords):
+        '''
+        coords is a list of [lon, lat] points.
+        '''
+        self.coords = coords
+        self.points = [project(coord[0], coord[1]) for coord in coords]
+        self.significance = self.calc_significance(self.points)
+        self.levels = {}
+
+    def calc_significance(self, points):
+        count = len(points)
+        significance = [0.0] * count
+        if count == 0:
+            return significance
+        significance[0] = math.inf
+        significance[count-1] = math.inf
+        stack = [(0, count-1, math.inf)]
+        while len(stack) > 0:
+            first, last, parentSignificance = stack.pop()
+            if last - first < 2:
+                continue
+            maxDist = -1.0
+            maxIdx = first + 1
+            for idx in range(first+1, last):
+                dist = self.segment_distance(points[idx], points[first], points[last])
+                if dist > maxDist:
+                    maxDist = dist
+                    maxIdx = idx
+            # A vertex can never outlive the vertex that split its range, that keeps the levels nested.
+            vertexSignificance = min(maxDist, parentSignificance)
+            significance[maxIdx] = vertexSignificance
+            stack.append((first, maxIdx, vertexSignificance))
+            stack.append((maxIdx, last, vertexSignificance))
+        return significance
+
+    def segment_distance(self, point, start, end):
+        '''
+        Distance from a point to the line segment between start and end.
+        '''
+        dx = end[0] - start[0]
+        dy = end[1] - start[1]
+        lengthSq = dx * dx + dy * dy
+        if lengthSq == 0:
+            return math.hypot(point[0] - start[0], point[1] - start[1])
+        t = min(max(((point[0] - start[0]) * dx + (point[1] - start[1]) * dy) / lengthSq, 0.0), 1.0)
+        return math.hypot(point[0] - (start[0] + t * dx), point[1] - (start[1] + t * dy))
+
+    def indexes(self, zoom):
+        '''
+        Indexes of the vertices to draw at a zoom level.
+        '''
+        level = self.levels.get(zoom)
+        if level is None:
+            tolerance = self.tolerancePx / map_size(zoom)
+            level = [idx for idx, vertexSignificance in enumerate(self.significance) if vertexSignificance > tolerance]
+            self.levels[zoom] = level
+        return level
+
+    def coords_for_zoom(self, zoom):
+        '''
+        The [lon, lat] points to draw at a zoom level.
+        '''
+        return [self.coords[idx] for idx in self.indexes(zoom)]
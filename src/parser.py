@@ -7,7 +7,9 @@ import math
 import datetime
 import re
 
-from enums import MotorStatus, DroneStatus, FlightMode, PositionMode
+from enums import MotorStatus, DroneStatus, FlightMode, PositionMode, RecordLayout, FpvPlatform, PathMetric
+from heatmap import HeatmapBinner
+from mercator import PathLOD, PATH_DETAIL_ZOOMS
 
 from kivy_garden.mapview.utils import haversine
 
@@ -20,13 +22,37 @@ class AtomBaseLogParser():
         self.common = parent.common
 
 
+    def scaled(self, value, scale):
+        '''
+        Scale a float reading to an integer for the telemetry DB. Unreadable values (NaN, infinite) become None.
+        '''
+        return round(value * scale) if math.isfinite(value) else None
+
+
+    def new_path_values(self):
+        '''
+        Metric readings of each point of a flight path, used to colour the path on the map.
+        '''
+        return {metric: [] for metric in PathMetric if metric != PathMetric.NONE}
+
+
     def parse(self, importRef):
         '''
         Parse Atom based logs.
         '''
         self.parent.zipFilename = importRef
+        telemetryDb = self.parent.telemetryDb
+        telemetryRecords = [] if telemetryDb is not None and not telemetryDb.has_import(importRef) else None
+        heatmapBinner = HeatmapBinner() if not self.db.has_heatmap(importRef) else None # Imports from before the heatmap are binned when opened.
         fpvFiles = self.db.execute("SELECT filename FROM log_files WHERE importref = ? AND bintype = 'FPV' ORDER BY filename", (importRef,))
-        binFiles = self.db.execute("SELECT filename FROM log_files WHERE importref = ? AND bintype IN ('BIN','FC') ORDER BY filename", (importRef,))
+        # Files the import scan found no valid records in are not opened, nor used as timestamp markers.
+        binFiles = self.db.execute("""
+            SELECT l.filename FROM log_files l
+            LEFT JOIN log_file_meta m ON m.filename = l.filename
+            WHERE l.importref = ? AND l.bintype IN ('BIN','FC') AND (m.records IS NULL OR m.records > m.invalid_records)
+            ORDER BY l.filename
+            """, (importRef,)
+        )
 
         # First read the FPV file. The presence of this file is optional. The format of this
         # file differs slightly based on the mobile platform it was created on: Android vs iOS.
@@ -69,10 +95,14 @@ class AtomBaseLogParser():
         firstTs = None
         distTraveled = 0
         self.parent.pathCoords = []
+        self.parent.pathValues = []
+        self.parent.pathLODs = []
         self.parent.flightStarts = {}
         self.parent.flightEnds = {}
         self.parent.flightStats = []
         pathCoord = []
+        pathValue = self.new_path_values()
+        flightHomes = {} # Home point of each flight, by flight number.
         isNewPath = True
         isFlying = False
         recordCount = 0
@@ -257,25 +287,26 @@ class AtomBaseLogParser():
                             self.parent.flightStats[pathNum][7] = dronelon
                         if speed2vertmetricabs > self.parent.flightStats[pathNum][8]: # Vertical Max speed (could be up or down)
                             self.parent.flightStats[pathNum][8] = speed2vertmetricabs
+                    isNewPoint = False
                     if (hasValidCoords):
                         if (statusChanged): # start new flight path if current one ends or new one begins.
                             if (len(pathCoord) > 0):
                                 self.parent.pathCoords.append(pathCoord)
+                                self.parent.pathValues.append(pathValue)
                                 pathCoord = []
+                                pathValue = self.new_path_values()
                                 isNewPath = True
                         if (isFlying): # Only trace path when the drone's motors are spinning faster than idle speeds.
                             pathNum = len(self.parent.pathCoords)+1
-                            if len(pathCoord) == 0:
-                                pathCoord.append([])
-                            lastSegment = pathCoord[len(pathCoord)-1]
-                            lastCoord = lastSegment[len(lastSegment)-1] if len(lastSegment) > 0 else [9999, 9999]
+                            if hasHomeCoords and pathNum not in flightHomes:
+                                flightHomes[pathNum] = (homelat, homelon)
+                            lastCoord = pathCoord[len(pathCoord)-1] if len(pathCoord) > 0 else [9999, 9999]
                             if lastCoord[0] != dronelon or lastCoord[1] != dronelat: # Only include the point if it is different from the previous (i.e. drone moved)
-                                if len(lastSegment) >= 200: # Break flight paths into segments because the map widget cannot handle too many points per path otherwise.
-                                    lastCoord = lastSegment[len(lastSegment)-1]
-                                    pathCoord.append([])
-                                    lastSegment = pathCoord[len(pathCoord)-1]
-                                    lastSegment.append(lastCoord)
-                                lastSegment.append([dronelon, dronelat])
+                                pathCoord.append([dronelon, dronelat])
+                                pathValue[PathMetric.ALTITUDE].append(alt2metric if math.isfinite(alt2metric) else None)
+                                pathValue[PathMetric.SPEED].append(speed2metric if math.isfinite(speed2metric) else None)
+                                pathValue[PathMetric.BATTERY].append(batteryLevel)
+                                isNewPoint = True
                                 if lastCoord[0] != 9999:
                                     distTraveled = distTraveled + (haversine(lastCoord[0], lastCoord[1], dronelon, dronelat) * 1000)
                             if pathNum == len(self.parent.flightStats):
@@ -322,6 +353,10 @@ class AtomBaseLogParser():
                         fpvFlightCtrlConnected = "1" if fpvFlags & 2 == 2 else "0" # Drone to controller connection.
                         fpvRemoteConnected = "1" if fpvFlags & 4 == 4 else "0"
                         #fpvHighDbm = "1" if fpvFlags & 32 == 32 else "0"
+                    if isNewPoint:
+                        pathValue[PathMetric.RSSI].append(int(fpvRssi) if fpvRssi else None)
+                    if heatmapBinner is not None and hasValidCoords and isFlying:
+                        heatmapBinner.add(dronelon, dronelat, alt2metric, satellites, int(fpvRssi) if fpvRssi else None)
 
                     flightDesc = f'{pathNum}'
                     if (isNewPath and len(pathCoord) > 0):
@@ -330,6 +365,15 @@ class AtomBaseLogParser():
                         isNewPath = False
                     if pathNum > 0:
                         self.parent.flightEnds[flightDesc] = tableLen
+                    if telemetryRecords is not None:
+                        telemetryRecords.append((
+                            recordCount, pathNum, round(readingTs.timestamp() * 1000),
+                            round(dronelat * 10000000), round(dronelon * 10000000), round(ctrllat * 10000000), round(ctrllon * 10000000), round(homelat * 10000000), round(homelon * 10000000),
+                            self.scaled(alt2metric, 100), self.scaled(dist3metric, 100), self.scaled(speed2metric, 100), self.scaled(speed2vertmetric, 100),
+                            satellites, self.scaled(gps, 1), batteryLevel, batteryTemp, batteryCurrent, round(batteryVoltage * 1000),
+                            telemetryDb.motorStatusCodes[droneMotorStatus], droneAction, flightMode, positionMode,
+                            int(fpvRssi) if fpvRssi else None, int(fpvChannel) if fpvChannel else None
+                        ))
                     self.parent.logdata.append([recordCount, recordId, pathNum, readingTs.isoformat(sep=' '), readingTs.strftime('%X'), elapsedTs, f"{self.common.fmt_num(dist1)}", f"{self.common.fmt_num(dist1lat)}", f"{self.common.fmt_num(dist1lon)}", f"{self.common.fmt_num(dist2)}", f"{self.common.fmt_num(dist2lat)}", f"{self.common.fmt_num(dist2lon)}", f"{self.common.fmt_num(dist3)}", f"{self.common.fmt_num(alt1)}", f"{self.common.fmt_num(alt2)}", alt2metric, f"{self.common.fmt_num(speed1)}", f"{self.common.fmt_num(speed1lat)}", f"{self.common.fmt_num(speed1lon)}", f"{self.common.fmt_num(speed2)}", f"{self.common.fmt_num(speed2lat)}", f"{self.common.fmt_num(speed2lon)}", f"{self.common.fmt_num(speed1vert)}", f"{self.common.fmt_num(speed2vert)}", str(satellites), str(ctrllat), str(ctrllon), str(homelat), str(homelon), str(dronelat), str(dronelon), orientation1, orientation2, roll, winddirection, motor1Stat, motor2Stat, motor3Stat, motor4Stat, droneMotorStatus.value, droneActionDesc.value, droneAction, fpvRssi, fpvChannel, fpvFlightCtrlConnected, fpvRemoteConnected, droneConnected, rth, posModeDesc, gpsStatus, inUse, f"{self.common.fmt_num(self.common.dist_val(distTraveled))}", batteryLevel, batteryTemp, batteryCurrent, batteryVoltage, batteryVoltage1, batteryVoltage2, flightModeDesc, flightCounter])
                     tableLen = tableLen + 1
 
@@ -337,21 +381,42 @@ class AtomBaseLogParser():
 
         if (len(pathCoord) > 0):
             self.parent.pathCoords.append(pathCoord)
+            self.parent.pathValues.append(pathValue)
+        self.parent.pathLODs = [PathLOD(coords) for coords in self.parent.pathCoords] # Shared by the flight path layer and the stored paths.
+        if telemetryRecords is not None:
+            telemetryDb.save_import(importRef, telemetryRecords)
+        if heatmapBinner is not None:
+            self.db.save_heatmap(importRef, heatmapBinner.rows())
+        if not self.db.has_flight_paths(importRef): # Imports from before the flight archive overlay get them when opened.
+            self.db.save_flight_paths(importRef, [(idx+1, detailZoom, pathLOD.coords_for_zoom(detailZoom)) for idx, pathLOD in enumerate(self.parent.pathLODs) for detailZoom in PATH_DETAIL_ZOOMS])
         dbRows = self.db.execute("""
             SELECT flight_number, duration, max_distance, max_altitude, max_h_speed, max_v_speed, traveled
             FROM flight_stats WHERE importref = ?
             """, (importRef,)
         )
         hasData = dbRows is not None and len(dbRows) > 0
+        if not hasData:
+            # These stats are used in the log file list to show metrics for each file. They are written
+            # in a single commit so an interrupted import never leaves a partial set of flights behind.
+            self.db.executemany("""
+                INSERT INTO flight_stats(importref, flight_number, duration, max_distance, max_altitude, max_h_speed, max_v_speed, traveled, min_lat, min_lon, max_lat, max_lon, home_lat, home_lon)
+                VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [(importRef, i, self.parent.flightStats[i][3].total_seconds(), self.parent.flightStats[i][0], self.parent.flightStats[i][1], self.parent.flightStats[i][2], self.parent.flightStats[i][8], self.parent.flightStats[i][9], self.parent.flightStats[i][4], self.parent.flightStats[i][5], self.parent.flightStats[i][6], self.parent.flightStats[i][7]) + flightHomes.get(i, (None, None)) for i in range(1, len(self.parent.flightStats))]
+            )
+        else:
+            # Flights imported before bounding boxes were recorded get them now, for the spatial index.
+            self.db.executemany(
+                "UPDATE flight_stats SET min_lat = ?, min_lon = ?, max_lat = ?, max_lon = ? WHERE importref = ? AND flight_number = ? AND min_lat IS NULL",
+                [(self.parent.flightStats[i][4], self.parent.flightStats[i][5], self.parent.flightStats[i][6], self.parent.flightStats[i][7], importRef, i) for i in range(1, len(self.parent.flightStats))]
+            )
+            # Same for the home points, for the launch sites.
+            self.db.executemany(
+                "UPDATE flight_stats SET home_lat = ?, home_lon = ? WHERE importref = ? AND flight_number = ? AND home_lat IS NULL",
+                [flightHomes[i] + (importRef, i) for i in range(1, len(self.parent.flightStats)) if i in flightHomes]
+            )
+        self.db.assign_launch_sites(importRef) # Only flights without a launch site yet.
         for i in range(1, len(self.parent.flightStats)):
-            if not hasData:
-                # These stats are used in the log file list to show metrics for each file.
-                self.db.execute("""
-                    INSERT INTO flight_stats(importref, flight_number, duration, max_distance, max_altitude, max_h_speed, max_v_speed, traveled)
-                    VALUES(?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    (importRef, i, self.parent.flightStats[i][3].total_seconds(), self.parent.flightStats[i][0], self.parent.flightStats[i][1], self.parent.flightStats[i][2], self.parent.flightStats[i][8], self.parent.flightStats[i][9])
-                )
             if self.parent.flightStats[0][3] == None:
                 self.parent.flightStats[0][2] = self.parent.flightStats[i][2] # Flight Horizontal Max speed
                 self.parent.flightStats[0][3] = self.parent.flightStats[i][3] # Flight duration (total)
@@ -378,6 +443,99 @@ class AtomBaseLogParser():
                 self.parent.flightStats[0][9] = self.parent.flightStats[0][9] + self.parent.flightStats[i][9] # Total Distance Travelled
 
 
+class LogFileScanner():
+    '''
+    Collect metadata about a log file in a single pass, without decoding the flight data itself.
+    '''
+    recordSize = 512
+    recordStruct = struct.Struct('<5xQ496xBBB') # Elapsed time and the 3 bytes at the end that identify the record layout.
+
+    def scan(self, filePath, binType):
+        if binType == 'FPV':
+            return self.scan_fpv_file(filePath)
+        return self.scan_flight_file(filePath)
+
+    def scan_flight_file(self, filePath):
+        '''
+        Scan a BIN/FC file: count the records, check the record layout and find the time span covered. Like in the
+        parser, the time of a record is the time in the file name plus its elapsed time.
+        '''
+        fileSize = os.path.getsize(filePath)
+        records = 0
+        invalidRecords = 0
+        layouts = set()
+        firstElapsed = None
+        lastElapsed = None
+        with open(filePath, mode='rb') as flightFile:
+            while True:
+                chunk = flightFile.read(self.recordSize * 1024)
+                chunkLen = len(chunk) - (len(chunk) % self.recordSize)
+                if chunkLen == 0:
+                    break
+                for elapsed, layout1, layout2, layout3 in self.recordStruct.iter_unpack(memoryview(chunk)[:chunkLen]):
+                    records = records + 1
+                    if elapsed == 0:
+                        invalidRecords = invalidRecords + 1 # Same records the parser skips.
+                        continue
+                    layouts.add(RecordLayout.LEGACY if layout1 == 0 and layout2 == 0 and layout3 == 0 else RecordLayout.CURRENT)
+                    if firstElapsed is None:
+                        firstElapsed = elapsed
+                    lastElapsed = elapsed
+        fileTs = datetime.datetime.strptime(re.sub("-.*", "", os.path.basename(filePath)), '%Y%m%d%H%M%S')
+        return {
+            "filesize": fileSize,
+            "records": records,
+            "invalid_records": invalidRecords,
+            "tail_bytes": fileSize % self.recordSize, # Incomplete record at the end of the file, if any.
+            "layout": None if len(layouts) == 0 else RecordLayout.MIXED.value if len(layouts) > 1 else layouts.pop().value,
+            "fpv_platform": None,
+            "first_ts": None if firstElapsed is None else (fileTs + datetime.timedelta(microseconds=firstElapsed)).isoformat(sep=' '),
+            "last_ts": None if lastElapsed is None else (fileTs + datetime.timedelta(microseconds=lastElapsed)).isoformat(sep=' ')
+        }
+
+    def scan_fpv_file(self, filePath):
+        '''
+        Scan an FPV file: count the records and find out on which mobile platform it was created.
+        '''
+        fileSize = os.path.getsize(filePath)
+        records = 0
+        invalidRecords = 0
+        platforms = set()
+        firstTs = None
+        lastTs = None
+        tailBytes = 0
+        with open(filePath, mode='rb') as fpvFile:
+            for fpvRecord in fpvFile:
+                reclen = len(fpvRecord)
+                if not fpvRecord.endswith(b'\n'):
+                    tailBytes = reclen
+                    break
+                if not fpvRecord[:14].isdigit():
+                    invalidRecords = invalidRecords + 1
+                    continue
+                if reclen == 19:
+                    platforms.add(FpvPlatform.IOS)
+                elif reclen == 24:
+                    platforms.add(FpvPlatform.ANDROID)
+                else:
+                    invalidRecords = invalidRecords + 1
+                    continue
+                records = records + 1
+                if firstTs is None:
+                    firstTs = fpvRecord[:14]
+                lastTs = fpvRecord[:14]
+        return {
+            "filesize": fileSize,
+            "records": records,
+            "invalid_records": invalidRecords,
+            "tail_bytes": tailBytes,
+            "layout": None,
+            "fpv_platform": platforms.pop().value if len(platforms) == 1 else None,
+            "first_ts": None if firstTs is None else datetime.datetime.strptime(firstTs.decode("ascii"), '%Y%m%d%H%M%S').isoformat(sep=' '),
+            "last_ts": None if lastTs is None else datetime.datetime.strptime(lastTs.decode("ascii"), '%Y%m%d%H%M%S').isoformat(sep=' ')
+        }
+
+
 class DreamerBaseLogParser():
 
     def __init__(self, parent):
@@ -0,0 +1,157 @@
+'''
+Flight playback scheduler - Developer: Koen Aerts
+'''
+import time
+import bisect
+import collections
+
+from kivy.clock import Clock
+
+
+def interpolate(start, end, fraction, angles=()):
+    '''
+    Linear interpolation between two tuples of readings. The values at the indexes in angles are headings in degrees
+    (0 - 359), they turn the short way round.
+    '''
+    values = []
+    for idx, (startValue, endValue) in enumerate(zip(start, end)):
+        if idx in angles:
+            values.append((startValue + (((endValue - startValue + 180) % 360) - 180) * fraction) % 360)
+        else:
+            values.append(startValue + (endValue - startValue) * fraction)
+    return values
+
+
+class FlightPlayback():
+    '''
+    Play a flight back on the Kivy clock, so frames are drawn on the main thread without a playback thread. The
+    position in the flight is a time cursor that moves with the wall clock times the playback speed, each tick shows
+    the last row at or before the cursor. When drawing a frame takes more than its share of the tick interval, the
+    interval is stretched so the map and input keep up; the cursor still moves by the elapsed time, so each tick
+    advances more rows. From skipSpeed on, ticks that come late are not drawn at all.
+    Between ticks, the optional onMotion callback is called every display frame with the row at the cursor, the
+    fraction of the way to the next row and the cursor time, to move the drone smoothly.
+    '''
+    frameBudget = 0.5 # Share of the tick interval that drawing a frame may take.
+    skipSpeed = 16 # Playback speed from which late ticks are skipped.
+    lateTick = 1.5 # A tick is late when it comes this many scheduled intervals after the previous one.
+    statsHistory = 200 # Number of ticks kept for the jitter stats.
+
+    def __init__(self, onFrame, onStopped, onMotion=None):
+        '''
+        onFrame is called with the row index to show, onStopped when playback stops, both on the main thread.
+        '''
+        self.onFrame = onFrame
+        self.onStopped = onStopped
+        self.onMotion = onMotion
+        self.event = None
+        self.motionEvent = None
+        self.speed = 1
+        self.interval = 1
+        self.times = []
+        self.firstIdx = 0
+        self.rowIdx = 0
+        self.cursor = 0
+        self.scheduledDelay = self.interval
+        self.scheduledAt = 0
+        self.lastTickAt = 0
+        self.counts = {
+            'ticks': 0,
+            'frames': 0,
+            'dropped': 0,
+            'skipped': 0,
+            'motion_frames': 0
+        }
+        self.jitter = collections.deque(maxlen=self.statsHistory)
+        self.frameCost = 0
+
+
+    def is_playing(self):
+        return self.event is not None
+
+
+    def start(self, times, firstIdx, rowIdx, interval, speed):
+        '''
+        Start playback at rowIdx. times holds the flight time in seconds of the rows of the flight, starting with row
+        firstIdx. interval is the time between frames in seconds.
+        '''
+        self.stop()
+        self.times = times
+        self.firstIdx = firstIdx
+        self.rowIdx = rowIdx
+        self.interval = interval
+        self.speed = speed
+        self.cursor = times[rowIdx - firstIdx]
+        self.frameCost = 0
+        self.lastTickAt = time.monotonic()
+        self.schedule(interval)
+        if self.onMotion is not None:
+            self.motionEvent = Clock.schedule_interval(self.move, 0) # Every frame.
+
+
+    def stop(self):
+        '''
+        Stop playback. The pending tick is cancelled, so this takes effect right away.
+        '''
+        if self.event is None:
+            return
+        self.event.cancel()
+        self.event = None
+        if self.motionEvent is not None:
+            self.motionEvent.cancel()
+            self.motionEvent = None
+        self.onStopped()
+
+
+    def schedule(self, delay):
+        self.scheduledDelay = delay
+        self.scheduledAt = time.monotonic()
+        self.event = Clock.schedule_once(self.tick, delay)
+
+
+    def tick(self, dt):
+        now = time.monotonic()
+        delay = now - self.scheduledAt
+        self.cursor = self.cursor + (now - self.lastTickAt) * self.speed # Includes the time spent drawing the last frame.
+        self.lastTickAt = now
+        self.counts['ticks'] = self.counts['ticks'] + 1
+        self.jitter.append(abs(delay - self.scheduledDelay))
+        lastPos = len(self.times) - 1
+        pos = min(max(bisect.bisect_right(self.times, self.cursor) - 1, self.rowIdx - self.firstIdx), lastPos)
+        finished = pos == lastPos
+        late = delay > self.scheduledDelay * self.lateTick
+        if late:
+            self.counts['dropped'] = self.counts['dropped'] + max(round(delay / self.scheduledDelay) - 1, 1)
+        if late and self.speed >= self.skipSpeed and not finished:
+            self.counts['skipped'] = self.counts['skipped'] + 1
+        elif self.firstIdx + pos != self.rowIdx or finished:
+            self.rowIdx = self.firstIdx + pos
+            self.onFrame(self.rowIdx)
+            self.counts['frames'] = self.counts['frames'] + 1
+            cost = time.monotonic() - now
+            self.frameCost = cost if self.frameCost == 0 else self.frameCost * 0.8 + cost * 0.2
+        if finished:
+            self.stop()
+            return
+        self.schedule(max(self.interval, self.frameCost / self.frameBudget))
+
+
+    def move(self, dt):
+        cursor = self.cursor + (time.monotonic() - self.lastTickAt) * self.speed
+        lastPos = len(self.times) - 1
+        pos = min(max(bisect.bisect_right(self.times, cursor) - 1, 0), lastPos)
+        fraction = 0
+        if pos < lastPos and self.times[pos+1] > self.times[pos]:
+            fraction = min(max((cursor - self.times[pos]) / (self.times[pos+1] - self.times[pos]), 0), 1)
+        self.counts['motion_frames'] = self.counts['motion_frames'] + 1
+        self.onMotion(self.firstIdx + pos, fraction, min(cursor, self.times[lastPos]))
+
+
+    def stats(self):
+        stats = dict(self.counts)
+        stats['interval_ms'] = round(self.scheduledDelay * 1000)
+        stats['frame_cost_ms'] = round(self.frameCost * 1000, 1)
+        if len(self.jitter) > 0:
+            stats['jitter_avg_ms'] = round(sum(self.jitter) * 1000 / len(self.jitter), 1)
+            stats['jitter_max_ms'] = round(max(self.jitter) * 1000, 1)
+        return stats
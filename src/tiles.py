@@ -0,0 +1,321 @@
+'''
+Map tile cache and offline map tiles - Developer: Koen Aerts
+'''
+import io
+import time
+import queue
+import random
+import requests
+import requests.adapters
+import itertools
+import threading
+import collections
+import urllib.parse
+
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from kivy.clock import mainthread
+from kivy.core.image import Image as CoreImage
+from kivy_garden.mapview import MapSource
+
+from mercator import tile_range
+
+
+class TileFetcher():
+    '''
+    Download map tiles with a bounded number of concurrent requests, over persistent connections: one pooled
+    requests session per tile server host. Tiles shown by the map go before prefetched tiles, and requests for tiles
+    that left the map before their download started are dropped.
+    '''
+    PRIORITY_VIEW = 0
+    PRIORITY_PREFETCH = 1
+    workers = 6 # Concurrent requests for all hosts together.
+    requestTimeout = 10
+    viewportHistory = 20 # Number of viewport load times kept for the stats.
+
+    def __init__(self, userAgent):
+        self.userAgent = userAgent
+        self.lock = threading.Lock()
+        self.queue = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.sessions = {}
+        self.counts = {
+            'requests': 0,
+            'downloaded': 0,
+            'cancelled': 0,
+            'failed': 0
+        }
+        self.viewPending = 0
+        self.viewStartedAt = None
+        self.viewportTimes = collections.deque(maxlen=self.viewportHistory)
+        for idx in range(self.workers):
+            threading.Thread(target=self.run, name=f"tile-fetcher-{idx}", daemon=True).start()
+
+
+    def fetch(self, url, priority, isCancelled=None):
+        '''
+        Queue a tile download. Returns a Future with the image data. isCancelled is called right before the download
+        starts, when it returns True the download is skipped and the Future is cancelled.
+        '''
+        future = Future()
+        with self.lock:
+            self.counts['requests'] = self.counts['requests'] + 1
+            if priority == self.PRIORITY_VIEW:
+                if self.viewPending == 0:
+                    self.viewStartedAt = time.monotonic()
+                self.viewPending = self.viewPending + 1
+        self.queue.put((priority, next(self.sequence), url, isCancelled, future))
+        return future
+
+
+    def session(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+        with self.lock:
+            session = self.sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                session.headers.update({"User-Agent": self.userAgent})
+                session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.workers))
+                session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.workers))
+                self.sessions[host] = session
+        return session
+
+
+    def run(self):
+        while True:
+            priority, sequence, url, isCancelled, future = self.queue.get()
+            try:
+                if (isCancelled is not None and isCancelled()) or not future.set_running_or_notify_cancel():
+                    future.cancel()
+                    self.count('cancelled')
+                    continue
+                try:
+                    response = self.session(url).get(url, timeout=self.requestTimeout)
+                    response.raise_for_status()
+                    self.count('downloaded')
+                    future.set_result(response.content)
+                except Exception as e:
+                    self.count('failed')
+                    future.set_exception(e)
+            finally:
+                if priority == self.PRIORITY_VIEW:
+                    self.view_request_done()
+
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] = self.counts[key] + 1
+
+
+    def view_request_done(self):
+        '''
+        Time to complete the viewport: from the first tile request of the map after an idle moment until all its
+        tile requests are done.
+        '''
+        with self.lock:
+            self.viewPending = self.viewPending - 1
+            if self.viewPending == 0:
+                self.viewportTimes.append(time.monotonic() - self.viewStartedAt)
+
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counts)
+            stats['pending'] = self.queue.qsize()
+            stats['viewport_loads'] = len(self.viewportTimes)
+            if len(self.viewportTimes) > 0:
+                stats['viewport_last_ms'] = round(self.viewportTimes[-1] * 1000)
+                stats['viewport_avg_ms'] = round(sum(self.viewportTimes) * 1000 / len(self.viewportTimes))
+                stats['viewport_max_ms'] = round(max(self.viewportTimes) * 1000)
+        return stats
+
+
+class CachedMapSource(MapSource):
+    '''
+    Map source that keeps its tiles in a TileCacheDb instead of one file per tile in the cache directory. Tiles are
+    read from the cache in worker threads, missing tiles are downloaded by the TileFetcher. Only the texture is created
+    on the main thread.
+    '''
+    workers = 2
+
+    def __init__(self, tileCache, tileFetcher, **kwargs):
+        super().__init__(**kwargs)
+        self.tileCache = tileCache
+        self.tileFetcher = tileFetcher
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tile-loader")
+
+
+    def fill_tile(self, tile):
+        '''
+        Called by the map widget for each tile it shows. Tile rows are counted from the bottom of the map. The map
+        widget sets the state of tiles it removes to "done".
+        '''
+        if tile.state == "done":
+            return
+        self.executor.submit(self.load_tile, tile)
+
+
+    def load_tile(self, tile):
+        try:
+            if tile.state == "done":
+                return
+            data = self.tileCache.get_tile(tile.zoom, tile.tile_x, tile.tile_y)
+            if data is None:
+                future = self.fetch_tile(tile.zoom, tile.tile_x, self.get_row_count(tile.zoom) - tile.tile_y - 1, TileFetcher.PRIORITY_VIEW, lambda: tile.state == "done")
+                future.add_done_callback(lambda future: self.tile_downloaded(tile, future))
+            else:
+                mainthread(self.show_tile)(tile, data)
+        except Exception as e:
+            print(f"Error loading tile {tile.zoom}/{tile.tile_x}/{tile.tile_y}: {e}")
+
+
+    def tile_downloaded(self, tile, future):
+        if future.cancelled():
+            return
+        try:
+            data = future.result()
+            self.tileCache.put_tile(tile.zoom, tile.tile_x, tile.tile_y, data)
+            mainthread(self.show_tile)(tile, data)
+        except Exception as e:
+            print(f"Error loading tile {tile.zoom}/{tile.tile_x}/{tile.tile_y}: {e}")
+
+
+    def fetch_tile(self, zoom, x, y, priority, isCancelled=None):
+        '''
+        Download the image data of a tile, returns a Future. The row (y) is counted from the top of the map, like in
+        the tile URLs.
+        '''
+        url = self.url.format(z=zoom, x=x, y=y, s=random.choice(self.subdomains))
+        return self.tileFetcher.fetch(url, priority, isCancelled)
+
+
+    def show_tile(self, tile, data):
+        if tile.state == "done":
+            return
+        imageExt = "jpg" if data[:3] == b'\xff\xd8\xff' else "png" # Some tile servers return JPEG whatever the URL says.
+        tile.texture = CoreImage(io.BytesIO(data), ext=imageExt).texture
+        tile.state = "need-animation"
+
+
+class TilePrefetcher():
+    '''
+    Download the map tiles around flights into the tile cache ahead of time, so the map can be used without a
+    connection. These tiles are pinned in the cache, so they are not evicted to make room for other tiles.
+    '''
+    minZoom = 12
+    maxZoom = 17
+    maxTiles = 10000 # Per job, tile servers do not allow bulk downloads.
+    workers = 4 # Downloads queued at a time, they wait for the tiles shown by the map.
+    requestsPerSecond = 8 # Shared by all workers.
+    defaultTileBytes = 20 * 1024 # Size estimate when there are no cached tiles of the map source yet.
+    progressInterval = 0.5 # Seconds between progress updates.
+    CANCELLED = -1 # Download result of a tile that was skipped because the job was cancelled.
+
+    def __init__(self, parent):
+        self.parent = parent
+        self.lock = threading.Lock()
+        self.running = False
+        self.cancelled = False
+        self.nextRequestAt = 0
+
+
+    def plan(self, mapSource, bboxes):
+        '''
+        The tiles that cover the bounding boxes and are not cached yet, lowest zoom levels first, and an estimate of
+        their total size in bytes based on the tiles of the map source that are already cached. Tile rows are counted
+        from the top of the map.
+        '''
+        tiles = set()
+        for latMin, lonMin, latMax, lonMax in bboxes:
+            for zoom in range(max(self.minZoom, mapSource.min_zoom), min(self.maxZoom, mapSource.max_zoom)+1):
+                xMin, yMin, xMax, yMax = tile_range(latMin, lonMin, latMax, lonMax, zoom)
+                for x in range(xMin, xMax+1):
+                    for y in range(yMin, yMax+1):
+                        tiles.add((zoom, x, y))
+        missingTiles = [tile for tile in sorted(tiles) if not mapSource.tileCache.has_tile(tile[0], tile[1], (2 ** tile[0]) - tile[2] - 1)]
+        tileBytes = mapSource.tileCache.average_tile_size() or self.defaultTileBytes
+        return missingTiles, round(len(missingTiles) * tileBytes)
+
+
+    def start(self, mapSource, tiles):
+        '''
+        Download the tiles in the background. Returns False when a download is already running.
+        '''
+        with self.lock:
+            if self.running:
+                return False
+            self.running = True
+            self.cancelled = False
+        threading.Thread(target=self.run, args=(mapSource, tiles[:self.maxTiles]), daemon=True).start()
+        return True
+
+
+    def cancel(self):
+        self.cancelled = True
+
+
+    def run(self, mapSource, tiles):
+        '''
+        Download the tiles into the cache of the map source. Returns the report that is passed to the parent as well.
+        '''
+        report = {
+            'total': len(tiles),
+            'downloaded': 0,
+            'failed': 0,
+            'cancelled': 0,
+            'bytes': 0
+        }
+        lastProgress = 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for tileBytes in executor.map(lambda tile: self.download(mapSource, *tile), tiles):
+                    if tileBytes is None:
+                        report['failed'] = report['failed'] + 1
+                    elif tileBytes == self.CANCELLED:
+                        report['cancelled'] = report['cancelled'] + 1
+                    else:
+                        report['downloaded'] = report['downloaded'] + 1
+                        report['bytes'] = report['bytes'] + tileBytes
+                    if time.monotonic() - lastProgress >= self.progressInterval:
+                        lastProgress = time.monotonic()
+                        mainthread(self.parent.tile_prefetch_progress)(dict(report))
+        except Exception as e:
+            print(f"Tile download failed: {e}")
+        finally:
+            with self.lock:
+                self.running = False
+        print(f"Tile download: {report}")
+        mainthread(self.parent.tile_prefetch_done)(report)
+        return report
+
+
+    def throttle(self):
+        '''
+        Wait for the next request slot, so all workers together stay within the request rate.
+        '''
+        with self.lock:
+            now = time.monotonic()
+            wait = self.nextRequestAt - now
+            self.nextRequestAt = max(now, self.nextRequestAt) + 1 / self.requestsPerSecond
+        if wait > 0:
+            time.sleep(wait)
+
+
+    def download(self, mapSource, zoom, x, y):
+        '''
+        Download a single tile into the cache. Returns its size, None if it could not be downloaded or CANCELLED if
+        the job was cancelled first.
+        '''
+        if self.cancelled:
+            return self.CANCELLED
+        self.throttle()
+        try:
+            data = mapSource.fetch_tile(zoom, x, y, TileFetcher.PRIORITY_PREFETCH, lambda: self.cancelled).result()
+            if not mapSource.tileCache.put_tile(zoom, x, (2 ** zoom) - y - 1, data, pinned=True):
+                self.cancelled = True # The cache is full, the other tiles would not fit either.
+                return self.CANCELLED
+            return len(data)
+        except CancelledError:
+            return self.CANCELLED
+        except Exception as e:
+            print(f"Error downloading tile {zoom}/{x}/{y}: {e}")
+            return None
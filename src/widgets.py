@@ -2,12 +2,15 @@
 Custom Widgets - Developers: Chris Raynak, Koen Aerts
 '''
 import math
+import time
 from kivy.clock import Clock
+from kivy.core.image import Image as CoreImage
+from kivy.core.text import Label as CoreLabel
+from kivy.graphics import Callback, ClearBuffers, ClearColor, Fbo, Mesh, PopMatrix, PushMatrix, Rectangle, Rotate
+from kivy.graphics.opengl import glDisable, glEnable, GL_BLEND
 from kivy.metrics import dp
-from kivy.properties import NumericProperty, BoundedNumericProperty, StringProperty
 from kivy.uix.image import Image
 from kivy.uix.label import Label
-from kivy.uix.scatter import Scatter
 from kivy.uix.widget import Widget
 
 import kivy_garden.graph
@@ -151,380 +154,191 @@ class SplashScreen():
                 self.splash_win.remove_widget(self.splash_text)
 
 
-class DistGauge(Widget):
+class GaugeCluster(Widget):
     '''
-    Distance Gauge
-    '''    
-    display_unit = StringProperty("")
-    unit = NumericProperty(1.8)
-    value = BoundedNumericProperty(0, min=0, max=99000, errorvalue=0)
-
-    def __init__(self, **kwargs):
-        super(DistGauge, self).__init__(**kwargs)
-        self.file_gauge = "assets/Distance_Background.png"
-        self.file_needle_long = "assets/LongNeedleAltimeter1a.png"
-        self.file_needle_short = "assets/SmallNeedleAltimeter1a.png"
-        self._gauge = Scatter(
-            size=self.size,
-            do_rotation=False,
-            do_scale=False,
-            do_translation=False
-        )
-        self._img_gauge = Image(
-            source=self.file_gauge,
-            size=self.size,
-        )
-        self._needleL = Scatter(
-            size=self.size,
-            do_rotation=False,
-            do_scale=False,
-            do_translation=False
-        )
-        self._needleS = Scatter(
-            size=self.size,
-            do_rotation=False,
-            do_scale=False,
-            do_translation=False
-        )
-        self._img_needle_short = Image(
-            source=self.file_needle_short,
-            size=self.size,
-        )
-        self._img_needle_long = Image(
-            source=self.file_needle_long,
-            size=self.size,
-        )
-        self._glab = Label(font_size=dp(14), markup=True, color=[1, 1, 1, 1])
-        self._glab2 = Label(font_size=dp(12), markup=True, color=[1, 1, 1, 1])
-        self._gauge.add_widget(self._img_gauge)
-        self._needleS.add_widget(self._img_needle_short)
-        self._needleL.add_widget(self._img_needle_long)
-        self.add_widget(self._gauge)
-        self.add_widget(self._needleS)
-        self.add_widget(self._needleL)
-        self.add_widget(self._glab)
-        self.add_widget(self._glab2)
-        self.bind(pos=self._update)
-        self.bind(size=self._update)
-        self.bind(value=self._turn)
-
-    def _update(self, *args): # Update gauge and needle positions after sizing or positioning.
-        self._glab.font_size = dp(14) if self.height > dp(100) else dp(12) if self.height > dp(75) else dp(10)
-        self._glab2.font_size = dp(12) if self.height > dp(75) else dp(10)
-        self._gauge.size = self.size
-        self._img_gauge.size = self.size
-        self._needleL.size = self.size
-        self._needleS.size = self.size
-        self._img_needle_short.size = self.size
-        self._img_needle_long.size = self.size
-        self._gauge.pos = self.pos
-        self._needleL.pos = (self.x, self.y)
-        self._needleL.center = self._gauge.center
-        self._needleS.pos = (self.x, self.y)
-        self._needleS.center = self._gauge.center
-        self._glab.center_x = self._gauge.center_x - dp(28)/dp(150)*self.size[0]
-        self._glab.center_y = self._gauge.center_y + dp(1)/dp(150)*self.size[1]
-        self._glab2.center_x = self._gauge.center_x
-        self._glab2.center_y = self._gauge.center_y - dp(15)/dp(150)*self.size[1]
-
-    def _turn(self, *args): # Turn needle
-        self._needleS.center_x = self._gauge.center_x
-        self._needleS.center_y = self._gauge.center_y
-        self._needleS.rotation = ((1 * self.unit) - (self.value * self.unit * 2)/10)
-        self._needleL.center_x = self._gauge.center_x
-        self._needleL.center_y = self._gauge.center_y
-        self._needleL.rotation = (1 * self.unit) - (self.value * self.unit * 2)        
-        self._glab.text = "[b]{0:04d}[/b]".format(self.value)
-        self._glab2.text = self.display_unit
-
-
-class AltGauge(Widget):
-    '''
-    Altitude Gauge
-    '''
-    display_unit = StringProperty("")
-    unit = NumericProperty(1.8)
-    value = BoundedNumericProperty(0, min=0, max=8000, errorvalue=0)
-    size_text = NumericProperty(10)
-
-    def __init__(self, **kwargs):
-        super(AltGauge, self).__init__(**kwargs)
-        self.file_gauge = "assets/Altimeter_Background2.png"
-        self.file_needle_long = "assets/LongNeedleAltimeter1a.png"
-        self.file_needle_short = "assets/SmallNeedleAltimeter1a.png"
-        self._gauge = Scatter(
-            size=self.size,
-            do_rotation=False,
-            do_scale=False,
-            do_translation=False
-        )
-        self._img_gauge = Image(
-            source=self.file_gauge,
-            size=self.size,
-        )
-        self._needleL = Scatter(
-            size=self.size,
-            do_rotation=False,
-            do_scale=False,
-            do_translation=False
-        )
-        self._needleS = Scatter(
-            size=self.size,
-            do_rotation=False,
-            do_scale=False,
-            do_translation=False
-        )
-        self._img_needle_short = Image(
-            source=self.file_needle_short,
-            size=self.size
-        )
-        self._img_needle_long = Image(
-            source=self.file_needle_long,
-            size=self.size
-        )
-        self._glab = Label(font_size=dp(14), markup=True, color=[1, 1, 1, 1])
-        self._glab2 = Label(font_size=dp(12), markup=True, color=[1, 1, 1, 1])
-        self._gauge.add_widget(self._img_gauge)
-        self._needleS.add_widget(self._img_needle_short)
-        self._needleL.add_widget(self._img_needle_long)
-        self.add_widget(self._gauge)
-        self.add_widget(self._needleS)
-        self.add_widget(self._needleL)
-        self.add_widget(self._glab)
-        self.add_widget(self._glab2)
-        self.bind(pos=self._update)
-        self.bind(size=self._update)
-        self.bind(value=self._turn)
-        self.bind(display_unit=self._turn)
-
-    def _update(self, *args): # Update gauge and needle positions after sizing or positioning.
-        self._glab.font_size = dp(14) if self.height > dp(100) else dp(12) if self.height > dp(75) else dp(10)
-        self._glab2.font_size = dp(12) if self.height > dp(75) else dp(10)
-        self._gauge.size = self.size
-        self._img_gauge.size = self.size
-        self._needleL.size = self.size
-        self._needleS.size = self.size
-        self._img_needle_short.size = self.size
-        self._img_needle_long.size = self.size
-        self._gauge.pos = self.pos
-        self._needleL.pos = (self.x, self.y)
-        self._needleL.center = self._gauge.center
-        self._needleS.pos = (self.x, self.y)
-        self._needleS.center = self._gauge.center
-        self._glab.center_x = self._gauge.center_x - dp(28)/dp(150)*self.size[0]
-        self._glab.center_y = self._gauge.center_y + dp(1)/dp(150)*self.size[1]
-        self._glab2.center_x = self._gauge.center_x
-        self._glab2.center_y = self._gauge.center_y - dp(16)/dp(150)*self.size[1]
-
-    def _turn(self, *args): # Turn needle
-        self._needleS.center_x = self._gauge.center_x
-        self._needleS.center_y = self._gauge.center_y
-        self._needleS.rotation = ((1 * self.unit) - (self.value * self.unit * 2)/10)
-        self._needleL.center_x = self._gauge.center_x
-        self._needleL.center_y = self._gauge.center_y
-        self._needleL.rotation = (1 * self.unit) - (self.value * self.unit * 2)        
-        self._glab.text = "[b]{0:04d}[/b]".format(self.value)
-        self._glab2.text = self.display_unit
-
-
-class HGauge(Widget):
+    Analog gauges: distance, altitude, horizontal speed, vertical speed and heading dials, stacked from top to bottom,
+    drawn on the canvas of a single widget. The dial images are packed into one texture when the cluster is created,
+    the dial faces are drawn as a single mesh and the needles are turned with Rotate instructions. set_values()
+    updates all needles and readouts at once.
     '''
-    Horizontal Speed Gauge
-    '''
-    display_unit = StringProperty("")
-    unit = NumericProperty(1.8)
-    value = BoundedNumericProperty(0, min=-400, max=400, errorvalue=0)
-    size_text = NumericProperty(10)
+    unit = 1.8
+    atlasPadding = 2 # Pixels between the images in the atlas texture, so scaled images do not pick up their neighbours.
+    images = {
+        'distance': "assets/Distance_Background.png",
+        'altitude': "assets/Altimeter_Background2.png",
+        'hspeed': "assets/AirSpeedIndicator_Background_H.png",
+        'vspeed': "assets/AirSpeedIndicator_Background_V.png",
+        'heading': "assets/HeadingIndicator_Background1.png",
+        'heading_ring': "assets/HeadingRing.png",
+        'heading_drone': "assets/Heading_drone3a.png",
+        'needle': "assets/needle.png",
+        'needle_long': "assets/LongNeedleAltimeter1a.png",
+        'needle_short': "assets/SmallNeedleAltimeter1a.png"
+    }
+    dials = ('distance', 'altitude', 'hspeed', 'vspeed', 'heading') # Top to bottom.
+    limits = ((0, 99000), (0, 8000), (-400, 400), (-14, 14), (0, 400)) # Values out of these ranges show as 0.
 
     def __init__(self, **kwargs):
-        super(HGauge, self).__init__(**kwargs)
-        self.file_gauge = "assets/AirSpeedIndicator_Background_H.png"
-        self.file_needle = "assets/needle.png"
-        self._gauge = Scatter(
-            size=self.size,
-            do_rotation=False,
-            do_scale=False,
-            do_translation=False
-        )
-        self._img_gauge = Image(
-            source=self.file_gauge,
-            size=self.size
-        )
-        self._needle = Scatter(
-            size=self.size,
-            do_rotation=False,
-            do_scale=False,
-            do_translation=False
-        )
-        self._img_needle = Image(
-            source=self.file_needle,
-            size=self.size
-        )
-        self._glab = Label(font_size=dp(14), markup=True)
-        self._glab2 = Label(font_size=dp(12), markup=True, color=[1, 1, 1, 1])
-        self._gauge.add_widget(self._img_gauge)
-        self._needle.add_widget(self._img_needle)
-        self.add_widget(self._gauge)
-        self.add_widget(self._needle)
-        self.add_widget(self._glab2)
-        self.bind(pos=self._update)
-        self.bind(size=self._update)
-        self.bind(value=self._turn)
-
-    def _update(self, *args): # Update gauge and needle positions after sizing or positioning.
-        self._glab2.font_size = dp(12) if self.height > dp(75) else dp(10)
-        self._gauge.size = self.size
-        self._img_gauge.size = self.size
-        self._needle.size = self.size
-        self._img_needle.size = self.size
-        self._gauge.pos = self.pos
-        self._needle.pos = (self.x, self.y)
-        self._needle.center = self._gauge.center
-        self._glab.center_x = self._gauge.center_x
-        self._glab.center_y = self._gauge.center_y
-        self._glab2.center_x = self._gauge.center_x
-        self._glab2.center_y = self._gauge.center_y - dp(20)/dp(150)*self.size[1]
-
-    def _turn(self, *args): # Turn needle
-        self._needle.center_x = self._gauge.center_x
-        self._needle.center_y = self._gauge.center_y
-        self._needle.rotation = (100 * self.unit) - (self.value * self.unit * 4)
-        self._glab2.text = self.display_unit
-
-
-class VGauge(Widget):
-    '''
-    Vertical Speed Gauge
-    '''
-    display_unit = StringProperty("")
-    unit = NumericProperty(1.8)
-    value = BoundedNumericProperty(0, min=-14, max=14, errorvalue=0)
-    size_text = NumericProperty(10)
-
-    def __init__(self, **kwargs):
-        super(VGauge, self).__init__(**kwargs)
-        self.file_gauge = "assets/AirSpeedIndicator_Background_V.png"
-        self.file_needle = "assets/needle.png"
-        self._gauge = Scatter(
-            size=self.size,
-            do_rotation=False,
-            do_scale=False,
-            do_translation=False
-        )
-        self._img_gauge = Image(
-            source=self.file_gauge,
-            size=self.size
-        )
-        self._needle = Scatter(
-            size=self.size,
-            do_rotation=False,
-            do_scale=False,
-            do_translation=False
-        )
-        self._img_needle = Image(
-            source=self.file_needle,
-            size=self.size
-        )
-        self._glab = Label(font_size=dp(14), markup=True)
-        self._glab2 = Label(font_size=dp(12), markup=True, color=[1, 1, 1, 1])
-        self._gauge.add_widget(self._img_gauge)
-        self._needle.add_widget(self._img_needle)
-        self.add_widget(self._gauge)
-        self.add_widget(self._needle)
-        self.add_widget(self._glab2)
-        self.bind(pos=self._update)
-        self.bind(size=self._update)
-        self.bind(value=self._turn)
-
-    def _update(self, *args): # Update gauge and needle positions after sizing or positioning.
-        self._glab2.font_size = dp(12) if self.height > dp(75) else dp(10)
-        self._gauge.size = self.size
-        self._img_gauge.size = self.size
-        self._needle.size = self.size
-        self._img_needle.size = self.size
-        self._gauge.pos = self.pos
-        self._needle.pos = (self.x, self.y)
-        self._needle.center = self._gauge.center
-        self._glab.center_x = self._gauge.center_x
-        self._glab.center_y = self._gauge.center_y
-        self._glab2.center_x = self._gauge.center_x
-        self._glab2.center_y = self._gauge.center_y - dp(20)/dp(150)*self.size[1]
-
-    def _turn(self, *args): # Turn needle
-        self._needle.center_x = self._gauge.center_x
-        self._needle.center_y = self._gauge.center_y
-        self._needle.rotation = -(self.value * self.unit * 5.5)
-        self._glab2.text = self.display_unit
-
-
-class HeadingGauge(Widget):
-    '''
-    Heading Gauge (direction drone is travelling as opposed to direction drone is looking)
-    '''
-    unit = NumericProperty(1.8)
-    value = BoundedNumericProperty(0, min=0, max=400, errorvalue=0)
-    drotation = BoundedNumericProperty(0, min=0, max=400, errorvalue=0) #Rotational position of drone
-    size_text = NumericProperty(10)
-
-    def __init__(self, **kwargs):
-        super(HeadingGauge, self).__init__(**kwargs)
-        self.file_gauge = "assets/HeadingIndicator_Background1.png"
-        self.file_heading_ring = "assets/HeadingRing.png"
-        self.file_heading_aircraft = "assets/Heading_drone3a.png"
-        self.size_gauge = dp(150)
-        self._gauge = Scatter(
-            size=self.size,
-            do_rotation=False,
-            do_scale=False,
-            do_translation=False
-        )
-        self._img_gauge = Image(
-            source=self.file_gauge,
-            size=self.size
-        )
-        self._headingR = Scatter(
-            size=self.size,
-            do_rotation=False,
-            do_scale=False,
-            do_translation=False
-        )
-        self._aircrafT = Scatter(
-            size=self.size,
-            do_rotation=False,
-            do_scale=False,
-            do_translation=False
-        )
-        self._img_aircraft = Image(
-            source=self.file_heading_aircraft,
-            size=self.size
-         )
-        self._img_heading_ring = Image(
-            source=self.file_heading_ring,
-            size=self.size
-        )
-        self._gauge.add_widget(self._img_gauge)
-        self._headingR.add_widget(self._img_heading_ring)
-        self._aircrafT.add_widget(self._img_aircraft)
-        self.add_widget(self._gauge)
-        self.add_widget(self._headingR)
-        self.add_widget(self._aircrafT)        
-        self.bind(pos=self._update)
-        self.bind(size=self._update)
-        self.bind(value=self._turn)
-
-    def _update(self, *args): # Update positioning.
-        self._gauge.size = self.size
-        self._img_gauge.size = self.size
-        self._headingR.size = self.size
-        self._aircrafT.size = self.size
-        self._img_aircraft.size = self.size
-        self._img_heading_ring.size = self.size
-        self._gauge.pos = self.pos
-        self._headingR.pos = (self.x, self.y)
-        self._headingR.center = self._gauge.center
-        self._aircrafT.pos = (self.x, self.y)
-
-    def _turn(self, *args): # Turn
-        self._headingR.center_x = self._gauge.center_x
-        self._headingR.center_y = self._gauge.center_y
-        self._headingR.rotation = (1 * self.unit) - (self.value * 1)
+        super(GaugeCluster, self).__init__(**kwargs)
+        self.textures = self.build_atlas()
+        self.values = (0, 0, 0, 0, 0)
+        self.distUnit = ""
+        self.speedUnit = ""
+        self.counts = {
+            'updates': 0,
+            'update_us': 0,
+            'update_max_us': 0
+        }
+        with self.canvas:
+            self.faces = Mesh(texture=self.textures['distance'], mode='triangles')
+            self.needles = {}
+            for name, image in (('distance_short', 'needle_short'), ('distance_long', 'needle_long'), ('altitude_short', 'needle_short'), ('altitude_long', 'needle_long'), ('hspeed', 'needle'), ('vspeed', 'needle'), ('heading', 'heading_ring')):
+                PushMatrix()
+                rotate = Rotate()
+                rectangle = Rectangle(texture=self.textures[image])
+                PopMatrix()
+                self.needles[name] = (rotate, rectangle)
+            self.headingDrone = Rectangle(texture=self.textures['heading_drone'])
+            self.readouts = {name: [None, Rectangle(size=(0, 0))] for name in ('distance', 'distance_unit', 'altitude', 'altitude_unit', 'hspeed_unit', 'vspeed_unit')}
+        self.bind(pos=self.layout, size=self.layout)
+
+    def build_atlas(self):
+        '''
+        Draw the images side by side into a frame buffer and return a region of its texture for each image. Blending
+        is off while drawing, so the pixels, transparency included, are copied as they are. The frame buffer is only
+        drawn again when its content is lost.
+        '''
+        textures = {name: CoreImage(fileName).texture for name, fileName in self.images.items()}
+        width = sum(texture.width + self.atlasPadding for texture in textures.values())
+        height = max(texture.height for texture in textures.values())
+        self.atlas = Fbo(size=(width, height))
+        regions = {}
+        x = 0
+        with self.atlas:
+            ClearColor(0, 0, 0, 0)
+            ClearBuffers()
+            Callback(lambda instr: glDisable(GL_BLEND))
+            for name, texture in textures.items():
+                Rectangle(texture=texture, pos=(x, 0), size=texture.size)
+                regions[name] = (x, 0, texture.width, texture.height)
+                x = x + texture.width + self.atlasPadding
+            Callback(lambda instr: glEnable(GL_BLEND))
+        self.canvas.before.add(self.atlas) # Drawn once, and again when the GL context is reloaded.
+        return {name: self.atlas.texture.get_region(*region) for name, region in regions.items()}
+
+    def fit(self, texture, center, side):
+        '''
+        Position and size of an image centered in a square dial, scaled down to fit but never scaled up.
+        '''
+        scale = min(side / texture.width, side / texture.height, 1)
+        width = texture.width * scale
+        height = texture.height * scale
+        return ((center[0] - width / 2, center[1] - height / 2), (width, height))
+
+    def dial_center(self, idx):
+        side = self.width
+        return (self.x + side / 2, self.top - side * idx - side / 2)
+
+    def layout(self, *args): # Position the dials after sizing or positioning.
+        side = self.width
+        vertices = []
+        indices = []
+        for idx, name in enumerate(self.dials):
+            (x, y), (width, height) = self.fit(self.textures[name], self.dial_center(idx), side)
+            u0, v0, u1, v1, u2, v2, u3, v3 = self.textures[name].tex_coords
+            vertices.extend((x, y, u0, v0, x + width, y, u1, v1, x + width, y + height, u2, v2, x, y + height, u3, v3))
+            base = idx * 4
+            indices.extend((base, base + 1, base + 2, base + 2, base + 3, base))
+        self.faces.vertices = vertices
+        self.faces.indices = indices
+        for name, (rotate, rectangle) in self.needles.items():
+            center = self.dial_center(self.dials.index(name.split('_')[0]))
+            rotate.origin = center
+            rectangle.pos, rectangle.size = self.fit(rectangle.texture, center, side)
+        self.headingDrone.pos, self.headingDrone.size = self.fit(self.headingDrone.texture, self.dial_center(4), side)
+        self.turn()
+        for name in self.readouts:
+            self.readouts[name][0] = None # Font sizes depend on the dial size.
+        self.update_readouts()
+
+    def set_units(self, speedUnit, distUnit):
+        self.speedUnit = speedUnit
+        self.distUnit = distUnit
+        self.update_readouts()
+
+    def set_values(self, distance, altitude, hSpeed, vSpeed, heading):
+        '''
+        Turn all needles and update the readouts in one go.
+        '''
+        startedAt = time.perf_counter()
+        values = self.limit((distance, altitude, hSpeed, vSpeed, heading))
+        if values == self.values:
+            return
+        self.values = values
+        self.turn()
+        self.update_readouts()
+        elapsed = round((time.perf_counter() - startedAt) * 1000000)
+        self.counts['updates'] = self.counts['updates'] + 1
+        self.counts['update_us'] = self.counts['update_us'] + elapsed
+        self.counts['update_max_us'] = max(self.counts['update_max_us'], elapsed)
+
+    @classmethod
+    def limit(cls, values):
+        return tuple(value if low <= value <= high else 0 for value, (low, high) in zip(values, cls.limits))
+
+    @classmethod
+    def needle_angles(cls, values):
+        '''
+        Angle of each needle in degrees, counterclockwise.
+        '''
+        distance, altitude, hSpeed, vSpeed, heading = values
+        return {
+            'distance_short': (1 * cls.unit) - (distance * cls.unit * 2)/10,
+            'distance_long': (1 * cls.unit) - (distance * cls.unit * 2),
+            'altitude_short': (1 * cls.unit) - (altitude * cls.unit * 2)/10,
+            'altitude_long': (1 * cls.unit) - (altitude * cls.unit * 2),
+            'hspeed': (100 * cls.unit) - (hSpeed * cls.unit * 4),
+            'vspeed': -(vSpeed * cls.unit * 5.5),
+            'heading': (1 * cls.unit) - (heading * 1)
+        }
+
+    def turn(self): # Turn needles
+        for name, angle in self.needle_angles(self.values).items():
+            self.needles[name][0].angle = angle
+
+    def update_readouts(self):
+        '''
+        Render the value and unit texts of the dials, only the ones whose text changed.
+        '''
+        side = self.width
+        valueFontSize = dp(14) if side > dp(100) else dp(12) if side > dp(75) else dp(10)
+        unitFontSize = dp(12) if side > dp(75) else dp(10)
+        distance, altitude = self.values[0], self.values[1]
+        for name, text, fontSize, bold, offset, idx in (
+            ('distance', "{0:04d}".format(round(distance)), valueFontSize, True, (-28, 1), 0),
+            ('distance_unit', self.distUnit, unitFontSize, False, (0, -15), 0),
+            ('altitude', "{0:04d}".format(round(altitude)), valueFontSize, True, (-28, 1), 1),
+            ('altitude_unit', self.distUnit, unitFontSize, False, (0, -16), 1),
+            ('hspeed_unit', self.speedUnit, unitFontSize, False, (0, -20), 2),
+            ('vspeed_unit', self.speedUnit, unitFontSize, False, (0, -20), 3)
+        ):
+            readout = self.readouts[name]
+            if readout[0] == text:
+                continue
+            readout[0] = text
+            rectangle = readout[1]
+            if len(text) == 0:
+                rectangle.size = (0, 0)
+                continue
+            label = CoreLabel(text=text, font_size=fontSize, bold=bold, color=(1, 1, 1, 1))
+            label.refresh()
+            center = self.dial_center(idx)
+            rectangle.texture = label.texture
+            rectangle.size = label.texture.size
+            rectangle.pos = (center[0] + offset[0] / 150 * side - label.texture.width / 2, center[1] + offset[1] / 150 * side - label.texture.height / 2)
+
+    def stats(self):
+        stats = dict(self.counts)
+        stats['update_avg_us'] = round(self.counts['update_us'] / self.counts['updates']) if self.counts['updates'] > 0 else 0
+        stats['draw_calls'] = len([instruction for instruction in self.canvas.children if isinstance(instruction, (Mesh, Rectangle))])
+        return stats
@@ -0,0 +1,229 @@
+'''
+Schema migrations and query plans of the flight log DB, on a synthetic archive of 10k imports.
+'''
+import datetime
+import sqlite3
+
+import pytest
+
+from db import Db
+
+IMPORTS = 10000
+FLIGHTS_PER_IMPORT = 3
+MODELS = ["Atom", "Atom SE", "P1A"]
+
+
+def import_ref(idx):
+    date = datetime.date(2020, 1, 1) + datetime.timedelta(days=idx // 5)
+    return f"{date.strftime('%Y%m%d')}{idx % 5:02d}0000-{MODELS[idx % len(MODELS)]}-Drone{idx}.zip"
+
+
+@pytest.fixture(scope="module")
+def archive(tmp_path_factory):
+    db = Db(str(tmp_path_factory.mktemp("archive") / "flights.db"))
+    db.executemany("INSERT INTO models(modelref) VALUES(?)", [(model,) for model in MODELS])
+    db.executemany(
+        "INSERT INTO imports(importref, modelref, dateref, importedon) VALUES(?,?,?,?)",
+        [(import_ref(idx), MODELS[idx % len(MODELS)], import_ref(idx)[:8], "2024-01-01T00:00:00") for idx in range(IMPORTS)]
+    )
+    db.executemany(
+        "INSERT INTO log_files(filename, importref, bintype) VALUES(?,?,?)",
+        [(f"{import_ref(idx)[:14]}-{kind}.bin", import_ref(idx), kind) for idx in range(IMPORTS) for kind in ("FC", "FPV")]
+    )
+    flights = []
+    for idx in range(IMPORTS):
+        lat = 40 + (idx % 100) * 0.1
+        lon = -5 + (idx // 100) * 0.1
+        for flight in range(1, FLIGHTS_PER_IMPORT + 1):
+            flights.append((import_ref(idx), flight, 60 * flight, 100.0 * flight, 50.0, 10.0, 3.0, 500.0 * flight, lat, lon, lat + 0.01, lon + 0.01, lat + 0.005, lon + 0.005))
+    db.executemany("""
+        INSERT INTO flight_stats(importref, flight_number, duration, max_distance, max_altitude, max_h_speed, max_v_speed, traveled, min_lat, min_lon, max_lat, max_lon, home_lat, home_lon)
+        VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+        """, flights
+    )
+    for idx in range(0, IMPORTS, 500):
+        db.assign_launch_sites(import_ref(idx))
+    db.execute("ANALYZE") # The worst case for the R*Tree joins: statistics for the regular tables only.
+    return db
+
+
+def query_plan(db, query, params=()):
+    return [row[3] for row in db.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+
+
+def assert_no_scan(plan):
+    # A scan of the R*Tree is a lookup through its own index, any other scan reads the whole table.
+    scans = [step for step in plan if step.startswith("SCAN") and "VIRTUAL TABLE INDEX" not in step]
+    assert scans == [], plan
+
+
+def test_archive_is_populated(archive):
+    assert archive.execute("SELECT count(1) FROM imports")[0][0] == IMPORTS
+    assert archive.execute("SELECT count(1) FROM flight_bbox")[0][0] == IMPORTS * FLIGHTS_PER_IMPORT
+    assert archive.execute("SELECT sum(flights) FROM model_summary")[0][0] == IMPORTS * FLIGHTS_PER_IMPORT
+
+
+def test_log_list_uses_import_summary(archive):
+    plan = query_plan(archive, """
+        SELECT importref, dateref, flights, duration, max_duration, max_distance, max_altitude, max_h_speed, max_v_speed, traveled
+        FROM import_summary
+        WHERE modelref = ?
+        AND (? IS NULL OR importref IN (SELECT importref FROM flight_stats WHERE site_id = ?))
+        ORDER BY dateref DESC, importref DESC
+        """, ("Atom", None, None)
+    )
+    assert_no_scan(plan)
+    assert any("import_summary_model_index" in step for step in plan), plan
+    assert not any("TEMP B-TREE" in step for step in plan), plan
+
+
+def test_log_list_site_filter_uses_site_index(archive):
+    plan = query_plan(archive, """
+        SELECT importref FROM import_summary
+        WHERE modelref = ?
+        AND (? IS NULL OR importref IN (SELECT importref FROM flight_stats WHERE site_id = ?))
+        ORDER BY dateref DESC, importref DESC
+        """, ("Atom", 1, 1)
+    )
+    assert_no_scan(plan)
+    assert any("flight_stats_site_index" in step for step in plan), plan
+
+
+def test_model_totals_use_model_summary(archive):
+    plan = query_plan(archive, "SELECT imports, flights, duration, traveled FROM model_summary WHERE modelref = ?", ("Atom",))
+    assert_no_scan(plan)
+    assert any("model_summary" in step for step in plan), plan
+
+
+def test_imports_by_model_use_covering_index(archive):
+    plan = query_plan(archive, "SELECT importref, dateref FROM imports WHERE modelref = ? ORDER BY dateref DESC, importref DESC", ("Atom",))
+    assert_no_scan(plan)
+    assert any("COVERING INDEX imports_model_index" in step for step in plan), plan
+
+
+def test_parser_log_file_lookup_uses_covering_index(archive):
+    plan = query_plan(archive, "SELECT filename FROM log_files WHERE importref = ? AND bintype = 'FPV' ORDER BY filename", (import_ref(42),))
+    assert_no_scan(plan)
+    assert any("COVERING INDEX log_files_import_index" in step for step in plan), plan
+
+
+def test_flights_in_bbox_use_rtree(archive):
+    plan = query_plan(archive, """
+        SELECT i.importref, s.flight_number
+        FROM flight_bbox b
+        CROSS JOIN flight_stats s ON s.flight_id = b.id
+        JOIN imports i ON i.importref = s.importref
+        WHERE b.max_lat >= ? AND b.min_lat <= ? AND b.max_lon >= ? AND b.min_lon <= ?
+        """, (45, 45.5, 0, 0.5)
+    )
+    assert_no_scan(plan)
+    assert any("VIRTUAL TABLE INDEX" in step for step in plan), plan
+    assert any("INTEGER PRIMARY KEY" in step for step in plan), plan
+    flights = archive.flights_in_bbox(45, 0, 45.5, 0.5)
+    assert len(flights) > 0
+    assert all(flight[6] <= 45.5 and flight[8] >= 45 and flight[7] <= 0.5 and flight[9] >= 0 for flight in flights)
+
+
+def test_launch_site_flights_use_site_index(archive):
+    plan = query_plan(archive, """
+        SELECT i.importref, s.flight_number
+        FROM flight_stats s
+        JOIN imports i ON i.importref = s.importref
+        WHERE s.site_id = ?
+        ORDER BY i.dateref DESC, i.importref DESC, s.flight_number
+        """, (1,)
+    )
+    assert_no_scan(plan)
+    assert any("flight_stats_site_index" in step for step in plan), plan
+    assert len(archive.launch_sites()) > 0
+
+
+def test_summaries_are_in_sync(archive):
+    assert archive.rebuild_summaries() == 0
+
+
+def test_baseline_schema_migrates(tmp_path):
+    dbFile = str(tmp_path / "baseline.db")
+    con = sqlite3.connect(dbFile)
+    # The schema as created before migrations existed, with rows that violate the foreign keys it did not enforce.
+    con.executescript("""
+        CREATE TABLE models(
+            modelref TEXT PRIMARY KEY
+        );
+        CREATE TABLE imports(
+            importref TEXT PRIMARY KEY,
+            modelref TEXT NOT NULL,
+            dateref TEXT NOT NULL,
+            importedon TEXT NOT NULL,
+            FOREIGN KEY (modelref) REFERENCES models(modelref) ON DELETE CASCADE ON UPDATE NO ACTION
+        );
+        CREATE TABLE log_files(
+            filename TEXT PRIMARY KEY,
+            importref TEXT NOT NULL,
+            bintype TEXT NOT NULL,
+            FOREIGN KEY (importref) REFERENCES imports(importref) ON DELETE CASCADE ON UPDATE NO ACTION
+        );
+        CREATE TABLE flight_stats(
+            importref TEXT NOT NULL,
+            flight_number INTEGER NOT NULL,
+            duration INTEGER NOT NULL,
+            max_distance REAL NOT NULL,
+            max_altitude REAL NOT NULL,
+            max_h_speed REAL NOT NULL,
+            max_v_speed REAL NOT NULL,
+            traveled REAL NOT NULL,
+            FOREIGN KEY (importref) REFERENCES imports(importref) ON DELETE CASCADE ON UPDATE NO ACTION
+        );
+        CREATE INDEX flight_stats_index ON flight_stats(importref);
+        INSERT INTO models VALUES('Atom');
+        INSERT INTO imports VALUES('20240101120000-Atom-Drone.zip', 'Atom', '20240101', '2024-01-01T12:00:00');
+        INSERT INTO imports VALUES('20240102120000-Gone-Drone.zip', 'Gone', '20240102', '2024-01-02T12:00:00');
+        INSERT INTO log_files VALUES('20240101120000-FC.bin', '20240101120000-Atom-Drone.zip', 'FC');
+        INSERT INTO log_files VALUES('20240103120000-FC.bin', '20240103120000-Atom-Drone.zip', 'FC');
+        INSERT INTO flight_stats VALUES('20240101120000-Atom-Drone.zip', 1, 120, 300.0, 80.0, 12.0, 4.0, 900.0);
+        INSERT INTO flight_stats VALUES('20240101120000-Atom-Drone.zip', 2, 60, 100.0, 40.0, 8.0, 2.0, 400.0);
+        INSERT INTO flight_stats VALUES('20240103120000-Atom-Drone.zip', 1, 30, 10.0, 5.0, 1.0, 1.0, 20.0);
+    """)
+    con.commit()
+    con.close()
+
+    db = Db(dbFile)
+    assert [row[0] for row in db.execute("SELECT version FROM schema_version ORDER BY version")] == [version for version, _, _ in Db.migrations]
+    assert db.schema_version() == len(Db.migrations) == 12
+    assert db.execute("SELECT importref FROM imports") == [("20240101120000-Atom-Drone.zip",)]
+    assert db.execute("SELECT count(1) FROM log_files")[0][0] == 1
+    assert db.execute("SELECT flight_id, flight_number FROM flight_stats ORDER BY flight_id") == [(1, 1), (2, 2)]
+    assert db.execute("SELECT flights, duration, max_distance, traveled FROM import_summary") == [(2, 180, 300.0, 1300.0)]
+    assert db.execute("SELECT imports, flights FROM model_summary WHERE modelref = 'Atom'") == [(1, 2)]
+    assert db.rebuild_summaries() == 0
+
+    db.migrate() # Applying the migrations again changes nothing.
+    assert db.schema_version() == 12
+    assert db.rebuild_summaries() == 0
+
+
+def test_failed_commit_rolls_back(tmp_path):
+    db = Db(str(tmp_path / "commit.db"))
+    with pytest.raises(sqlite3.IntegrityError):
+        with db.transaction():
+            db.execute("PRAGMA defer_foreign_keys = ON") # The foreign key is checked by the COMMIT.
+            db.execute("INSERT INTO log_files(filename, importref, bintype) VALUES('orphan.bin', 'missing.zip', 'FC')")
+    assert db.local.depth == 0
+    assert not db.connection().in_transaction
+    assert db.execute("SELECT count(1) FROM log_files") == [(0,)]
+
+    # The next transaction starts afresh.
+    with db.transaction():
+        db.execute("INSERT INTO models(modelref) VALUES('Atom')")
+    assert db.execute("SELECT modelref FROM models") == [("Atom",)]
+
+
+def test_failed_statement_rolls_back_nested_transactions(tmp_path):
+    db = Db(str(tmp_path / "nested.db"))
+    with pytest.raises(sqlite3.IntegrityError):
+        with db.transaction():
+            db.execute("INSERT INTO models(modelref) VALUES('Atom')")
+            with db.transaction():
+                db.execute("INSERT INTO models(modelref) VALUES('Atom')")
+    assert db.local.depth == 0
+    assert db.execute("SELECT count(1) FROM models") == [(0,)]
@@ -0,0 +1,111 @@
+'''
+Integrity checks of the log archive: content hashes and changed files.
+'''
+import datetime
+import os
+
+import pytest
+
+pytest.importorskip("kivy")
+
+from db import AsyncDb, Db
+from integrity import IntegrityChecker
+
+IMPORT_REF = "20240101120000-Atom-Drone.zip"
+LOG_FILE = "20240101120000-FC.bin"
+
+
+class Parent():
+    '''
+    The parts of the app the integrity checker uses.
+    '''
+    def __init__(self, tmp_path):
+        self.db = Db(str(tmp_path / "flights.db"))
+        self.asyncDb = AsyncDb(self.db)
+        self.logfileDir = str(tmp_path / "logs")
+        self.telemetryDb = None
+        self.reports = []
+        os.mkdir(self.logfileDir)
+
+    def save_log_file_meta(self, binBaseName, binType):
+        filesize = os.path.getsize(os.path.join(self.logfileDir, binBaseName))
+        self.db.execute("INSERT OR REPLACE INTO log_file_meta(filename, filesize, records, invalid_records, tail_bytes) VALUES(?,?,0,0,0)", (binBaseName, filesize))
+
+    def purge_import(self, importRef):
+        self.db.execute("DELETE FROM imports WHERE importref = ?", (importRef,))
+        return False
+
+    def integrity_check_done(self, report):
+        self.reports.append(report)
+
+
+@pytest.fixture
+def parent(tmp_path):
+    parent = Parent(tmp_path)
+    parent.db.execute("INSERT INTO models(modelref) VALUES('Atom')")
+    parent.db.execute("INSERT INTO imports(importref, modelref, dateref, importedon) VALUES(?,'Atom','20240101','2024-01-01T12:00:00')", (IMPORT_REF,))
+    parent.db.execute("INSERT INTO log_files(filename, importref, bintype) VALUES(?,?,'FC')", (LOG_FILE, IMPORT_REF))
+    write_log_file(parent, b"original")
+    return parent
+
+
+def write_log_file(parent, data):
+    with open(os.path.join(parent.logfileDir, LOG_FILE), mode='wb') as binFile:
+        binFile.write(data)
+
+
+def age_verification(parent):
+    verifiedOn = (datetime.datetime.now() - datetime.timedelta(days=IntegrityChecker.verifyIntervalDays + 1)).isoformat()
+    parent.db.execute("UPDATE log_file_meta SET verified_on = ?", (verifiedOn,))
+
+
+def test_new_files_are_hashed_once(parent):
+    checker = IntegrityChecker(parent)
+    report = checker.check()
+    assert report['scanned_files'] == 1
+    assert report['hashed_files'] == 1
+    contentHash = parent.db.execute("SELECT content_hash FROM log_file_meta")[0][0]
+    assert contentHash == checker.file_hash(os.path.join(parent.logfileDir, LOG_FILE))
+
+    # Recently verified files are not hashed again, i.e. on the run after a delete.
+    assert checker.check()['hashed_files'] == 0
+    age_verification(parent)
+    assert checker.check()['hashed_files'] == 1
+
+
+def test_changed_file_keeps_its_original_hash(parent):
+    checker = IntegrityChecker(parent)
+    checker.check()
+    contentHash = parent.db.execute("SELECT content_hash FROM log_file_meta")[0][0]
+
+    write_log_file(parent, b"corrupted")
+    age_verification(parent)
+    assert checker.check()['changed_files'] == 1
+    assert parent.db.execute("SELECT content_hash, changed_on IS NOT NULL FROM log_file_meta") == [(contentHash, 1)]
+
+    # Still changed, it is reported once.
+    age_verification(parent)
+    assert checker.check()['changed_files'] == 0
+    assert parent.db.execute("SELECT content_hash, changed_on IS NOT NULL FROM log_file_meta") == [(contentHash, 1)]
+
+    # Restored from a backup.
+    write_log_file(parent, b"original")
+    age_verification(parent)
+    assert checker.check()['changed_files'] == 0
+    assert parent.db.execute("SELECT content_hash, changed_on FROM log_file_meta") == [(contentHash, None)]
+
+
+def test_import_with_missing_files_is_purged(parent):
+    os.remove(os.path.join(parent.logfileDir, LOG_FILE))
+    report = IntegrityChecker(parent).check()
+    assert report['purged_imports'] == 1
+    assert parent.db.execute("SELECT count(1) FROM imports") == [(0,)]
+
+
+def test_import_deleted_by_the_user_is_not_purged_again(parent):
+    os.remove(os.path.join(parent.logfileDir, LOG_FILE))
+    deleted = parent.asyncDb.call(parent.purge_import, IMPORT_REF) # Queued before the check starts.
+    report = IntegrityChecker(parent).check()
+    deleted.result()
+    assert report['purged_imports'] == 0
+    assert parent.db.execute("SELECT count(1) FROM imports") == [(0,)]
@@ -0,0 +1,103 @@
+'''
+Map tile cache: budget, pinned tiles and offline tile packs.
+'''
+import sqlite3
+
+import pytest
+
+from db import TileCacheDb
+
+
+def tile_cache(tmp_path, name="test", imageExt="png", budgetBytes=1048576):
+    return TileCacheDb(str(tmp_path / f"{name}.mbtiles"), name=name, imageExt=imageExt, budgetBytes=budgetBytes)
+
+
+def test_pack_round_trip(tmp_path):
+    source = tile_cache(tmp_path, "source")
+    tiles = {(14, x, 100): bytes([x]) * (100 + x) for x in range(5)}
+    for (zoom, x, row), data in tiles.items():
+        source.put_tile(zoom, x, row, data)
+    packFile = str(tmp_path / "pack.mbtiles")
+    source.export_pack(packFile)
+
+    pack = sqlite3.connect(packFile)
+    assert dict(pack.execute("SELECT name, value FROM metadata").fetchall())['format'] == "png"
+    assert pack.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    pack.close()
+
+    target = tile_cache(tmp_path, "target")
+    assert target.import_pack(packFile) == len(tiles)
+    for (zoom, x, row), data in tiles.items():
+        assert target.get_tile(zoom, x, row) == data
+    assert target.execute("SELECT count(1), sum(pinned) FROM tiles") == [(len(tiles), len(tiles))]
+    assert target.stats()['bytes'] == sum(len(data) for data in tiles.values())
+
+
+def test_pack_format_must_match(tmp_path):
+    source = tile_cache(tmp_path, "source", imageExt="jpg")
+    source.put_tile(10, 1, 1, b"\xff\xd8\xff" + b"x" * 100)
+    packFile = str(tmp_path / "pack.mbtiles")
+    source.export_pack(packFile)
+    with pytest.raises(ValueError):
+        tile_cache(tmp_path, "png").import_pack(packFile)
+    assert tile_cache(tmp_path, "jpg", imageExt="jpg").import_pack(packFile) == 1
+
+
+def test_pack_must_be_mbtiles(tmp_path):
+    cache = tile_cache(tmp_path)
+    with pytest.raises(FileNotFoundError):
+        cache.import_pack(str(tmp_path / "missing.mbtiles"))
+    otherFile = str(tmp_path / "other.db")
+    other = sqlite3.connect(otherFile)
+    other.execute("CREATE TABLE other(value)")
+    other.close()
+    with pytest.raises(ValueError):
+        cache.import_pack(otherFile)
+    assert cache.execute("SELECT count(1) FROM tiles") == [(0,)]
+
+
+def test_pinned_tiles_stay_within_the_budget(tmp_path):
+    cache = tile_cache(tmp_path, budgetBytes=1000)
+    assert cache.put_tile(14, 0, 0, b"a" * 400, pinned=True)
+    assert cache.put_tile(14, 1, 0, b"b" * 400, pinned=True)
+    assert not cache.put_tile(14, 2, 0, b"c" * 400, pinned=True)
+    assert cache.get_tile(14, 2, 0) is None
+    assert cache.stats()['pinned_bytes'] == 800
+
+    # Unpinned tiles make room for the pinned ones, the budget holds for all tiles.
+    assert cache.put_tile(14, 3, 0, b"d" * 300)
+    assert cache.stats()['bytes'] <= 1000
+    assert cache.get_tile(14, 0, 0) == b"a" * 400
+
+    # Downloaded again by the map, a pinned tile stays pinned.
+    assert cache.put_tile(14, 0, 0, b"e" * 400)
+    assert cache.execute("SELECT pinned FROM tiles WHERE tile_column = 0") == [(1,)]
+    assert cache.stats()['pinned_bytes'] == 800
+
+
+def test_lower_budget_unpins_least_recently_used_tiles(tmp_path):
+    cache = tile_cache(tmp_path, budgetBytes=1000)
+    for x in range(3):
+        cache.put_tile(14, x, 0, bytes([x]) * 300, pinned=True)
+        cache.execute("UPDATE tiles SET last_used = ? WHERE tile_column = ?", (1000 + x, x))
+    cache.set_budget(500)
+    assert cache.execute("SELECT tile_column FROM tiles WHERE pinned = 1") == [(2,)]
+    assert cache.stats()['pinned_bytes'] == 300
+    assert cache.stats()['bytes'] <= 500
+    assert cache.get_tile(14, 2, 0) == bytes([2]) * 300
+
+
+def test_pack_must_fit_in_the_budget(tmp_path):
+    source = tile_cache(tmp_path, "source")
+    for x in range(5):
+        source.put_tile(14, x, 100, bytes([x]) * 100)
+    packFile = str(tmp_path / "pack.mbtiles")
+    source.export_pack(packFile)
+    target = tile_cache(tmp_path, "target", budgetBytes=1000)
+    target.put_tile(10, 0, 0, b"x" * 600, pinned=True)
+    with pytest.raises(ValueError):
+        target.import_pack(packFile)
+    assert target.execute("SELECT count(1) FROM tiles") == [(1,)]
+    target.set_budget(1100)
+    assert target.import_pack(packFile) == 5
+    assert target.stats()['pinned_bytes'] == 1100
@@ -0,0 +1,231 @@
+'''
+Tile prefetching and fetching against a local tile server stand-in.
+'''
+import threading
+import time
+import http.server
+
+import pytest
+
+pytest.importorskip("kivy")
+pytest.importorskip("kivy_garden.mapview")
+
+from db import TileCacheDb
+from mercator import tile_range
+from tiles import CachedMapSource, TileFetcher, TilePrefetcher
+
+BBOX = (50.85, 4.35, 50.86, 4.36) # Brussels, a flight sized area.
+
+
+class TileHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, like real tile servers.
+
+    def do_GET(self):
+        self.server.requests.append((time.monotonic(), self.path))
+        time.sleep(self.server.latency)
+        if "/404/" in self.path:
+            self.send_error(404)
+            return
+        data = b"\x89PNG\r\n\x1a\n" + self.path.encode("ascii")
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def tile_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), TileHandler)
+    server.daemon_threads = True
+    server.requests = []
+    server.latency = 0
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def tile_cache(tmp_path):
+    return TileCacheDb(str(tmp_path / "test.mbtiles"), name="test", imageExt="png", budgetBytes=100 * 1048576)
+
+
+@pytest.fixture
+def tile_fetcher():
+    return TileFetcher("potdrone-tests")
+
+
+def map_source(tileCache, tileFetcher, server, **kwargs):
+    return CachedMapSource(tileCache, tileFetcher, url=server.url + "/{z}/{x}/{y}.png", cache_key="test", **kwargs)
+
+
+class Parent():
+    '''
+    Receives the progress of a prefetch job, like the app does.
+    '''
+    def __init__(self):
+        self.progress = []
+        self.reports = []
+
+    def tile_prefetch_progress(self, report):
+        self.progress.append(report)
+
+    def tile_prefetch_done(self, report):
+        self.reports.append(report)
+
+
+def test_plan_covers_tile_range_at_prefetch_zooms(tile_server, tile_cache, tile_fetcher):
+    prefetcher = TilePrefetcher(Parent())
+    mapSource = map_source(tile_cache, tile_fetcher, tile_server, min_zoom=0, max_zoom=19)
+    expected = set()
+    for zoom in range(12, 18):
+        xMin, yMin, xMax, yMax = tile_range(*BBOX, zoom)
+        expected.update((zoom, x, y) for x in range(xMin, xMax+1) for y in range(yMin, yMax+1))
+    tiles, estimatedBytes = prefetcher.plan(mapSource, [BBOX])
+    assert tiles == sorted(expected)
+    assert set(tile[0] for tile in tiles) == set(range(12, 18))
+    assert estimatedBytes == len(tiles) * TilePrefetcher.defaultTileBytes
+
+    # Cached tiles are left out, and the estimate follows the size of the cached tiles.
+    zoom, x, y = tiles[0]
+    tile_cache.put_tile(zoom, x, (2 ** zoom) - y - 1, b"x" * 1000)
+    cachedTiles, estimatedBytes = prefetcher.plan(mapSource, [BBOX])
+    assert cachedTiles == tiles[1:]
+    assert estimatedBytes == len(cachedTiles) * 1000
+
+
+def test_plan_stays_within_map_source_zooms(tile_server, tile_cache, tile_fetcher):
+    prefetcher = TilePrefetcher(Parent())
+    tiles, _ = prefetcher.plan(map_source(tile_cache, tile_fetcher, tile_server, min_zoom=0, max_zoom=14), [BBOX])
+    assert set(tile[0] for tile in tiles) == {12, 13, 14}
+
+
+def test_start_caps_the_tiles_per_job(tile_server, tile_cache, tile_fetcher):
+    prefetcher = TilePrefetcher(Parent())
+    jobs = []
+    done = threading.Event()
+    def run(mapSource, tiles):
+        jobs.append(tiles)
+        done.wait()
+        prefetcher.running = False
+    prefetcher.run = run
+    tiles = [(17, x, 0) for x in range(TilePrefetcher.maxTiles + 50)]
+    assert prefetcher.start(map_source(tile_cache, tile_fetcher, tile_server), tiles)
+    assert not prefetcher.start(map_source(tile_cache, tile_fetcher, tile_server), tiles) # One job at a time.
+    done.set()
+    for _ in range(100):
+        if len(jobs) > 0:
+            break
+        time.sleep(0.01)
+    assert len(jobs) == 1
+    assert jobs[0] == tiles[:TilePrefetcher.maxTiles]
+
+
+def test_run_stores_pinned_tiles_within_the_request_rate(tile_server, tile_cache, tile_fetcher):
+    parent = Parent()
+    prefetcher = TilePrefetcher(parent)
+    mapSource = map_source(tile_cache, tile_fetcher, tile_server)
+    tiles, _ = prefetcher.plan(mapSource, [BBOX])
+    tiles = tiles[:17]
+    startedAt = time.monotonic()
+    report = prefetcher.run(mapSource, tiles)
+    elapsed = time.monotonic() - startedAt
+    assert report['downloaded'] == len(tiles)
+    assert report['failed'] == 0
+    assert parent.reports == [report]
+    for zoom, x, y in tiles:
+        assert tile_cache.get_tile(zoom, x, (2 ** zoom) - y - 1) == b"\x89PNG\r\n\x1a\n" + f"/{zoom}/{x}/{y}.png".encode("ascii")
+    assert tile_cache.execute("SELECT count(1), sum(pinned) FROM tiles") == [(len(tiles), len(tiles))]
+    assert report['bytes'] == tile_cache.stats()['bytes']
+
+    # At most requestsPerSecond requests in any second, also with several workers.
+    interval = 1 / TilePrefetcher.requestsPerSecond
+    assert elapsed >= (len(tiles) - 1) * interval * 0.95
+    requestTimes = sorted(requestTime for requestTime, _ in tile_server.requests)
+    window = TilePrefetcher.requestsPerSecond
+    for idx in range(window, len(requestTimes)):
+        assert requestTimes[idx] - requestTimes[idx-window] >= 1 - 0.05
+
+
+def test_cancelled_tiles_are_not_failures(tile_server, tile_cache, tile_fetcher, capsys):
+    tile_server.latency = 0.05
+    parent = Parent()
+    prefetcher = TilePrefetcher(parent)
+    mapSource = map_source(tile_cache, tile_fetcher, tile_server)
+    tiles, _ = prefetcher.plan(mapSource, [BBOX])
+    tiles = tiles[:20]
+    prefetcher.running = True
+    job = threading.Thread(target=prefetcher.run, args=(mapSource, tiles))
+    job.start()
+    wait_for_requests(tile_server, 3)
+    prefetcher.cancel()
+    job.join(timeout=10)
+    report = parent.reports[0]
+    assert report['failed'] == 0
+    assert report['cancelled'] > 0
+    assert report['downloaded'] + report['cancelled'] == len(tiles)
+    assert "Error downloading" not in capsys.readouterr().out
+
+
+def wait_for_requests(server, count, timeout=5):
+    deadline = time.monotonic() + timeout
+    while len(server.requests) < count and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert len(server.requests) >= count
+
+
+def test_fetcher_serves_the_map_before_prefetching(tile_server, tile_fetcher):
+    tile_server.latency = 0.3
+    # Keep all workers busy, so the next requests queue up.
+    blockers = [tile_fetcher.fetch(f"{tile_server.url}/busy/{idx}.png", TileFetcher.PRIORITY_PREFETCH) for idx in range(TileFetcher.workers)]
+    wait_for_requests(tile_server, TileFetcher.workers)
+    prefetches = [tile_fetcher.fetch(f"{tile_server.url}/prefetch/{idx}.png", TileFetcher.PRIORITY_PREFETCH) for idx in range(TileFetcher.workers)]
+    views = [tile_fetcher.fetch(f"{tile_server.url}/view/{idx}.png", TileFetcher.PRIORITY_VIEW) for idx in range(TileFetcher.workers)]
+    for future in blockers + prefetches + views:
+        future.result(timeout=10)
+    paths = [path for _, path in tile_server.requests[TileFetcher.workers:]]
+    assert all(path.startswith("/view/") for path in paths[:TileFetcher.workers]), paths
+    assert all(path.startswith("/prefetch/") for path in paths[TileFetcher.workers:]), paths
+    assert views[0].result() == b"\x89PNG\r\n\x1a\n/view/0.png"
+
+
+def test_fetcher_drops_tiles_that_left_the_map(tile_server, tile_fetcher):
+    tile_server.latency = 0.3
+    blockers = [tile_fetcher.fetch(f"{tile_server.url}/busy/{idx}.png", TileFetcher.PRIORITY_PREFETCH) for idx in range(TileFetcher.workers)]
+    wait_for_requests(tile_server, TileFetcher.workers)
+    shown = {idx: True for idx in range(8)}
+    futures = [tile_fetcher.fetch(f"{tile_server.url}/view/{idx}.png", TileFetcher.PRIORITY_VIEW, lambda idx=idx: not shown[idx]) for idx in range(8)]
+    for idx in range(0, 8, 2):
+        shown[idx] = False # Panned away before the download started.
+    for future in blockers:
+        future.result(timeout=10)
+    for idx, future in enumerate(futures):
+        if idx % 2 == 0:
+            with pytest.raises(Exception):
+                future.result(timeout=10)
+            assert future.cancelled()
+        else:
+            assert future.result(timeout=10) == b"\x89PNG\r\n\x1a\n" + f"/view/{idx}.png".encode("ascii")
+    paths = [path for _, path in tile_server.requests]
+    assert not any(path in paths for path in [f"/view/{idx}.png" for idx in range(0, 8, 2)])
+    assert tile_fetcher.stats()['cancelled'] == 4
+
+
+def test_fetcher_records_the_viewport_load_time(tile_server, tile_fetcher):
+    tile_server.latency = 0.2
+    futures = [tile_fetcher.fetch(f"{tile_server.url}/view/{idx}.png", TileFetcher.PRIORITY_VIEW) for idx in range(TileFetcher.workers * 2)]
+    for future in futures:
+        future.result(timeout=10)
+    deadline = time.monotonic() + 5
+    while tile_fetcher.stats()['viewport_loads'] == 0 and time.monotonic() < deadline:
+        time.sleep(0.005) # The metric is recorded right after the last result is set.
+    stats = tile_fetcher.stats()
+    assert stats['viewport_loads'] == 1
+    assert stats['viewport_last_ms'] >= 2 * 200 * 0.95 # Two rounds of requests over all workers.
+    assert stats['downloaded'] == len(futures)
+    assert stats['pending'] == 0
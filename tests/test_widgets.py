@@ -0,0 +1,79 @@
+'''
+Gauge cluster against the formulas of the separate gauge widgets it replaced.
+'''
+import os
+
+import pytest
+
+pytest.importorskip("kivy")
+pytest.importorskip("kivy_garden.graph")
+
+from widgets import GaugeCluster
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+UNIT = 1.8
+VALUES = [
+    (0, 0, 0, 0, 0),
+    (1, 1, 1, 1, 1),
+    (120, 80, 36, -2, 270),
+    (2500.5, 120.25, -12.5, 3.75, 359),
+    (99000, 8000, 400, 14, 400),
+    (-1, -5, -400, -14, 0),
+    (99001, 8001, 401, 14.5, 401), # Out of range, the needles show 0.
+    (150, 9000, -500, -20, 90)
+]
+
+
+def bounded(value, low, high):
+    # BoundedNumericProperty(errorvalue=0) of the old widgets.
+    return value if low <= value <= high else 0
+
+
+def old_angles(distance, altitude, hSpeed, vSpeed, heading):
+    '''
+    Needle rotations of DistGauge, AltGauge, HGauge, VGauge and HeadingGauge.
+    '''
+    distance = bounded(distance, 0, 99000)
+    altitude = bounded(altitude, 0, 8000)
+    hSpeed = bounded(hSpeed, -400, 400)
+    vSpeed = bounded(vSpeed, -14, 14)
+    heading = bounded(heading, 0, 400)
+    return {
+        'distance_short': ((1 * UNIT) - (distance * UNIT * 2)/10),
+        'distance_long': (1 * UNIT) - (distance * UNIT * 2),
+        'altitude_short': ((1 * UNIT) - (altitude * UNIT * 2)/10),
+        'altitude_long': (1 * UNIT) - (altitude * UNIT * 2),
+        'hspeed': (100 * UNIT) - (hSpeed * UNIT * 4),
+        'vspeed': -(vSpeed * UNIT * 5.5),
+        'heading': (1 * UNIT) - (heading * 1)
+    }
+
+
+@pytest.mark.parametrize("values", VALUES)
+def test_needle_angles_match_old_gauges(values):
+    assert GaugeCluster.needle_angles(GaugeCluster.limit(values)) == old_angles(*values)
+
+
+@pytest.fixture
+def cluster(monkeypatch):
+    window = pytest.importorskip("kivy.core.window").Window
+    if window is None:
+        pytest.skip("no window to draw in")
+    monkeypatch.chdir(SRC_DIR) # The dial images are loaded from assets/.
+    return GaugeCluster(pos=(0, 0), size=(100, 500))
+
+
+def test_set_values_keeps_the_canvas(cluster):
+    instructions = len(cluster.canvas.children)
+    assert cluster.stats()['draw_calls'] == 15
+    cluster.set_units("km/h", "m")
+    for values in VALUES:
+        cluster.set_values(*values)
+        assert len(cluster.canvas.children) == instructions
+        assert cluster.stats()['draw_calls'] == 15
+        assert {name: rotate.angle for name, (rotate, _) in cluster.needles.items()} == pytest.approx(old_angles(*values))
+
+    # The same values again change nothing.
+    updates = cluster.stats()['updates']
+    cluster.set_values(*VALUES[-1])
+    assert cluster.stats()['updates'] == updates